@@ -20,6 +20,8 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
 from django.template.defaultfilters import filesizeformat
 
 from Artifactorial.models import AuthToken, Artifact, Directory, Share
@@ -31,32 +33,62 @@ class AuthTokenAdmin(admin.ModelAdmin):
     list_display = ('user', 'description')
 
 
+class DirectoryListFilter(admin.SimpleListFilter):
+    """
+    Like list_filter = ('directory', ) without one query per directory
+    """
+    title = "directory"
+    parameter_name = "directory__id__exact"
+
+    def lookups(self, request, model_admin):
+        return Directory.objects.order_by("path").values_list("id", "path")
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(directory__id=self.value())
+        return queryset
+
+
 class ArtifactAdmin(admin.ModelAdmin):
     def ttl(self, obj):
         return obj.created_at + datetime.timedelta(days=obj.directory.ttl)
 
     def size(self, obj):
-        return filesizeformat(obj.path.size)
+        return filesizeformat(obj.size)
+    size.admin_order_field = 'size'
 
     def full_path(self, obj):
         return "/" + obj.path.name
+    full_path.admin_order_field = 'path'
 
     list_display = ('full_path', 'size', 'directory', 'is_permanent', 'created_at', 'ttl')
-    list_filter = ('directory', )
+    list_filter = (DirectoryListFilter, 'is_permanent')
+    list_select_related = ('directory', 'directory__user', 'directory__group')
+    date_hierarchy = 'created_at'
+    search_fields = ('^path', )
+    # Counting every artifact is slow on large tables
+    show_full_result_count = False
 
     def get_readonly_fields(self, request, obj=None):
         if obj: # editing an existing object
-            return ('directory', )
-        return ()
+            return ('directory', 'size')
+        return ('size', )
 
 
 class DirectoryAdmin(admin.ModelAdmin):
     def current_size(self, obj):
-        return "%s / %s" % (filesizeformat(obj.size()),
+        return "%s / %s" % (filesizeformat(obj.total_size),
                             filesizeformat(obj.quota))
+    current_size.admin_order_field = 'total_size'
+
+    def get_queryset(self, request):
+        query = super(DirectoryAdmin, self).get_queryset(request)
+        return query.annotate(total_size=Coalesce(Sum('artifact__size'), 0))
 
     list_display = ('path', 'user', 'group', 'is_public', 'ttl',
                     'current_size')
+    list_select_related = ('user', 'group')
+    search_fields = ('^path', )
 
 
 class ShareAdmin(admin.ModelAdmin):
@@ -64,6 +96,7 @@ class ShareAdmin(admin.ModelAdmin):
         return "/" + obj.artifact.path.name
 
     list_display = ('artifact_name', 'token')
+    list_select_related = ('artifact', )
     ordering = ('artifact__path', 'token')
 
 
@@ -20,6 +20,13 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def repair_search_index(sender, using, **kwargs):
+    from Artifactorial import search
+    search.repair(connections[using])
 
 
 class ArtifactorialConfig(AppConfig):
@@ -28,3 +35,4 @@ class ArtifactorialConfig(AppConfig):
 
     def ready(self):
         import Artifactorial.signals
+        post_migrate.connect(repair_search_index, sender=self)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+
+from __future__ import unicode_literals
+
+from django.db import transaction
+
+import struct
+import tarfile
+import zipfile
+import zlib
+
+
+COMPRESSED_TAR_EXTENSIONS = (".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+CHUNK_SIZE = 64 * 1024
+
+# Zip compression methods
+STORED = 0
+DEFLATED = 8
+
+ZIP_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+ZIP_LOCAL_SIGNATURE = b"PK\003\004"
+
+
+# Value of Artifact.archive when the archive can not be read
+BAD = "bad"
+
+
+def get_format(name):
+    """
+    Return "tar" or "zip" for the archives that can be seeked, "stream"
+    for the compressed tar archives and None for the other files
+    """
+    name = name.lower()
+    if name.endswith(COMPRESSED_TAR_EXTENSIONS):
+        return "stream"
+    elif name.endswith(".tar"):
+        return "tar"
+    elif name.endswith(".zip"):
+        return "zip"
+    return None
+
+
+def normalize(name):
+    while name.startswith("./"):
+        name = name[2:]
+    return name.lstrip("/")
+
+
+def read_tar(f_in):
+    """
+    Yield (name, offset, size, compressed_size, compression) for the
+    regular files of an uncompressed tar archive
+    """
+    with tarfile.open(fileobj=f_in, mode="r:") as tar:
+        for member in tar:
+            if member.isreg() and not member.issparse():
+                yield (normalize(member.name), member.offset_data,
+                       member.size, member.size, STORED)
+
+
+def read_zip(f_in):
+    """
+    Yield (name, offset, size, compressed_size, compression) for the files
+    of a zip archive. The offset of the data is found in the local header.
+    """
+    with zipfile.ZipFile(f_in) as archive:
+        for info in archive.infolist():
+            # Skip the directories and the encrypted files
+            if info.filename.endswith("/") or info.flag_bits & 0x1:
+                continue
+            f_in.seek(info.header_offset)
+            header = f_in.read(ZIP_LOCAL_HEADER.size)
+            if len(header) != ZIP_LOCAL_HEADER.size or \
+               not header.startswith(ZIP_LOCAL_SIGNATURE):
+                raise zipfile.BadZipfile("Invalid local header")
+            header = ZIP_LOCAL_HEADER.unpack(header)
+            yield (normalize(info.filename),
+                   info.header_offset + ZIP_LOCAL_HEADER.size + header[10] + header[11],
+                   info.file_size, info.compress_size, info.compress_type)
+
+
+def read_stream(f_in):
+    """
+    Yield (name, None, size, size, compression) for the regular files of a
+    compressed tar archive: the data can not be seeked, so no offset
+    """
+    with tarfile.open(fileobj=f_in, mode="r|*") as tar:
+        for member in tar:
+            if member.isreg():
+                yield (normalize(member.name), None, member.size, member.size, STORED)
+
+
+READERS = {"tar": read_tar, "zip": read_zip, "stream": read_stream}
+
+
+def build_index(artifact, batch_size=1000, stream=False):
+    """
+    Store the members of a tar or zip artifact. The compressed tar archives
+    are decompressed entirely, so they are only indexed when *stream* is set.
+    A corrupted archive is marked as BAD to not parse it again.
+    Return False when the artifact is not a valid archive.
+    """
+    from Artifactorial.models import ArchiveMember, Artifact
+
+    fmt = get_format(artifact.path.name)
+    if fmt is None or (fmt == "stream" and not stream):
+        return False
+    try:
+        f_in = open(artifact.path.path, "rb")
+    except (IOError, OSError):
+        return False
+    with f_in:
+        try:
+            # Longer names are not indexed
+            members = [ArchiveMember(artifact=artifact, name=name, offset=offset,
+                                     size=size, compressed_size=compressed_size,
+                                     compression=compression)
+                       for (name, offset, size, compressed_size, compression)
+                       in READERS[fmt](f_in) if name and len(name) <= 255]
+        except (EOFError, IOError, OSError, tarfile.TarError, zipfile.BadZipfile, zlib.error):
+            (fmt, members) = (BAD, [])
+
+    with transaction.atomic():
+        # Another request might have built the index meanwhile
+        if Artifact.objects.filter(pk=artifact.pk, archive="").update(archive=fmt):
+            ArchiveMember.objects.bulk_create(members, batch_size=batch_size)
+    artifact.archive = fmt
+    return fmt != BAD
+
+
+class _Slice(object):
+    """
+    Part of a file. No fileno(): sendfile() would send the rest of the file.
+    """
+    def __init__(self, fileobj, offset, size):
+        self.fileobj = fileobj
+        self.fileobj.seek(offset)
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+class _Inflate(object):
+    """
+    Decompress a deflate stream, a bounded amount at a time
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            data = self.decompressor.unconsumed_tail
+            if not data:
+                data = self.fileobj.read(CHUNK_SIZE)
+                if not data:
+                    break
+            data = self.decompressor.decompress(data, max(size, 0))
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(chunks)
+
+    def close(self):
+        self.fileobj.close()
+
+
+class _Member(object):
+    """
+    File object extracted from an archive, closing the archive when done
+    """
+    def __init__(self, fileobj, closing):
+        self.fileobj = fileobj
+        self.closing = closing
+
+    def read(self, size=-1):
+        return self.fileobj.read(size)
+
+    def close(self):
+        self.fileobj.close()
+        for obj in self.closing:
+            obj.close()
+
+
+def _open_indexed(artifact, member):
+    f_in = open(artifact.path.path, "rb")
+    try:
+        if member.compression == STORED:
+            return _Slice(f_in, member.offset, member.size)
+        elif member.compression == DEFLATED:
+            return _Inflate(_Slice(f_in, member.offset, member.compressed_size))
+        # Let zipfile handle the other compression methods
+        archive = zipfile.ZipFile(f_in)
+        for info in archive.infolist():
+            if normalize(info.filename) == member.name:
+                return _Member(archive.open(info), [archive, f_in])
+        raise KeyError(member.name)
+    except BaseException:
+        f_in.close()
+        raise
+
+
+def _open_stream(artifact, name):
+    f_in = open(artifact.path.path, "rb")
+    try:
+        tar = tarfile.open(fileobj=f_in, mode="r|*")
+        for member in tar:
+            if member.isreg() and normalize(member.name) == name:
+                return (_Member(tar.extractfile(member), [tar, f_in]), member.size)
+        raise KeyError(name)
+    except BaseException:
+        f_in.close()
+        raise
+
+
+def open_member(artifact, name):
+    """
+    Return a file object and the size of the member. The uncompressed tar
+    and zip archives are indexed on first use, the compressed tar archives
+    are read until the member (once listed, the index tells whether the
+    member exists).
+    Raise KeyError when the member is not found.
+    """
+    from Artifactorial.models import ArchiveMember
+
+    fmt = get_format(artifact.path.name)
+    if fmt is None:
+        raise KeyError(name)
+    if not artifact.archive:
+        build_index(artifact)
+    if artifact.archive == BAD:
+        raise KeyError(name)
+    try:
+        if artifact.archive:
+            # The last one wins when a name is present twice in a tar
+            member = ArchiveMember.objects.filter(artifact=artifact, name=name) \
+                                          .order_by("-offset").first()
+            if member is None:
+                raise KeyError(name)
+            if member.offset is not None:
+                return (_open_indexed(artifact, member), member.size)
+        return _open_stream(artifact, name)
+    except (EOFError, tarfile.TarError, zipfile.BadZipfile, zlib.error):
+        raise KeyError(name)
+
+
+def members(artifact):
+    """
+    Return the sorted list of (name, size) of the files in the archive.
+    Every archive (even the compressed tar) is indexed on first use.
+    """
+    from Artifactorial.models import ArchiveMember
+
+    if get_format(artifact.path.name) is None:
+        return []
+    if not artifact.archive:
+        build_index(artifact, stream=True)
+    if artifact.archive in ["", BAD]:
+        return []
+    query = ArchiveMember.objects.filter(artifact=artifact).order_by("offset", "id")
+    return sorted(dict(query.values_list("name", "size")).items())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Cache of the rendered directory listings.
+
+Each directory has a generation counter that is bumped every time one of its
+artifacts is saved or deleted. A global generation is bumped when a
+directory is saved or deleted. The cache key of a listing is built from these
+generations so stale entries are never returned and expire by themselves.
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+import hashlib
+import os
+import time
+
+
+PREFIX = "artifactorial:listing"
+
+
+def _cache():
+    return caches[getattr(settings, "ARTIFACTORIAL_LISTING_CACHE", "default")]
+
+
+def _timeout():
+    # Disabled by default: the cache should be shared by every process
+    return getattr(settings, "ARTIFACTORIAL_LISTING_CACHE_TIMEOUT", 0)
+
+
+def _generation_key(name):
+    return "%s:generation:%s" % (PREFIX, name)
+
+
+def _initial_generation():
+    # A generation evicted from the cache should not come back to a value
+    # already used in a key
+    return int(time.time() * 1000000)
+
+
+def invalidate(directory_id=None):
+    """
+    Invalidate the listings that include the given directory or every
+    listing when directory_id is None.
+    """
+    key = _generation_key("all" if directory_id is None else directory_id)
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_generation(), None)
+
+
+def _generations(names):
+    cache = _cache()
+    keys = [_generation_key(name) for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, _initial_generation(), None)
+            values[key] = cache.get(key)
+    return [values[key] for key in keys]
+
+
+def _directories(dirname, generation):
+    """
+    Return the directories that can contain the artifacts listed under
+    dirname: the sub-directories and the parent directories.
+    """
+    from Artifactorial.models import Directory
+
+    cache = _cache()
+    key = "%s:directories:%d:%s" % (PREFIX, generation,
+                                    hashlib.sha1(dirname.encode("utf-8")).hexdigest())
+    directories = cache.get(key)
+    if directories is None:
+        ancestors = ["/"]
+        parts = dirname.strip("/").split("/")
+        for index in range(len(parts)):
+            ancestors.append("/" + "/".join(parts[:index + 1]))
+        query = Directory.objects.filter(Q(path__startswith=dirname) | Q(path__in=ancestors))
+        directories = list(query.values_list("id", "is_public", "user_id", "group_id"))
+        cache.set(key, directories, _timeout())
+    return [Directory(id=i, is_public=p, user_id=u, group_id=g)
+            for (i, p, u, g) in directories]
+
+
+def key(request, user, filename, formating):
+    """
+    Return the cache key of the listing or None if the cache is disabled.
+    Users that can see the same directories share the same entries.
+    """
+    if not _timeout():
+        return None
+    (generation,) = _generations(["all"])
+    visible = [d.id for d in _directories(os.path.dirname(filename), generation)
+               if d.is_visible_to(user)]
+    parts = [filename, formating, generation,
+             list(zip(visible, _generations(visible))),
+             # Filtering and sorting parameters
+             sorted([(k, v) for (k, v) in request.GET.items() if k != "token"])]
+    # The html pages include the user name and the token
+    if formating == "html":
+        parts.extend([request.user.pk, request.GET.get("token", None)])
+    return "%s:%s" % (PREFIX, hashlib.sha1(repr(parts).encode("utf-8")).hexdigest())
+
+
+def load(key):
+    return _cache().get(key)
+
+
+def store(key, content):
+    _cache().set(key, content, _timeout())
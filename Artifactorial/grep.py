@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+
+"""
+Search the lines matching a pattern in the artifacts.
+
+The user supplied regular expressions can backtrack for ages and the re
+module cannot be interrupted: the files are searched by worker processes
+that are killed when the deadline is reached.
+"""
+
+from __future__ import unicode_literals
+
+from collections import deque
+import multiprocessing
+import re
+import time
+
+
+# Size of the reads
+CHUNK_SIZE = 1024 * 1024
+# Longer lines are split
+MAX_LINE_SIZE = 4 * CHUNK_SIZE
+# Truncate the lines sent back
+MAX_OUTPUT_SIZE = 4096
+
+
+class Search(object):
+    """
+    Parameters and results of a grep request
+    """
+    def __init__(self, pattern, flags=0, context=0, limit=1000, timeout=30, buckets=()):
+        self.pattern = pattern
+        self.flags = flags
+        self.context = context
+        self.limit = limit
+        self.deadline = time.time() + timeout
+        self.buckets = list(buckets)
+        self.matches = 0
+        self.limited = False
+        self.timed_out = False
+
+
+class FileSearch(object):
+    """
+    Search in one file, in a worker process
+    """
+    def __init__(self, regex, context=0, limit=1000, deadline=None, buckets=()):
+        self.regex = regex
+        self.context = context
+        self.limit = limit
+        self.deadline = deadline
+        self.buckets = buckets
+        self.matches = 0
+
+    def match(self):
+        """
+        Count one match, return False when the limit is reached
+        """
+        if self.matches >= self.limit:
+            return False
+        self.matches += 1
+        return True
+
+    def is_over(self):
+        return self.deadline is not None and time.time() > self.deadline
+
+    def consume(self, amount):
+        # Bandwidth caps of the request
+        for bucket in self.buckets:
+            delay = bucket.consume(amount)
+            if delay:
+                time.sleep(delay)
+
+
+def chunks(f_in):
+    """
+    Yield the content of the file by chunks of complete lines (without the
+    last newline)
+    """
+    rest = b""
+    while True:
+        data = f_in.read(CHUNK_SIZE)
+        if not data:
+            if rest:
+                yield rest
+            return
+        data = rest + data
+        cut = data.rfind(b"\n")
+        if cut == -1:
+            if len(data) < MAX_LINE_SIZE:
+                rest = data
+                continue
+            # Split the line
+            (data, rest) = (data, b"")
+        else:
+            (data, rest) = (data[:cut], data[cut + 1:])
+        yield data
+
+
+def grep_file(search, filename, emit):
+    """
+    Call emit(lineno, line, is_match) for every matching line and its
+    context, and emit(None, None, False) between non contiguous groups.
+    Only the chunks with matches are split into lines.
+    """
+    context = search.context
+    before = deque(maxlen=context or None)
+    after = 0
+    printed = 0
+    lineno = 0
+    with open(filename, "rb") as f_in:
+        for (index, chunk) in enumerate(chunks(f_in)):
+            if search.is_over():
+                return
+            search.consume(len(chunk) + 1)
+            # Skip binary files
+            if index == 0 and b"\0" in chunk[:8192]:
+                return
+            if search.regex.search(chunk) is None:
+                count = chunk.count(b"\n") + 1
+                if after:
+                    for line in chunk.split(b"\n", after)[:after]:
+                        lineno += 1
+                        count -= 1
+                        emit(lineno, line, False)
+                        printed = lineno
+                        after -= 1
+                if context and count:
+                    tail = chunk.rsplit(b"\n", context)[-min(count, context):]
+                    before.extend([(lineno + count - len(tail) + i + 1, line)
+                                   for (i, line) in enumerate(tail)])
+                lineno += count
+                continue
+
+            for line in chunk.split(b"\n"):
+                lineno += 1
+                if search.regex.search(line) is not None:
+                    if not search.match():
+                        return
+                    lines = [(n, l) for (n, l) in before if n > printed]
+                    first = lines[0][0] if lines else lineno
+                    if context and printed and first > printed + 1:
+                        emit(None, None, False)
+                    for (n, l) in lines:
+                        emit(n, l, False)
+                    before.clear()
+                    emit(lineno, line, True)
+                    printed = lineno
+                    after = context
+                elif after:
+                    emit(lineno, line, False)
+                    printed = lineno
+                    after -= 1
+                elif context:
+                    before.append((lineno, line))
+
+
+def _worker(name, filename, pattern, flags, context, limit, deadline, buckets):
+    """
+    Return the (lineno, text, is_match) of the lines to print, lineno being
+    None for the separators
+    """
+    search = FileSearch(re.compile(pattern, flags), context, limit, deadline, buckets)
+    lines = []
+
+    def emit(lineno, line, is_match):
+        if lineno is None:
+            lines.append((None, "--\n", False))
+        else:
+            sep = ":" if is_match else "-"
+            line = line[:MAX_OUTPUT_SIZE].decode("utf-8", "replace")
+            lines.append((lineno, "%s%s%d%s%s\n" % (name, sep, lineno, sep, line), is_match))
+    try:
+        grep_file(search, filename, emit)
+    except (IOError, OSError):
+        lines.append((None, "# %s: unable to read the file\n" % name, False))
+    return lines
+
+
+def stream(search, files, workers=4):
+    """
+    Grep the files (a list of (name, filename)) in worker processes and
+    yield the lines in the order of the files, like "grep -n".
+    At most "workers" files are searched ahead of the output. When the
+    deadline or the match limit is reached, the workers are killed instead
+    of waiting for them.
+    """
+    files = list(files)
+    pool = multiprocessing.Pool(max(1, min(workers, len(files))))
+    pending = deque()
+    files = iter(files)
+    try:
+        while not search.limited:
+            for (name, filename) in files:
+                # One more match to know if the limit was reached
+                pending.append(pool.apply_async(_worker, (name, filename, search.pattern,
+                                                          search.flags, search.context,
+                                                          search.limit - search.matches + 1,
+                                                          search.deadline, search.buckets)))
+                if len(pending) >= workers:
+                    break
+            if not pending:
+                break
+            last = None
+            for (lineno, line, is_match) in pending.popleft().get(max(0, search.deadline - time.time())):
+                if is_match:
+                    if search.matches >= search.limit:
+                        search.limited = True
+                        break
+                    search.matches += 1
+                    last = lineno
+                elif search.matches >= search.limit:
+                    # Only the context following the last match
+                    if lineno is None or last is None or lineno > last + search.context:
+                        continue
+                yield line
+    except multiprocessing.TimeoutError:
+        search.timed_out = True
+    finally:
+        pool.terminate()
+
+    if search.timed_out:
+        yield "# timeout after %d matches\n" % search.matches
+    elif search.limited:
+        yield "# stopped after %d matches\n" % search.matches
@@ -21,10 +21,15 @@ from __future__ import unicode_literals
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from Artifactorial.models import Directory
+from django.utils import timezone
+from Artifactorial import metrics
+from Artifactorial.models import Change, Directory, DirectoryUsage
+from Artifactorial.storage import get_roots
 
+from datetime import timedelta
 import errno
 import os
+import time
 
 
 class Command(BaseCommand):
@@ -39,17 +44,31 @@ class Command(BaseCommand):
                             help="Override directory TTL")
 
     def handle(self, *args, **kwargs):
+        start = time.time()
         self.stdout.write("Removing old files in:\n")
         for directory in Directory.objects.all():
             self.stdout.write("* %s\n" % directory.path)
-            directory.clean_old_files(kwargs["purge"], kwargs["ttl"])
+            reclaimed = directory.clean_old_files(kwargs["purge"], kwargs["ttl"])
+            metrics.CLEAN_RECLAIMED_BYTES.inc(reclaimed)
+
+        # Store the usage after the cleanup
+        DirectoryUsage.snapshot()
+
+        # Prune the change log
+        retention = getattr(settings, "ARTIFACTORIAL_CHANGES_RETENTION", 30)
+        older_than = timezone.now() - timedelta(days=retention)
+        count = Change.prune(older_than)
+        self.stdout.write("Removing old changes: %d\n" % count)
 
         self.stdout.write("Removing empty directories:\n")
-        for root, _, _ in os.walk(settings.MEDIA_ROOT, topdown=False):
-            try:
-                os.rmdir(root)
-            except OSError as exc:
-                if exc.errno != errno.ENOTEMPTY:  # pragma: no cover
-                    self.stderr.write("Unable to remove %s: %s\n" % (root, exc))
-            else:
-                self.stdout.write("* %s\n" % root)
+        for location in sorted(get_roots().values()):
+            for root, _, _ in os.walk(location, topdown=False):
+                try:
+                    os.rmdir(root)
+                except OSError as exc:
+                    if exc.errno != errno.ENOTEMPTY:  # pragma: no cover
+                        self.stderr.write("Unable to remove %s: %s\n" % (root, exc))
+                else:
+                    self.stdout.write("* %s\n" % root)
+
+        metrics.CLEAN_DURATION.observe(time.time() - start)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from Artifactorial import cache
+from Artifactorial.models import Artifact, Directory
+
+import bisect
+from datetime import timedelta
+import errno
+import os
+import random
+
+
+EXTENSIONS = [".log", ".txt", ".tar.gz", ".img", ".dtb", ".xml", ".json"]
+
+
+def size_distribution(value):
+    """
+    Parse the size distribution:
+    * fixed:SIZE
+    * uniform:MIN,MAX
+    * lognormal:MU,SIGMA (sizes around exp(MU))
+    """
+    try:
+        (kind, params) = value.split(":", 1)
+        params = [float(p) for p in params.split(",")]
+        if kind == "fixed" and len(params) == 1:
+            return lambda rnd: int(params[0])
+        elif kind == "uniform" and len(params) == 2:
+            return lambda rnd: int(rnd.uniform(params[0], params[1]))
+        elif kind == "lognormal" and len(params) == 2:
+            return lambda rnd: int(rnd.lognormvariate(params[0], params[1]))
+    except ValueError:
+        pass
+    raise CommandError("Invalid size distribution '%s'" % value)
+
+
+class Command(BaseCommand):
+    args = None
+    help = 'Generate a synthetic dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", default=0, type=int,
+                            help="Seed of the random generator")
+        parser.add_argument("--prefix", default="/populate",
+                            help="Create the directories under this path")
+        parser.add_argument("--users", default=100, type=int,
+                            help="Number of users")
+        parser.add_argument("--groups", default=10, type=int,
+                            help="Number of groups")
+        parser.add_argument("--directories", default=1000, type=int,
+                            help="Number of directories")
+        parser.add_argument("--artifacts", default=100000, type=int,
+                            help="Number of artifacts")
+        parser.add_argument("--files", default="none",
+                            choices=["none", "sparse"],
+                            help="Create sparse files or only the database rows")
+        parser.add_argument("--sizes", default="lognormal:10,2",
+                            help="Size distribution (fixed:SIZE, uniform:MIN,MAX or lognormal:MU,SIGMA)")
+        parser.add_argument("--max-age", default=90, type=int,
+                            help="Spread the upload dates over this number of days")
+        parser.add_argument("--permanent", default=0.1, type=float,
+                            help="Ratio of permanent artifacts")
+        parser.add_argument("--batch-size", default=5000, type=int,
+                            help="Number of rows inserted at once")
+
+    def handle(self, *args, **kwargs):
+        rnd = random.Random(kwargs["seed"])
+        kwargs["sizes"] = size_distribution(kwargs["sizes"])
+        prefix = kwargs["prefix"].rstrip("/")
+        if Directory.objects.filter(path__startswith=prefix + "/").exists():
+            raise CommandError("%s is not empty" % prefix)
+
+        with transaction.atomic():
+            self.stdout.write("Creating users and groups")
+            (users, groups) = self.create_users(rnd, prefix, kwargs["users"], kwargs["groups"])
+            self.stdout.write("Creating directories")
+            directories = self.create_directories(rnd, prefix, kwargs["directories"],
+                                                  users, groups)
+        self.stdout.write("Creating artifacts")
+        self.create_artifacts(rnd, directories, kwargs)
+        # bulk_create does not send the signals
+        cache.invalidate()
+
+    def create_users(self, rnd, prefix, nb_users, nb_groups):
+        name = prefix.strip("/").replace("/", "-")
+        Group.objects.bulk_create([Group(name="%s-group-%d" % (name, i))
+                                   for i in range(nb_groups)])
+        User.objects.bulk_create([User(username="%s-user-%d" % (name, i),
+                                       password="!")
+                                  for i in range(nb_users)])
+        groups = list(Group.objects.filter(name__startswith="%s-group-" % name).order_by("id"))
+        users = list(User.objects.filter(username__startswith="%s-user-" % name).order_by("id"))
+
+        # Each user is a member of 0 to 3 groups
+        Membership = User.groups.through
+        memberships = set()
+        for user in users:
+            for group in rnd.sample(groups, rnd.randint(0, min(3, len(groups)))):
+                memberships.add((user.id, group.id))
+        Membership.objects.bulk_create([Membership(user_id=u, group_id=g)
+                                        for (u, g) in sorted(memberships)])
+        return (users, groups)
+
+    def create_directories(self, rnd, prefix, count, users, groups):
+        directories = []
+        for index in range(count):
+            owner = rnd.choice(["user"] * 5 + ["group"] * 3 + ["anonymous"] * 2)
+            directory = Directory(path="%s/%s/%05d" % (prefix, owner, index),
+                                  is_public=rnd.random() < 0.3,
+                                  ttl=rnd.choice([7, 30, 90, 365]),
+                                  quota=rnd.choice([1, 10, 100, 1000]) * 1024 ** 3)
+            if owner == "user" and users:
+                directory.user = rnd.choice(users)
+            elif owner == "group" and groups:
+                directory.group = rnd.choice(groups)
+            directories.append(directory)
+        Directory.objects.bulk_create(directories)
+        return list(Directory.objects.filter(path__startswith=prefix + "/").order_by("path"))
+
+    def create_artifacts(self, rnd, directories, options):
+        now = timezone.now()
+        batch = []
+        # Some directories are much more used than others
+        weights = [rnd.paretovariate(1) for _ in directories]
+        total = sum(weights)
+        cumulated = []
+        for weight in weights:
+            cumulated.append((cumulated[-1] if cumulated else 0) + weight / total)
+
+        for index in range(options["artifacts"]):
+            directory = directories[min(len(directories) - 1,
+                                        bisect.bisect_left(cumulated, rnd.random()))]
+            created_at = now - timedelta(seconds=rnd.randint(0, options["max_age"] * 86400))
+            is_permanent = rnd.random() < options["permanent"]
+            filename = "artifact-%08d%s" % (index, rnd.choice(EXTENSIONS))
+            # Same layout as get_path_name (in local time)
+            if is_permanent:
+                path = "%s/%s" % (directory.path, filename)
+            else:
+                path = "%s/%s/%s" % (directory.path,
+                                     timezone.localtime(created_at).strftime("%Y/%m/%d/%H/%M"),
+                                     filename)
+            path = path.lstrip("/")
+            size = options["sizes"](rnd)
+            if options["files"] == "sparse":
+                self.create_file(path, size)
+            batch.append((Artifact(path=path, directory=directory,
+                                   is_permanent=is_permanent, size=size),
+                          created_at))
+            if len(batch) >= options["batch_size"]:
+                self.insert(batch)
+                batch = []
+                self.stdout.write("* %d artifacts" % (index + 1))
+        self.insert(batch)
+
+    def insert(self, batch):
+        """
+        Insert the (artifact, created_at) rows. bulk_create always sets
+        created_at (auto_now_add), so the generated dates are stored
+        afterwards.
+        """
+        if not batch:
+            return
+        with transaction.atomic():
+            last = Artifact.objects.aggregate(last=Max("id"))["last"] or 0
+            Artifact.objects.bulk_create([artifact for (artifact, _) in batch])
+            ids = dict(Artifact.objects.filter(id__gt=last).values_list("path", "id"))
+            for (artifact, created_at) in batch:
+                artifact.pk = ids[artifact.path.name]
+                artifact.created_at = created_at
+            Artifact.objects.bulk_update([artifact for (artifact, _) in batch],
+                                         ["created_at"])
+
+    def create_file(self, path, size):
+        filename = Artifact._meta.get_field("path").storage.path(path)
+        try:
+            f_out = open(filename, "wb")
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:  # pragma: no cover
+                raise
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError as exc:  # pragma: no cover
+                if exc.errno != errno.EEXIST:
+                    raise
+            f_out = open(filename, "wb")
+        with f_out:
+            f_out.truncate(size)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from Artifactorial.models import Artifact
+from Artifactorial.storage import choose_root, get_roots, move_to_root
+
+
+class Command(BaseCommand):
+    args = None
+    help = 'Move the artifacts between the storage roots'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="source", default=None,
+                            help="Move the artifacts out of this root (according to the placement policy)")
+        parser.add_argument("--bytes", default=None, type=int,
+                            help="Stop after moving this number of bytes")
+        parser.add_argument("--batch-size", default=100, type=int,
+                            help="Number of artifacts loaded at once")
+        parser.add_argument("--dry-run", default=False, action="store_true",
+                            help="Only count the artifacts to move")
+
+    def handle(self, *args, **kwargs):
+        roots = get_roots()
+        source = kwargs["source"]
+        if source is not None and source not in roots:
+            raise CommandError("Unknown storage root '%s'" % source)
+        self.stats = {"moved": 0, "moved_bytes": 0, "errors": 0}
+
+        # Tiered artifacts stay in the cold root
+        query = Artifact.objects.exclude(root=getattr(settings, "ARTIFACTORIAL_COLD_ROOT", "cold")) \
+                                .filter(is_missing=False) \
+                                .select_related("directory") \
+                                .only("id", "path", "root", "md5", "size",
+                                      "directory__id", "directory__root") \
+                                .order_by("id")
+        if source is None:
+            # Move the artifacts of the pinned directories to their root
+            query = query.exclude(directory__root="").exclude(root=F("directory__root"))
+        else:
+            query = query.filter(root=source).exclude(directory__root=source)
+
+        exclude = [source] if source is not None else []
+        last = 0
+        done = False
+        while not done:
+            artifacts = list(query.filter(id__gt=last)[:kwargs["batch_size"]])
+            done = len(artifacts) < kwargs["batch_size"]
+            for artifact in artifacts:
+                if kwargs["bytes"] is not None and self.stats["moved_bytes"] >= kwargs["bytes"]:
+                    done = True
+                    break
+                last = artifact.id
+                self.move(artifact, choose_root(artifact.directory, exclude), kwargs["dry_run"])
+
+        self.stdout.write("Moved: %d (%d bytes)" % (self.stats["moved"], self.stats["moved_bytes"]))
+        if self.stats["errors"]:
+            raise CommandError("Unable to move %d artifacts" % self.stats["errors"])
+
+    def move(self, artifact, root, dry_run):
+        if root == artifact.root:
+            return
+        try:
+            if not dry_run and not move_to_root(artifact, root):
+                return
+        except (IOError, OSError) as exc:
+            self.stats["errors"] += 1
+            self.stderr.write("Unable to move %s: %s" % (artifact.path.name, exc))
+            return
+        self.stats["moved"] += 1
+        self.stats["moved_bytes"] += artifact.size
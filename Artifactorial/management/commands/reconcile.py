@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Artifactorial.models import Artifact
+from Artifactorial.storage import get_layout, get_roots, get_storage, previous_layouts
+
+import heapq
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import tempfile
+import time
+
+try:
+    from os import scandir
+except ImportError:  # pragma: no cover
+    from scandir import scandir
+
+
+def list_directory(path):
+    """
+    Return the entries of the directory sorted like the full paths would be:
+    sub-directories are sorted with a trailing '/'.
+    """
+    entries = []
+    try:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                entries.append((entry.name + "/", None, None))
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                entries.append((entry.name, stat.st_size, stat.st_mtime))
+    except OSError:  # pragma: no cover
+        # Removed during the scan or not readable
+        return []
+    entries.sort()
+    return entries
+
+
+def walk(pool, root, relative="", result=None):
+    """
+    Yield (path, size, mtime) for every file under root, sorted by path.
+    The sub-directories are listed in advance by the thread pool.
+    """
+    if result is None:
+        result = pool.apply_async(list_directory, (os.path.join(root, relative),))
+    entries = result.get()
+    children = dict([(name, pool.apply_async(list_directory, (os.path.join(root, relative + name),)))
+                     for (name, size, _) in entries if size is None])
+    for (name, size, mtime) in entries:
+        if size is None:
+            for item in walk(pool, root, relative + name, children[name]):
+                yield item
+        else:
+            yield (relative + name, size, mtime)
+
+
+def artifacts(chunk_size, root=""):
+    """
+    Yield (id, path, size, is_missing) for every artifact of the storage
+    root, sorted by path.
+    """
+    last = None
+    while True:
+        query = Artifact.objects.filter(root=root).order_by("path")
+        if last is not None:
+            query = query.filter(path__gt=last)
+        rows = list(query.values_list("id", "path", "size", "is_missing")[:chunk_size])
+        for row in rows:
+            if last is not None and row[1] <= last:
+                raise CommandError("The database does not sort the paths like Python: "
+                                   "use a binary collation for Artifact.path")
+            last = row[1]
+            yield row
+        if len(rows) < chunk_size:
+            return
+
+
+def physical_artifacts(chunk_size, layout, root=""):
+    """
+    Yield (id, physical path, size, is_missing, path) for every artifact of
+    the storage root, sorted by physical path.
+    When the layout does not keep the order of the paths, every chunk is
+    sorted into a temporary file and the files are merged.
+    """
+    if layout.ordered:
+        for (id, path, size, is_missing) in artifacts(chunk_size, root):
+            yield (id, layout.physical(path), size, is_missing, path)
+        return
+
+    runs = []
+    try:
+        last = 0
+        while True:
+            rows = list(Artifact.objects.filter(root=root, id__gt=last).order_by("id")
+                                        .values_list("id", "path", "size", "is_missing")[:chunk_size])
+            if rows:
+                last = rows[-1][0]
+                run = tempfile.TemporaryFile(mode="w+")
+                for (id, path, size, is_missing) in sorted(rows, key=lambda r: layout.physical(r[1])):
+                    run.write(json.dumps([layout.physical(path), id, size, is_missing, path]) + "\n")
+                run.seek(0)
+                runs.append(run)
+            if len(rows) < chunk_size:
+                break
+        merged = heapq.merge(*[(json.loads(line) for line in run) for run in runs])
+        for (physical, id, size, is_missing, path) in merged:
+            yield (id, physical, size, is_missing, path)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _tagged(rows, is_current):
+    for (id, physical, size, is_missing, path) in rows:
+        yield (physical, id, size, is_missing, path, is_current)
+
+
+def layout_artifacts(chunk_size, root=""):
+    """
+    Yield (id, physical path, size, is_missing, path, is_current) for every
+    artifact in the current layout and in every previous layout (while
+    relocating), sorted by physical path.
+    """
+    layouts = [get_layout()] + previous_layouts()
+    streams = [_tagged(physical_artifacts(chunk_size, layout, root), index == 0)
+               for (index, layout) in enumerate(layouts)]
+    for (physical, id, size, is_missing, path, is_current) in heapq.merge(*streams):
+        yield (id, physical, size, is_missing, path, is_current)
+
+
+class Command(BaseCommand):
+    args = None
+    help = 'Find the files without artifacts and the artifacts without files'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", default=8, type=int,
+                            help="Number of directories listed in parallel")
+        parser.add_argument("--chunk-size", default=10000, type=int,
+                            help="Number of artifacts loaded at once")
+        parser.add_argument("--exclude", default=[], action="append",
+                            help="Ignore the files under this path (relative to the storage roots)")
+        parser.add_argument("--delete-orphans", default=False, action="store_true",
+                            help="Remove the files without artifacts")
+        parser.add_argument("--min-age", default=3600, type=int,
+                            help="Only remove orphans older than this number of seconds")
+        parser.add_argument("--mark-missing", default=False, action="store_true",
+                            help="Mark the artifacts without files as missing")
+        parser.add_argument("--list", default=False, action="store_true",
+                            help="Print every orphan file and missing artifact")
+
+    def handle(self, *args, **kwargs):
+        excludes = [e.strip("/") + "/" for e in kwargs["exclude"]]
+        now = time.time()
+        stats = {"orphans": 0, "orphan_bytes": 0, "deleted": 0,
+                 "missing": 0, "missing_bytes": 0, "marked": 0, "found": 0}
+        missing = []
+        found = []
+
+        pool = ThreadPool(kwargs["workers"])
+        try:
+            for (name, root) in sorted(get_roots().items()):
+                self.reconcile(pool, name, root, excludes, now, stats, missing, found, kwargs)
+        finally:
+            pool.close()
+            pool.join()
+
+        if kwargs["mark_missing"]:
+            self.mark(missing, found, stats, force=True)
+
+        self.stdout.write("Orphan files: %d (%d bytes)" % (stats["orphans"], stats["orphan_bytes"]))
+        if kwargs["delete_orphans"]:
+            self.stdout.write("* removed: %d" % stats["deleted"])
+        self.stdout.write("Missing files: %d (%d bytes)" % (stats["missing"], stats["missing_bytes"]))
+        if kwargs["mark_missing"]:
+            self.stdout.write("* marked: %d" % stats["marked"])
+            self.stdout.write("* found again: %d" % stats["found"])
+
+    def reconcile(self, pool, name, root, excludes, now, stats, missing, found, options):
+        """
+        Compare the files under root with the artifacts of this storage root.
+        While relocating, a file at the location of any layout belongs to
+        its artifact and an artifact is only missing when the storage finds
+        the file nowhere.
+        """
+        relocating = bool(previous_layouts())
+        storage = get_storage(name)
+        files = walk(pool, root)
+        rows = layout_artifacts(options["chunk_size"], name)
+        current_file = next(files, None)
+        current_row = next(rows, None)
+        while current_file is not None or current_row is not None:
+            if current_row is None or \
+               (current_file is not None and current_file[0] < current_row[1]):
+                (path, size, mtime) = current_file
+                if not any([path.startswith(e) for e in excludes]):
+                    self.orphan(root, path, size, mtime, now, stats, options)
+                current_file = next(files, None)
+            elif current_file is None or current_row[1] < current_file[0]:
+                (id, _, size, is_missing, path, is_current) = current_row
+                if not is_current:
+                    # Already relocated
+                    pass
+                elif relocating and os.path.exists(storage.path(path)):
+                    # Not relocated yet
+                    if is_missing:
+                        found.append(id)
+                else:
+                    stats["missing"] += 1
+                    stats["missing_bytes"] += size
+                    if options["list"]:
+                        self.stdout.write("* missing: %s" % path)
+                    if not is_missing:
+                        missing.append(id)
+                current_row = next(rows, None)
+            else:
+                # Found again (restored from a backup)
+                if current_row[3] and current_row[5]:
+                    found.append(current_row[0])
+                current_file = next(files, None)
+                current_row = next(rows, None)
+            if options["mark_missing"]:
+                self.mark(missing, found, stats)
+
+    def mark(self, missing, found, stats, force=False):
+        """
+        Update the artifacts by batches of 500
+        """
+        if force or len(missing) >= 500:
+            Artifact.objects.filter(id__in=missing).update(is_missing=True)
+            stats["marked"] += len(missing)
+            del missing[:]
+        if force or len(found) >= 500:
+            Artifact.objects.filter(id__in=found).update(is_missing=False)
+            stats["found"] += len(found)
+            del found[:]
+
+    def orphan(self, root, path, size, mtime, now, stats, options):
+        stats["orphans"] += 1
+        stats["orphan_bytes"] += size
+        if options["list"]:
+            self.stdout.write("* orphan: %s" % path)
+        # Do not remove files that are being uploaded
+        if options["delete_orphans"] and now - mtime >= options["min_age"]:
+            try:
+                os.unlink(os.path.join(root, path))
+                stats["deleted"] += 1
+            except OSError as exc:  # pragma: no cover
+                self.stderr.write("Unable to remove %s: %s" % (path, exc))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from Artifactorial.models import Artifact
+from Artifactorial.storage import get_layout, get_storage
+
+import errno
+import os
+
+
+class Command(BaseCommand):
+    args = None
+    help = 'Move the files from the previous layouts to the current one'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="layouts", default=[], action="append",
+                            help="Previous layout (default to ARTIFACTORIAL_PREVIOUS_LAYOUTS)")
+        parser.add_argument("--chunk-size", default=1000, type=int,
+                            help="Number of artifacts loaded at once")
+        parser.add_argument("--dry-run", default=False, action="store_true",
+                            help="Only count the files to move")
+
+    def handle(self, *args, **kwargs):
+        names = kwargs["layouts"] or getattr(settings, "ARTIFACTORIAL_PREVIOUS_LAYOUTS", [])
+        if not names:
+            raise CommandError("No previous layout: use --from or ARTIFACTORIAL_PREVIOUS_LAYOUTS")
+        try:
+            layouts = [get_layout(name) for name in names]
+        except ImportError as exc:
+            raise CommandError("Invalid layout: %s" % exc)
+        current = get_layout()
+        stats = {"moved": 0, "moved_bytes": 0, "done": 0, "missing": 0, "errors": 0}
+
+        last = 0
+        while True:
+            rows = list(Artifact.objects.filter(id__gt=last).order_by("id")
+                                        .values_list("id", "path", "size", "root")[:kwargs["chunk_size"]])
+            for (id, name, size, root) in rows:
+                last = id
+                storage = get_storage(root)
+                dst = storage.layout_path(name, current)
+                for layout in layouts:
+                    src = storage.layout_path(name, layout)
+                    if src != dst and os.path.exists(src):
+                        if kwargs["dry_run"] or self.move(src, dst, stats):
+                            stats["moved"] += 1
+                            stats["moved_bytes"] += size
+                        break
+                else:
+                    if os.path.exists(dst):
+                        stats["done"] += 1
+                    else:
+                        stats["missing"] += 1
+            if len(rows) < kwargs["chunk_size"]:
+                break
+
+        self.stdout.write("Moved: %d (%d bytes)" % (stats["moved"], stats["moved_bytes"]))
+        self.stdout.write("Already moved: %d" % stats["done"])
+        self.stdout.write("Missing: %d" % stats["missing"])
+        if stats["errors"]:
+            raise CommandError("Unable to move %d files" % stats["errors"])
+
+    def move(self, src, dst, stats):
+        """
+        Link the file to its new location and then remove the old name: the
+        file is always reachable under one of the names, so the artifacts can
+        be served while relocating.
+        """
+        try:
+            try:
+                os.makedirs(os.path.dirname(dst))
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            try:
+                os.link(src, dst)
+            except OSError as exc:
+                # Interrupted after the link in a previous run
+                if exc.errno == errno.EEXIST and os.path.samefile(src, dst):
+                    pass
+                elif exc.errno in [errno.EPERM, errno.ENOTSUP]:
+                    # No hard links on this file system
+                    os.rename(src, dst)
+                    return True
+                else:
+                    raise
+            os.unlink(src)
+            return True
+        except OSError as exc:
+            stats["errors"] += 1
+            self.stderr.write("Unable to move %s: %s" % (src, exc))
+            return False
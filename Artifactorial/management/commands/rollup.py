@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Artifactorial.models import DirectoryUsage
+
+from datetime import timedelta
+
+
+class Command(BaseCommand):
+    args = None
+    help = 'Store the usage of every directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", default=None, type=int,
+                            help="Remove the usage older than this number of days")
+
+    def handle(self, *args, **kwargs):
+        count = DirectoryUsage.snapshot()
+        self.stdout.write("Usage of %d directories stored" % count)
+
+        if kwargs["keep"] is not None:
+            older_than = timezone.now() - timedelta(days=int(kwargs["keep"]))
+            (removed, _) = DirectoryUsage.objects.filter(timestamp__lt=older_than).delete()
+            self.stdout.write("Removed %d old entries" % removed)
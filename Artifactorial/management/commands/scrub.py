@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+from django.utils import timezone
+
+from Artifactorial import throttling
+from Artifactorial.models import Artifact
+
+from datetime import timedelta
+import errno
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import time
+
+
+def check(args):
+    (artifact, bucket) = args
+    try:
+        return (artifact, artifact.compute_md5(bucket), None)
+    except (IOError, OSError) as exc:
+        return (artifact, None, exc)
+
+
+class Command(BaseCommand):
+    args = None
+    help = 'Check the integrity of the artifacts'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", default=4, type=int,
+                            help="Number of files hashed in parallel")
+        parser.add_argument("--rate", default=None, type=float,
+                            help="Maximum reading speed in MB/s (ARTIFACTORIAL_SCRUB_RATE by default)")
+        parser.add_argument("--interval", default=30, type=int,
+                            help="Check again the artifacts verified more than this number of days ago")
+        parser.add_argument("--duration", default=None, type=int,
+                            help="Stop after this number of seconds")
+        parser.add_argument("--quarantine", default=None,
+                            help="Move the corrupted files to this directory and remove the artifacts")
+        parser.add_argument("--batch-size", default=100, type=int,
+                            help="Number of artifacts checked between two checkpoints")
+
+    def handle(self, *args, **kwargs):
+        rate = kwargs["rate"]
+        if rate is None:
+            rate = getattr(settings, "ARTIFACTORIAL_SCRUB_RATE", 0)
+        # Shared by the workers (and by concurrent runs)
+        bucket = throttling.TokenBucket("scrub", float(rate) * 1024 * 1024) if rate else None
+        deadline = None
+        if kwargs["duration"] is not None:
+            deadline = time.time() + int(kwargs["duration"])
+
+        # The verification date is the checkpoint: artifacts checked during a
+        # previous (interrupted) run are skipped.
+        older_than = timezone.now() - timedelta(days=kwargs["interval"])
+        query = Artifact.objects.filter(Q(verified_at__isnull=True) | Q(verified_at__lt=older_than)) \
+                                .only("id", "path", "root", "directory_id", "md5", "size") \
+                                .order_by(F("verified_at").asc(nulls_first=True), "id")
+
+        stats = {"checked": 0, "bytes": 0, "backfilled": 0, "corrupted": 0, "unreadable": 0}
+        start = time.time()
+        pool = ThreadPool(kwargs["workers"])
+        try:
+            while deadline is None or time.time() < deadline:
+                batch = list(query[:kwargs["batch_size"]])
+                if not batch:
+                    break
+                results = pool.imap_unordered(check, [(a, bucket) for a in batch])
+                for (artifact, md5, exc) in results:
+                    self.handle_result(artifact, md5, exc, stats, kwargs["quarantine"])
+                Artifact.objects.filter(id__in=[a.id for a in batch]) \
+                                .update(verified_at=timezone.now())
+        finally:
+            pool.close()
+            pool.join()
+
+        duration = time.time() - start
+        self.stdout.write("Checked %d artifacts (%d bytes) in %.1fs" % (stats["checked"], stats["bytes"], duration))
+        self.stdout.write("* backfilled: %d" % stats["backfilled"])
+        self.stdout.write("* corrupted: %d" % stats["corrupted"])
+        self.stdout.write("* unreadable: %d" % stats["unreadable"])
+        if stats["corrupted"] or stats["unreadable"]:
+            raise CommandError("%d corrupted and %d unreadable artifacts"
+                               % (stats["corrupted"], stats["unreadable"]))
+
+    def handle_result(self, artifact, md5, exc, stats, quarantine):
+        stats["checked"] += 1
+        if exc is not None:
+            stats["unreadable"] += 1
+            self.stderr.write("Unreadable: %s (%s)" % (artifact.path.name, exc))
+            return
+
+        stats["bytes"] += artifact.size
+        if not artifact.md5:
+            Artifact.objects.filter(id=artifact.id).update(md5=md5)
+            stats["backfilled"] += 1
+        elif artifact.md5 != md5:
+            stats["corrupted"] += 1
+            self.stderr.write("Corrupted: %s (expected %s, got %s)" % (artifact.path.name,
+                                                                    artifact.md5, md5))
+            if quarantine is not None:
+                self.quarantine(artifact, quarantine)
+
+    def quarantine(self, artifact, root):
+        destination = os.path.join(root, artifact.path.name)
+        try:
+            os.makedirs(os.path.dirname(destination))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:  # pragma: no cover
+                raise
+        shutil.move(artifact.path.path, destination)
+        artifact.delete()
+        self.stderr.write("* moved to %s" % destination)
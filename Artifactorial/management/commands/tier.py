@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from Artifactorial.models import Directory
+from Artifactorial.storage import get_roots, move_to_root
+
+from datetime import timedelta
+
+
+class Command(BaseCommand):
+    args = None
+    help = 'Move the artifacts not downloaded for a while to the cold storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--root", default=None,
+                            help="Cold storage root (default to ARTIFACTORIAL_COLD_ROOT)")
+        parser.add_argument("--batch-size", default=100, type=int,
+                            help="Number of artifacts loaded at once")
+        parser.add_argument("--limit", default=None, type=int,
+                            help="Maximum number of artifacts to move")
+        parser.add_argument("--dry-run", default=False, action="store_true",
+                            help="Only count the artifacts to move")
+
+    def handle(self, *args, **kwargs):
+        root = kwargs["root"] or getattr(settings, "ARTIFACTORIAL_COLD_ROOT", "cold")
+        if not root or root not in get_roots():
+            raise CommandError("Unknown storage root '%s'" % root)
+        now = timezone.now()
+        stats = {"moved": 0, "moved_bytes": 0, "errors": 0}
+        limit = kwargs["limit"]
+
+        for directory in Directory.objects.filter(cold_after__isnull=False).order_by("path"):
+            older_than = now - timedelta(days=directory.cold_after)
+            query = directory.artifact_set.exclude(root=root) \
+                                          .filter(is_missing=False) \
+                                          .annotate(last_access=Coalesce("accessed_at", "created_at")) \
+                                          .filter(last_access__lt=older_than) \
+                                          .only("id", "path", "root", "md5", "size", "directory_id") \
+                                          .order_by("id")
+            last = 0
+            while limit is None or stats["moved"] + stats["errors"] < limit:
+                count = kwargs["batch_size"]
+                if limit is not None:
+                    count = min(count, limit - stats["moved"] - stats["errors"])
+                artifacts = list(query.filter(id__gt=last)[:count])
+                for artifact in artifacts:
+                    last = artifact.id
+                    if kwargs["dry_run"]:
+                        moved = True
+                    else:
+                        try:
+                            moved = move_to_root(artifact, root)
+                        except (IOError, OSError) as exc:
+                            stats["errors"] += 1
+                            self.stderr.write("Unable to move %s: %s" % (artifact.path.name, exc))
+                            continue
+                    if moved:
+                        stats["moved"] += 1
+                        stats["moved_bytes"] += artifact.size
+                if len(artifacts) < count:
+                    break
+
+        self.stdout.write("Moved to %s: %d (%d bytes)" % (root, stats["moved"], stats["moved_bytes"]))
+        if stats["errors"]:
+            raise CommandError("Unable to move %d artifacts" % stats["errors"])
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import unicode_literals
+
+import os
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+
+class _NoMetric(object):
+    """
+    Used when prometheus_client is not installed
+    """
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+
+if prometheus_client is not None:
+    REQUEST_DURATION = Histogram("artifactorial_request_duration_seconds",
+                                 "Time spent to build the response",
+                                 ["view", "method"])
+    UPLOADED_BYTES = Counter("artifactorial_uploaded_bytes",
+                             "Bytes uploaded")
+    SERVED_BYTES = Counter("artifactorial_served_bytes",
+                           "Bytes served by downloads and shares")
+    LISTING_ENTRIES = Histogram("artifactorial_listing_entries",
+                                "Number of entries in directory listings",
+                                buckets=[10, 100, 1000, 10000, 100000,
+                                         float("inf")])
+    QUOTA_REJECTIONS = Counter("artifactorial_quota_rejections",
+                               "Uploads rejected by the directory quota")
+    CLEAN_DURATION = Histogram("artifactorial_clean_duration_seconds",
+                               "Duration of the clean command",
+                               buckets=[1, 10, 60, 300, 900, 3600,
+                                        float("inf")])
+    CLEAN_RECLAIMED_BYTES = Counter("artifactorial_clean_reclaimed_bytes",
+                                    "Bytes removed by the clean command")
+    LISTING_CACHE_HITS = Counter("artifactorial_listing_cache_hits",
+                                 "Listings served from the cache")
+    LISTING_CACHE_MISSES = Counter("artifactorial_listing_cache_misses",
+                                   "Listings rendered and stored in the cache")
+else:  # pragma: no cover
+    REQUEST_DURATION = UPLOADED_BYTES = SERVED_BYTES = _NoMetric()
+    LISTING_ENTRIES = QUOTA_REJECTIONS = _NoMetric()
+    CLEAN_DURATION = CLEAN_RECLAIMED_BYTES = _NoMetric()
+    LISTING_CACHE_HITS = LISTING_CACHE_MISSES = _NoMetric()
+
+
+class DirectoryUsageCollector(object):
+    """
+    Per-directory usage, computed when scraping
+    """
+    def collect(self):
+        from django.db.models import Sum
+        from django.db.models.functions import Coalesce
+        from Artifactorial.models import Directory
+
+        usage = GaugeMetricFamily("artifactorial_directory_usage_bytes",
+                                  "Bytes used in the directory",
+                                  labels=["directory"])
+        quota = GaugeMetricFamily("artifactorial_directory_quota_bytes",
+                                  "Directory quota",
+                                  labels=["directory"])
+        query = Directory.objects.annotate(total_size=Coalesce(Sum("artifact__size"), 0))
+        for (path, size, limit) in query.values_list("path", "total_size", "quota"):
+            usage.add_metric([path], size)
+            quota.add_metric([path], limit)
+        yield usage
+        yield quota
+
+
+def is_multiprocess():
+    return "prometheus_multiproc_dir" in os.environ or \
+        "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def generate():
+    """
+    Return the metrics in the Prometheus text format.
+    When running under a multi-process server (like gunicorn), the metrics
+    of every worker are aggregated. The per-directory usage is only added
+    when ARTIFACTORIAL_METRICS_DIRECTORIES is set.
+    """
+    from django.conf import settings
+    from prometheus_client import CollectorRegistry, REGISTRY, generate_latest
+    from prometheus_client import multiprocess
+
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    content = generate_latest(registry)
+    # The labels list every directory, including the private ones
+    if getattr(settings, "ARTIFACTORIAL_METRICS_DIRECTORIES", False):
+        usage = CollectorRegistry()
+        usage.register(DirectoryUsageCollector())
+        content += generate_latest(usage)
+    return content
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import connection
+
+from Artifactorial import metrics
+
+from collections import Counter
+import cProfile
+import logging
+import os
+import pstats
+import random
+import time
+
+
+LOGGER = logging.getLogger("Artifactorial.profiling")
+
+
+class MetricsMiddleware(object):
+    """
+    Record the time spent in each view, by HTTP method.
+    For streaming responses (downloads), this is the time to the first byte.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.time()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.url_name if match is not None else ""
+        metrics.REQUEST_DURATION.labels(view, request.method).observe(time.time() - start)
+        return response
+
+
+class Profiler(object):
+    """
+    Count the SQL queries, the storage calls and profile the view.
+    """
+    # Builtins that access the storage
+    STAT = ["<built-in method posix.stat>", "<built-in method posix.lstat>"]
+    OPEN = ["<built-in method io.open>", "<built-in method posix.open>"]
+
+    def __init__(self):
+        self.queries = Counter()
+        self.sql_time = 0
+        self.profile = cProfile.Profile()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Used as a database execute_wrapper
+        start = time.time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.time() - start
+            self.queries[sql] += 1
+
+    def calls(self, names):
+        stats = pstats.Stats(self.profile).stats
+        return sum([stats[k][1] for k in stats if k[0] == "~" and k[2] in names])
+
+    def server_timing(self, total):
+        """
+        Summary of the profile in the Server-Timing format
+        """
+        timings = ["total;dur=%.1f" % (total * 1000),
+                   "sql;dur=%.1f;desc=\"%d queries\"" % (self.sql_time * 1000,
+                                                        sum(self.queries.values())),
+                   "stat;desc=\"%d calls\"" % self.calls(self.STAT),
+                   "open;desc=\"%d calls\"" % self.calls(self.OPEN)]
+        if self.queries:
+            (sql, count) = self.queries.most_common(1)[0]
+            sql = " ".join(sql.split()).replace("\"", "'")[:120]
+            timings.append("sql-top;desc=\"%dx %s\"" % (count, sql))
+        return ", ".join(timings)
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile the requests:
+    * when the ARTIFACTORIAL_PROFILING_HEADER header is sent by a staff member
+    * for a random sample of ARTIFACTORIAL_PROFILING_SAMPLE_RATE requests
+    A summary is returned in the Server-Timing header to the staff members
+    (and logged for the sampled requests). The cProfile dump and the summary
+    are saved in ARTIFACTORIAL_PROFILING_ROOT (if set).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        header = getattr(settings, "ARTIFACTORIAL_PROFILING_HEADER",
+                         "X-Artifactorial-Profile")
+        self.header = "HTTP_" + header.upper().replace("-", "_")
+        self.rate = getattr(settings, "ARTIFACTORIAL_PROFILING_SAMPLE_RATE", 0)
+        self.root = getattr(settings, "ARTIFACTORIAL_PROFILING_ROOT", None)
+
+    def is_requested(self, request):
+        if self.header not in request.META:
+            return False
+        # Staff members can be identified by a token
+        from Artifactorial.views import get_current_user
+        user = get_current_user(request, request.GET.get("token", None))
+        return user.is_staff
+
+    def __call__(self, request):
+        requested = self.is_requested(request)
+        if not requested and not (self.rate and random.random() < self.rate):
+            return self.get_response(request)
+
+        profiler = Profiler()
+        start = time.time()
+        with connection.execute_wrapper(profiler):
+            profiler.profile.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.profile.disable()
+        total = time.time() - start
+
+        # The summary includes SQL: only sent back to the staff members
+        summary = profiler.server_timing(total)
+        if requested:
+            response["Server-Timing"] = summary
+        else:
+            LOGGER.info("%s %s: %s", request.method, request.path, summary)
+        if self.root is not None:
+            match = request.resolver_match
+            name = "%s-%s-%d" % (match.url_name if match is not None else "unknown",
+                                 request.method, int(start * 1000000))
+            profiler.profile.dump_stats(os.path.join(self.root, name + ".prof"))
+            with open(os.path.join(self.root, name + ".txt"), "w") as f_out:
+                f_out.write("%s %s\n%s\n" % (request.method, request.path, summary))
+        return response
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:05
+from __future__ import unicode_literals
+
+import Artifactorial.models
+from django.db import migrations, models
+
+
+def store_sizes(apps, schema_editor):
+    Artifact = apps.get_model("Artifactorial", "Artifact")
+    for artifact in Artifact.objects.all().iterator():
+        try:
+            size = artifact.path.size
+        except OSError:
+            continue
+        Artifact.objects.filter(pk=artifact.pk).update(size=size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0005_share_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artifact',
+            name='size',
+            field=models.BigIntegerField(default=0, help_text='Size in Bytes'),
+        ),
+        migrations.AlterField(
+            model_name='artifact',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='artifact',
+            name='path',
+            field=models.FileField(db_index=True, upload_to=Artifactorial.models.get_path_name),
+        ),
+        migrations.RunPython(store_sizes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0006_artifact_size_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(help_text='Start of the hour')),
+                ('size', models.BigIntegerField(blank=True, help_text='Size in Bytes', null=True)),
+                ('artifacts', models.IntegerField(blank=True, null=True)),
+                ('uploads', models.IntegerField(default=0)),
+                ('uploaded_bytes', models.BigIntegerField(default=0)),
+                ('deletes', models.IntegerField(default=0)),
+                ('deleted_bytes', models.BigIntegerField(default=0)),
+                ('expired', models.IntegerField(default=0)),
+                ('expired_bytes', models.BigIntegerField(default=0)),
+                ('directory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Artifactorial.Directory')),
+            ],
+            options={
+                'verbose_name_plural': 'Directory usage',
+                'unique_together': {('directory', 'timestamp')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    from Artifactorial import search
+    search.install(schema_editor.connection, rebuild=True)
+
+
+def drop_index(apps, schema_editor):
+    from Artifactorial import search
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0007_directory_usage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0008_artifact_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='artifact',
+            name='size',
+            field=models.BigIntegerField(db_index=True, default=0, help_text='Size in Bytes'),
+        ),
+    ]
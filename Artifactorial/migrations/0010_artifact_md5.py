@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0009_artifact_size_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artifact',
+            name='md5',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='artifact',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Last integrity check', null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0010_artifact_md5'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artifact',
+            name='is_missing',
+            field=models.BooleanField(default=False, help_text='The file was not found on disk'),
+        ),
+    ]
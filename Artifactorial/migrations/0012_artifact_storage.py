@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:24
+from __future__ import unicode_literals
+
+import Artifactorial.models
+import Artifactorial.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0011_artifact_is_missing'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='artifact',
+            name='path',
+            field=models.FileField(db_index=True, storage=Artifactorial.storage.ArtifactStorage(), upload_to=Artifactorial.models.get_path_name),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0012_artifact_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artifact',
+            name='filename',
+            field=models.CharField(blank=True, default='', help_text='Name of the uploaded file', max_length=255),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0013_artifact_filename'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('event', models.CharField(choices=[('created', 'Created'), ('deleted', 'Deleted'), ('expired', 'Expired')], max_length=7)),
+                ('size', models.BigIntegerField(default=0, help_text='Size in Bytes')),
+                ('timestamp', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('directory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Artifactorial.Directory')),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:32
+from __future__ import unicode_literals
+
+import Artifactorial.models
+import Artifactorial.storage
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0014_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artifact',
+            name='accessed_at',
+            field=models.DateTimeField(blank=True, help_text='Last download (one day resolution)', null=True),
+        ),
+        migrations.AddField(
+            model_name='artifact',
+            name='root',
+            field=models.CharField(blank=True, default='', help_text='Storage root (empty for MEDIA_ROOT)', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='cold_after',
+            field=models.IntegerField(blank=True, help_text='Move the artifacts to the cold storage after this number of days without download', null=True, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AlterField(
+            model_name='artifact',
+            name='path',
+            field=Artifactorial.storage.ArtifactFileField(db_index=True, storage=Artifactorial.storage.ArtifactStorage(), upload_to=Artifactorial.models.get_path_name),
+        ),
+    ]
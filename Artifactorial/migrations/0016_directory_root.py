@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0015_artifact_tiering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='root',
+            field=models.CharField(blank=True, default='', help_text='Store the artifacts in this root (empty for the placement policy)', max_length=20),
+        ),
+    ]
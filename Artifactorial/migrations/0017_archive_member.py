@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 06:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0016_directory_root'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artifact',
+            name='archive',
+            field=models.CharField(blank=True, default='', help_text='Format of the indexed archive (tar or zip)', max_length=3),
+        ),
+        migrations.CreateModel(
+            name='ArchiveMember',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('offset', models.BigIntegerField(help_text='Offset of the data in the archive')),
+                ('size', models.BigIntegerField(default=0, help_text='Size in Bytes')),
+                ('compressed_size', models.BigIntegerField(default=0, help_text='Size in the archive')),
+                ('compression', models.IntegerField(default=0, help_text='Zip compression method')),
+                ('artifact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Artifactorial.Artifact')),
+            ],
+            options={
+                'index_together': {('artifact', 'name')},
+            },
+        ),
+    ]
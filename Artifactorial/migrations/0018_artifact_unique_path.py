@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 07:10
+from __future__ import unicode_literals
+
+import Artifactorial.models
+import Artifactorial.storage
+from django.db import migrations
+from django.db.models import Count
+
+import errno
+import os
+
+
+def rename_duplicates(apps, schema_editor):
+    """
+    Give a new name to the artifacts stored in several roots under the
+    same name, keeping the oldest one
+    """
+    Artifact = apps.get_model("Artifactorial", "Artifact")
+    duplicates = Artifact.objects.values("path").annotate(count=Count("id")) \
+                                 .filter(count__gt=1).values_list("path", flat=True)
+    for path in list(duplicates):
+        for artifact in Artifact.objects.filter(path=path).order_by("id")[1:]:
+            storage = Artifactorial.storage.get_storage(artifact.root)
+            name = storage.unique_name(storage.get_available_name(path, max_length=100))
+            (src, dst) = (storage.path(path), storage.path(name))
+            if os.path.exists(src):
+                try:
+                    os.makedirs(os.path.dirname(dst))
+                except OSError as exc:
+                    if exc.errno != errno.EEXIST:
+                        raise
+                os.rename(src, dst)
+            Artifact.objects.filter(pk=artifact.pk).update(path=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0017_archive_member'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='artifact',
+            name='path',
+            field=Artifactorial.storage.ArtifactFileField(storage=Artifactorial.storage.ArtifactStorage(), unique=True, upload_to=Artifactorial.models.get_path_name),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 07:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def store_watermark(apps, schema_editor):
+    # The changes before the oldest one left were pruned
+    Change = apps.get_model("Artifactorial", "Change")
+    ChangeWatermark = apps.get_model("Artifactorial", "ChangeWatermark")
+    first = Change.objects.order_by("id").values_list("id", flat=True).first()
+    if first is not None and first > 1:
+        ChangeWatermark.objects.create(pk=1, pruned=first - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0018_artifact_unique_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pruned', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(store_watermark, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-19 07:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Artifactorial', '0019_change_watermark'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivemember',
+            name='offset',
+            field=models.BigIntegerField(blank=True, help_text='Offset of the data in the archive (none when compressed)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='artifact',
+            name='archive',
+            field=models.CharField(blank=True, default='', help_text='Format of the indexed archive (tar, zip, stream or bad)', max_length=6),
+        ),
+    ]
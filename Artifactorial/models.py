@@ -22,14 +22,20 @@ from __future__ import unicode_literals
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.timezone import datetime, utc
 
+from Artifactorial.storage import ArtifactFileField, ArtifactStorage, get_roots
+
 import binascii
 from datetime import timedelta
+import hashlib
 import os
+import time
 
 
 def random_hash():
@@ -50,6 +56,41 @@ class AuthToken(models.Model):
         return "%s (%s)" % (user, self.description)
 
 
+def _group_ids(user):
+    """
+    Return the ids of the groups of the user. The result is cached on the
+    user object to avoid one query per directory when checking permissions.
+    """
+    if not hasattr(user, "_artifactorial_group_ids"):
+        if user.is_authenticated:
+            user._artifactorial_group_ids = set(user.groups.values_list("id", flat=True))
+        else:
+            user._artifactorial_group_ids = set()
+    return user._artifactorial_group_ids
+
+
+class DirectoryQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Same rules as Directory.is_visible_to but evaluated by the database
+        """
+        query = Q(is_public=True)
+        if user.is_authenticated:
+            query |= Q(user=user) | Q(group__in=_group_ids(user))
+        if user.is_active:
+            query |= Q(user__isnull=True, group__isnull=True)
+        return self.filter(query)
+
+    def with_usage(self):
+        """
+        Annotate each directory with the total size, the number of artifacts
+        and the date of the last upload.
+        """
+        return self.annotate(total_size=Coalesce(Sum("artifact__size"), 0),
+                             artifacts_count=Count("artifact"),
+                             last_upload=Max("artifact__created_at"))
+
+
 @python_2_unicode_compatible
 class Directory(models.Model):
     path = models.CharField(max_length=300, unique=True,
@@ -62,6 +103,15 @@ class Directory(models.Model):
     quota = models.BigIntegerField(blank=False, default=1024*1024*1024,
                                    validators=[MinValueValidator(1)],
                                    help_text='Size limit in Bytes')
+    root = models.CharField(max_length=20, blank=True, default="",
+                            help_text="Store the artifacts in this root "
+                                      "(empty for the placement policy)")
+    cold_after = models.IntegerField(null=True, blank=True,
+                                     validators=[MinValueValidator(0)],
+                                     help_text="Move the artifacts to the cold storage "
+                                               "after this number of days without download")
+
+    objects = DirectoryQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = 'Directories'
@@ -77,6 +127,8 @@ class Directory(models.Model):
                                             'no trailing slashes']})
         if not os.path.isabs(self.path):
             raise ValidationError({'path': ['Expecting an absolute path']})
+        if self.root and self.root not in get_roots():
+            raise ValidationError({'root': ['Unknown storage root']})
 
     def __str__(self):
         if self.user is not None:
@@ -100,10 +152,10 @@ class Directory(models.Model):
         """
         if self.is_public:
             return True
-        if self.user is not None:
-            return self.user == user
-        elif self.group is not None:
-            return self.group in user.groups.all()
+        if self.user_id is not None:
+            return self.user_id == user.pk
+        elif self.group_id is not None:
+            return self.group_id in _group_ids(user)
         else:
             return user.is_active
 
@@ -115,18 +167,18 @@ class Directory(models.Model):
         :param user: the user to check
         :return: True if the user can write to this directory, False otherwise.
         """
-        if self.user is not None:
-            return self.user == user
-        elif self.group is not None:
-            return self.group in user.groups.all()
+        if self.user_id is not None:
+            return self.user_id == user.pk
+        elif self.group_id is not None:
+            return self.group_id in _group_ids(user)
         else:
             return True
 
     def size(self):
-        size = 0
-        for artifact in self.artifact_set.all():
-            size += artifact.path.size
-        return size
+        # Already computed by DirectoryQuerySet.with_usage
+        if hasattr(self, "total_size"):
+            return self.total_size
+        return self.artifact_set.aggregate(size=Coalesce(Sum("size"), 0))["size"]
 
     def quota_progress(self):
         return int(round(float(self.size()) / self.quota * 100))
@@ -135,6 +187,8 @@ class Directory(models.Model):
         """
         Remove old artifacts by comparing to the TTL
         When purge is True, remove also permanent artifacts
+
+        :return: the number of bytes reclaimed
         """
         # Use the TTL passed as argument if not empty
         ttl = override_ttl if override_ttl is not None else self.ttl
@@ -142,14 +196,24 @@ class Directory(models.Model):
         # A negative TTL mean that we should not remove old files
         # Except when purge is True (we will remove everything)
         if ttl == 0 and not purge:
-            return
+            return 0
         now = datetime.utcnow().replace(tzinfo=utc)
         older_than = now - timedelta(days=ttl)
         query = self.artifact_set.filter(created_at__lt=older_than)
         # Also remove permanent artifacts
         if not purge:
             query = query.exclude(is_permanent=True)
-        query.delete()
+        expired = query.aggregate(count=Count("id"),
+                                  size=Coalesce(Sum("size"), 0))
+        if not expired["count"]:
+            return 0
+        from Artifactorial import signals
+
+        with transaction.atomic(), signals.record_changes(Change.EXPIRED):
+            query.delete()
+        DirectoryUsage.record(self, expired=expired["count"],
+                              expired_bytes=expired["size"])
+        return expired["size"]
 
 
 def get_path_name(instance, filename):
@@ -163,17 +227,76 @@ def get_path_name(instance, filename):
 
 @python_2_unicode_compatible
 class Artifact(models.Model):
-    path = models.FileField(upload_to=get_path_name)
+    path = ArtifactFileField(upload_to=get_path_name, storage=ArtifactStorage(),
+                             unique=True)
     directory = models.ForeignKey(Directory, blank=False, on_delete=models.CASCADE)
     is_permanent = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    size = models.BigIntegerField(default=0, db_index=True, help_text="Size in Bytes")
+    md5 = models.CharField(max_length=32, blank=True, default="")
+    verified_at = models.DateTimeField(null=True, blank=True, db_index=True,
+                                       help_text="Last integrity check")
+    is_missing = models.BooleanField(default=False,
+                                     help_text="The file was not found on disk")
+    filename = models.CharField(max_length=255, blank=True, default="",
+                                help_text="Name of the uploaded file")
+    root = models.CharField(max_length=20, blank=True, default="",
+                            help_text="Storage root (empty for MEDIA_ROOT)")
+    accessed_at = models.DateTimeField(null=True, blank=True,
+                                       help_text="Last download (one day resolution)")
+    archive = models.CharField(max_length=6, blank=True, default="",
+                               help_text="Format of the indexed archive (tar, zip, stream or bad)")
 
     def __str__(self):
         return self.path.name
 
+    def save(self, *args, **kwargs):
+        # Keep the original name: the storage renames the colliding uploads
+        if not self.filename and self.path and not self.path._committed:
+            self.filename = os.path.basename(self.path.name)[:255]
+        # Store the size to avoid calling stat() when listing artifacts
+        if not self.size and self.path:
+            try:
+                self.size = self.path.size
+            except OSError:
+                pass
+        super(Artifact, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse("artifacts", [self.path.name])
 
+    def get_filename(self):
+        return self.filename or os.path.basename(self.path.name)
+
+    def touch(self):
+        """
+        Record the download, at most once a day to avoid one write per
+        download
+        """
+        now = datetime.utcnow().replace(tzinfo=utc)
+        if self.accessed_at is None or now - self.accessed_at >= timedelta(days=1):
+            Artifact.objects.filter(pk=self.pk).update(accessed_at=now)
+            self.accessed_at = now
+
+    def compute_md5(self, bucket=None):
+        """
+        Compute the MD5 of the file (in hexadecimal)
+
+        :param bucket: optional TokenBucket limiting the reading speed
+        """
+        md5 = hashlib.md5()
+        with open(self.path.path, "rb") as f_in:
+            while True:
+                data = f_in.read(1024 * 1024)
+                if not data:
+                    break
+                if bucket is not None:
+                    delay = bucket.consume(len(data))
+                    if delay:
+                        time.sleep(delay)
+                md5.update(data)
+        return md5.hexdigest()
+
     def is_visible_to(self, user):
         return self.directory.is_visible_to(user)
 
@@ -192,3 +315,169 @@ class Share(models.Model):
 
     def get_absolute_url(self):
         return reverse("shares", [self.token])
+
+
+class DirectoryUsage(models.Model):
+    """
+    Hourly usage of a directory.
+    The counters are incremented when artifacts are uploaded, deleted or
+    expired while size and artifacts are snapshots taken by the rollup and
+    clean commands (None when no snapshot was taken during this hour).
+    """
+    directory = models.ForeignKey(Directory, blank=False, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(help_text="Start of the hour")
+    size = models.BigIntegerField(null=True, blank=True, help_text="Size in Bytes")
+    artifacts = models.IntegerField(null=True, blank=True)
+    uploads = models.IntegerField(default=0)
+    uploaded_bytes = models.BigIntegerField(default=0)
+    deletes = models.IntegerField(default=0)
+    deleted_bytes = models.BigIntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    expired_bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("directory", "timestamp")
+        verbose_name_plural = "Directory usage"
+
+    @staticmethod
+    def bucket(now=None):
+        if now is None:
+            now = datetime.utcnow().replace(tzinfo=utc)
+        return now.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def record(cls, directory, **counters):
+        """
+        Increment the counters of the current hour
+        """
+        timestamp = cls.bucket()
+        updates = dict([(k, F(k) + v) for (k, v) in counters.items()])
+        query = cls.objects.filter(directory=directory, timestamp=timestamp)
+        if query.update(**updates):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(directory=directory, timestamp=timestamp,
+                                   **counters)
+        except IntegrityError:
+            # Created concurrently
+            query.update(**updates)
+
+    @classmethod
+    def snapshot(cls, now=None):
+        """
+        Store the current size and number of artifacts of every directory
+
+        :return: the number of directories
+        """
+        timestamp = cls.bucket(now)
+        existing = set(cls.objects.filter(timestamp=timestamp)
+                                  .values_list("directory_id", flat=True))
+        created = []
+        directories = Directory.objects.with_usage() \
+                                       .values_list("id", "total_size", "artifacts_count")
+        for (directory_id, size, count) in directories:
+            if directory_id in existing:
+                cls.objects.filter(directory_id=directory_id, timestamp=timestamp) \
+                           .update(size=size, artifacts=count)
+            else:
+                created.append(cls(directory_id=directory_id, timestamp=timestamp,
+                                   size=size, artifacts=count))
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(created)
+        except IntegrityError:
+            # Some rows were created concurrently by record()
+            for usage in created:
+                cls.objects.update_or_create(directory_id=usage.directory_id,
+                                             timestamp=timestamp,
+                                             defaults={"size": usage.size,
+                                                       "artifacts": usage.artifacts})
+        return len(directories)
+
+
+@python_2_unicode_compatible
+class Change(models.Model):
+    """
+    Append-only log of the artifacts created, deleted and expired.
+    The id is used as the cursor of the change feed.
+    """
+    CREATED = "created"
+    DELETED = "deleted"
+    EXPIRED = "expired"
+    EVENTS = ((CREATED, "Created"),
+              (DELETED, "Deleted"),
+              (EXPIRED, "Expired"))
+
+    directory = models.ForeignKey(Directory, blank=False, on_delete=models.CASCADE)
+    path = models.CharField(max_length=255)
+    event = models.CharField(max_length=7, choices=EVENTS)
+    size = models.BigIntegerField(default=0, help_text="Size in Bytes")
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return "%s %s" % (self.event, self.path)
+
+    @classmethod
+    def pruned(cls):
+        """
+        Id of the last pruned change (0 when nothing was pruned)
+        """
+        return ChangeWatermark.objects.values_list("pruned", flat=True).first() or 0
+
+    @classmethod
+    def prune(cls, older_than):
+        """
+        Remove the changes older than the given date and remember the last
+        removed id: the cursors below it are too old.
+        """
+        with transaction.atomic():
+            last = cls.objects.filter(timestamp__lt=older_than).aggregate(last=Max("id"))["last"]
+            if last is None:
+                return 0
+            (count, _) = cls.objects.filter(id__lte=last).delete()
+            ChangeWatermark.objects.update_or_create(pk=1, defaults={"pruned": max(last, cls.pruned())})
+        return count
+
+    @classmethod
+    def record(cls, event, artifacts, batch_size=1000):
+        """
+        Log the event for every (directory_id, path, size)
+        """
+        batch = []
+        for (directory_id, path, size) in artifacts:
+            batch.append(cls(directory_id=directory_id, path=path,
+                             event=event, size=size))
+            if len(batch) >= batch_size:
+                cls.objects.bulk_create(batch)
+                batch = []
+        cls.objects.bulk_create(batch)
+
+
+class ChangeWatermark(models.Model):
+    """
+    Single row keeping the last change removed by the clean command, even
+    when every change was removed
+    """
+    pruned = models.BigIntegerField(default=0)
+
+
+@python_2_unicode_compatible
+class ArchiveMember(models.Model):
+    """
+    Index of the files in a tar or zip artifact, to read one of them
+    without going through the archive
+    """
+    artifact = models.ForeignKey(Artifact, blank=False, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    offset = models.BigIntegerField(null=True, blank=True,
+                                    help_text="Offset of the data in the archive (none when compressed)")
+    size = models.BigIntegerField(default=0, help_text="Size in Bytes")
+    compressed_size = models.BigIntegerField(default=0, help_text="Size in the archive")
+    compression = models.IntegerField(default=0, help_text="Zip compression method")
+
+    class Meta:
+        index_together = ("artifact", "name")
+
+    def __str__(self):
+        return "%s/!/%s" % (self.artifact, self.name)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Search on the artifact paths.
+
+The searches are accelerated by a trigram index:
+* SQLite: FTS5 table using the trigram tokenizer, kept in sync by triggers
+* PostgreSQL: GIN index using pg_trgm
+With other databases (or when the index is not available) the search falls
+back to a scan of the artifact table.
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+import logging
+import re
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+LOGGER = logging.getLogger("Artifactorial.search")
+
+FTS_TABLE = "Artifactorial_artifact_fts"
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS \"%s\" USING fts5(path, content='Artifactorial_artifact', "
+    "content_rowid='id', tokenize='trigram')" % FTS_TABLE,
+    "CREATE TRIGGER IF NOT EXISTS artifactorial_artifact_fts_insert AFTER INSERT ON \"Artifactorial_artifact\" "
+    "BEGIN INSERT INTO \"%s\"(rowid, path) VALUES (new.id, new.path); END" % FTS_TABLE,
+    "CREATE TRIGGER IF NOT EXISTS artifactorial_artifact_fts_delete AFTER DELETE ON \"Artifactorial_artifact\" "
+    "BEGIN INSERT INTO \"%s\"(\"%s\", rowid, path) VALUES ('delete', old.id, old.path); END" % (FTS_TABLE, FTS_TABLE),
+    "CREATE TRIGGER IF NOT EXISTS artifactorial_artifact_fts_update AFTER UPDATE OF path ON \"Artifactorial_artifact\" "
+    "BEGIN INSERT INTO \"%s\"(\"%s\", rowid, path) VALUES ('delete', old.id, old.path); "
+    "INSERT INTO \"%s\"(rowid, path) VALUES (new.id, new.path); END" % (FTS_TABLE, FTS_TABLE, FTS_TABLE),
+]
+
+POSTGRESQL_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS artifactorial_artifact_path_trgm "
+    "ON \"Artifactorial_artifact\" USING gin (path gin_trgm_ops)",
+]
+
+# Cache the availability of the index for each database
+_AVAILABLE = {}
+
+
+def install(connection, rebuild=False):
+    """
+    Create the index (when supported by the database).
+    The SQLite triggers are re-created as they are dropped when the artifact
+    table is rebuilt by a migration.
+    """
+    if connection.vendor == "sqlite":
+        statements = list(SQLITE_INDEX)
+        if rebuild:
+            statements.append("INSERT INTO \"%s\"(\"%s\") VALUES ('rebuild')" % (FTS_TABLE, FTS_TABLE))
+    elif connection.vendor == "postgresql":
+        statements = POSTGRESQL_INDEX
+    else:
+        return
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+    except DatabaseError as exc:
+        LOGGER.warning("Unable to create the search index: %s", exc)
+    _AVAILABLE.pop(connection.alias, None)
+
+
+def repair(connection):
+    """
+    Re-create the SQLite triggers that are dropped when a migration rebuilds
+    the artifact table.
+    """
+    if connection.vendor != "sqlite" or FTS_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' "
+                       "AND name LIKE 'artifactorial_artifact_fts_%'")
+        if cursor.fetchone()[0] != 3:
+            install(connection, rebuild=True)
+
+
+def uninstall(connection):
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            for name in ["insert", "delete", "update"]:
+                cursor.execute("DROP TRIGGER IF EXISTS artifactorial_artifact_fts_%s" % name)
+            cursor.execute("DROP TABLE IF EXISTS \"%s\"" % FTS_TABLE)
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX IF EXISTS artifactorial_artifact_path_trgm")
+    _AVAILABLE.pop(connection.alias, None)
+
+
+def _fts_available(connection):
+    if connection.alias not in _AVAILABLE:
+        _AVAILABLE[connection.alias] = connection.vendor == "sqlite" and \
+            FTS_TABLE in connection.introspection.table_names()
+    return _AVAILABLE[connection.alias]
+
+
+def _like_literal(literal):
+    # The trigram index is not used when the LIKE has an ESCAPE clause.
+    # Matching any character instead of '%' or '_' only returns more
+    # candidates.
+    return "".join(["_" if c in "%_" else c for c in literal])
+
+
+def glob_to_regex(pattern):
+    """
+    Translate a shell pattern (*, ? and [...]) into a regular expression
+    understood by Python and by the databases.
+    """
+    result = ""
+    index = 0
+    while index < len(pattern):
+        c = pattern[index]
+        index += 1
+        if c == "*":
+            result += ".*"
+        elif c == "?":
+            result += "."
+        elif c == "[" and "]" in pattern[index + 1:]:
+            end = pattern.index("]", index + 1)
+            chars = pattern[index:end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            result += "[%s]" % chars.replace("\\", "\\\\")
+            index = end + 1
+        else:
+            result += re.escape(c)
+    return "^%s$" % result
+
+
+def _glob_to_like(pattern):
+    result = ""
+    index = 0
+    while index < len(pattern):
+        c = pattern[index]
+        index += 1
+        if c == "*":
+            result += "%"
+        elif c == "?":
+            result += "_"
+        elif c == "[" and "]" in pattern[index + 1:]:
+            result += "_"
+            index = pattern.index("]", index + 1) + 1
+        else:
+            result += _like_literal(c)
+    return result
+
+
+_REPEATS = [getattr(sre_parse, op) for op in ["MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"]
+            if hasattr(sre_parse, op)]
+
+
+def _subpatterns(av):
+    if isinstance(av, sre_parse.SubPattern):
+        yield av
+    elif isinstance(av, (list, tuple)):
+        for item in av:
+            for sub in _subpatterns(item):
+                yield sub
+
+
+def _count_repeats(items, repeated=False):
+    """
+    Count the repeats of the parsed expression, raising ValueError on the
+    constructs that could backtrack exponentially.
+    """
+    count = 0
+    for (op, av) in items:
+        if op in _REPEATS and av[1] > 1:
+            if repeated:
+                raise ValueError("Nested repeats")
+            count += 1 + sum([_count_repeats(sub, True) for sub in _subpatterns(av[2])])
+        elif op == sre_parse.BRANCH and repeated:
+            raise ValueError("Repeated alternatives")
+        elif op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            raise ValueError("Backreferences")
+        else:
+            count += sum([_count_repeats(sub, repeated) for sub in _subpatterns(av)])
+    return count
+
+
+def check_regex(regex):
+    """
+    Raise ValueError when the regular expression is invalid or too expensive
+    to be matched against every path: the databases (SQLite calls Python)
+    match it without any deadline.
+    """
+    if len(regex) > getattr(settings, "ARTIFACTORIAL_SEARCH_REGEX_MAX_LENGTH", 256):
+        raise ValueError("Regular expression too long")
+    try:
+        items = sre_parse.parse(regex)
+    except re.error as exc:
+        raise ValueError(str(exc))
+    if _count_repeats(items) > getattr(settings, "ARTIFACTORIAL_SEARCH_REGEX_MAX_REPEATS", 3):
+        raise ValueError("Too many repeats")
+
+
+def _regex_literal(pattern):
+    """
+    Return the longest literal that any match of the regular expression
+    should contain (or None).
+    Alternatives, groups and character classes are not analyzed.
+    """
+    if "|" in pattern or "(" in pattern or "[" in pattern:
+        return None
+    literals = [""]
+    index = 0
+    while index < len(pattern):
+        c = pattern[index]
+        index += 1
+        if c == "\\":
+            # Escape sequences (\d, \., ...) end the literal
+            index += 1
+            literals.append("")
+        elif c in "?*{":
+            # The previous character is optional
+            literals[-1] = literals[-1][:-1]
+            literals.append("")
+            if c == "{" and "}" in pattern[index:]:
+                index = pattern.index("}", index) + 1
+        elif c in "^$.+)":
+            literals.append("")
+        else:
+            literals[-1] += c
+    literal = max(literals, key=len)
+    return literal if len(literal) >= 3 else None
+
+
+def filter_queryset(queryset, kind, pattern):
+    """
+    Filter the artifacts with a glob, a substring or a regular expression on
+    the path.
+    Raise ValueError when the pattern is invalid or too expensive.
+    """
+    if kind == "glob":
+        like = _glob_to_like(pattern)
+        regex = glob_to_regex(pattern)
+        check_regex(regex)
+        queryset = queryset.filter(path__regex=regex)
+    elif kind == "substring":
+        like = "%%%s%%" % _like_literal(pattern)
+        queryset = queryset.filter(path__contains=pattern)
+    elif kind == "regex":
+        check_regex(pattern)
+        literal = _regex_literal(pattern)
+        like = None if literal is None else "%%%s%%" % _like_literal(literal)
+        queryset = queryset.filter(path__regex=pattern)
+    else:
+        raise ValueError("Unknown search '%s'" % kind)
+
+    # Use the FTS index to only check the candidates
+    connection = connections[queryset.db]
+    if like is not None and _fts_available(connection):
+        # filter(id__in=RawSQL(...)) would be rendered as a scalar subquery
+        where = "\"%s\".\"id\" IN (SELECT rowid FROM \"%s\" WHERE path LIKE %%s)" \
+                % (queryset.model._meta.db_table, FTS_TABLE)
+        queryset = queryset.extra(where=[where], params=[like])
+    return queryset
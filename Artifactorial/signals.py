@@ -19,12 +19,116 @@
 
 from __future__ import unicode_literals
 
-from django.db.models.signals import post_delete
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from Artifactorial.models import Artifact
+from Artifactorial import cache
+from Artifactorial.models import Artifact, Change, Directory
+
+from contextlib import contextmanager
+import threading
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def defer_deletes():
+    """
+    Collect the files of the deleted artifacts instead of removing them and
+    invalidate the listings once per directory.
+
+    :return: the list of the files to remove
+    """
+    _deferred.files = []
+    _deferred.directories = set()
+    try:
+        with record_changes(Change.DELETED):
+            yield _deferred.files
+        _invalidate_on_commit(_deferred.directories)
+    finally:
+        del _deferred.files
+        del _deferred.directories
+
+
+@contextmanager
+def record_changes(event):
+    """
+    Log the artifacts deleted in the block with the given event, at once
+    when leaving the block.
+    """
+    _deferred.event = event
+    _deferred.changes = []
+    try:
+        yield
+        # Log at the end of the transaction so that the feed does not
+        # skip changes committed after the following ones
+        Change.record(event, _deferred.changes)
+    finally:
+        del _deferred.event
+        del _deferred.changes
+
+
+def _invalidate_on_commit(directory_ids):
+    # Invalidating before the commit would let a concurrent request cache
+    # the old listing under the new generation
+    def invalidate():
+        for directory_id in directory_ids:
+            cache.invalidate(directory_id)
+    transaction.on_commit(invalidate)
 
 
 @receiver(post_delete, sender=Artifact)
 def artifact_post_delete(sender, **kwargs):
     artifact = kwargs['instance']
-    artifact.path.storage.delete(artifact.path.path)
+    if getattr(_deferred, "files", None) is not None:
+        _deferred.files.append(artifact.path.path)
+    else:
+        artifact.path.storage.delete(artifact.path.name)
+
+
+@receiver(post_save, sender=Artifact)
+def artifact_record_creation(sender, **kwargs):
+    if kwargs['created'] and not kwargs.get('raw'):
+        artifact = kwargs['instance']
+        Change.record(Change.CREATED, [(artifact.directory_id, artifact.path.name, artifact.size)])
+
+
+@receiver(post_delete, sender=Artifact)
+def artifact_record_deletion(sender, **kwargs):
+    artifact = kwargs['instance']
+    # The changes of a deleted directory are deleted with it
+    if artifact.directory_id in getattr(_deferred, "deleted_directories", ()):
+        return
+    row = (artifact.directory_id, artifact.path.name, artifact.size)
+    if getattr(_deferred, "changes", None) is not None:
+        _deferred.changes.append(row)
+    else:
+        Change.record(Change.DELETED, [row])
+
+
+@receiver(post_save, sender=Artifact)
+@receiver(post_delete, sender=Artifact)
+def artifact_invalidate_listings(sender, **kwargs):
+    if getattr(_deferred, "directories", None) is not None:
+        _deferred.directories.add(kwargs['instance'].directory_id)
+    else:
+        _invalidate_on_commit([kwargs['instance'].directory_id])
+
+
+@receiver(post_save, sender=Directory)
+@receiver(post_delete, sender=Directory)
+def directory_invalidate_listings(sender, **kwargs):
+    _invalidate_on_commit([None])
+
+
+@receiver(pre_delete, sender=Directory)
+def directory_pre_delete(sender, **kwargs):
+    if getattr(_deferred, "deleted_directories", None) is None:
+        _deferred.deleted_directories = set()
+    _deferred.deleted_directories.add(kwargs['instance'].id)
+
+
+@receiver(post_delete, sender=Directory)
+def directory_post_delete(sender, **kwargs):
+    _deferred.deleted_directories.discard(kwargs['instance'].id)
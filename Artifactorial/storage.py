@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.db.models.fields.files import FieldFile
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+import binascii
+import errno
+import hashlib
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import threading
+
+
+# Length of the token added to the colliding names ("_" + 16 characters)
+TOKEN_LENGTH = 17
+
+LOGGER = logging.getLogger("Artifactorial.storage")
+
+
+class DirectLayout(object):
+    """
+    The files are stored at their logical path:
+    <directory>/YYYY/MM/DD/HH/MM/<filename>
+    """
+    # Sorting the physical paths gives the same order as the logical ones
+    ordered = True
+
+    def physical(self, name):
+        return name
+
+
+class HashedLayout(object):
+    """
+    The files are stored in a two levels fanout derived from the hash of the
+    logical path: ab/cd/abcd...  Every directory holds at most 256 entries
+    and the leaves grow evenly. The logical path only lives in the database.
+    """
+    ordered = False
+
+    def physical(self, name):
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return "%s/%s/%s" % (digest[0:2], digest[2:4], digest)
+
+
+LAYOUTS = {"direct": DirectLayout,
+           "hashed": HashedLayout}
+_layouts = {}
+
+
+def get_layout(name=None):
+    """
+    Return the layout called "name" ("direct", "hashed" or a dotted path),
+    ARTIFACTORIAL_LAYOUT by default.
+    """
+    if name is None:
+        name = getattr(settings, "ARTIFACTORIAL_LAYOUT", "direct")
+    if name not in _layouts:
+        _layouts[name] = LAYOUTS.get(name, None) or import_string(name)
+        _layouts[name] = _layouts[name]()
+    return _layouts[name]
+
+
+def previous_layouts():
+    return [get_layout(name)
+            for name in getattr(settings, "ARTIFACTORIAL_PREVIOUS_LAYOUTS", [])]
+
+
+@deconstructible
+class ArtifactStorage(FileSystemStorage):
+    """
+    Store the artifacts according to the configured layout.
+    The names (Artifact.path) are always the logical paths.
+
+    While relocating the files to a new layout, the files not yet moved are
+    looked up in ARTIFACTORIAL_PREVIOUS_LAYOUTS.
+
+    The names are not probed with exists() before saving: the files are
+    created with O_EXCL and a random token is added to the name on
+    collision.
+    """
+    def layout_path(self, name, layout):
+        return super(ArtifactStorage, self).path(layout.physical(name))
+
+    def path(self, name):
+        full_path = self.layout_path(name, get_layout())
+        for layout in previous_layouts():
+            if os.path.exists(full_path):
+                break
+            old_path = self.layout_path(name, layout)
+            if os.path.exists(old_path):
+                return old_path
+        return full_path
+
+    def get_available_name(self, name, max_length=None):
+        name = str(name).replace("\\", "/")
+        (dir_name, file_name) = os.path.split(name)
+        if ".." in dir_name.split("/"):
+            raise SuspiciousFileOperation("Detected path traversal attempt in '%s'" % dir_name)
+        # Keep room for the token
+        if max_length is not None and len(name) + TOKEN_LENGTH > max_length:
+            (file_root, file_ext) = os.path.splitext(file_name)
+            file_root = file_root[:max_length - TOKEN_LENGTH - len(name) + len(file_root)]
+            if not file_root:
+                raise SuspiciousFileOperation("The name '%s' is too long" % name)
+            name = os.path.join(dir_name, file_root + file_ext)
+        return name
+
+    def unique_name(self, name):
+        (file_root, file_ext) = os.path.splitext(name)
+        return "%s_%s%s" % (file_root, binascii.b2a_hex(os.urandom(8)).decode("utf-8"), file_ext)
+
+    def is_taken(self, name):
+        """
+        The names are unique across the storage roots: check the other roots
+        and the database (the file of a missing artifact is not on disk)
+        """
+        from Artifactorial.models import Artifact
+
+        for (root, location) in get_roots().items():
+            if os.path.abspath(location) == os.path.abspath(self.location):
+                continue
+            if os.path.exists(get_storage(root).path(name)):
+                return True
+        return Artifact.objects.filter(path=name).exists()
+
+    def _reserve(self, full_path):
+        try:
+            os.makedirs(os.path.dirname(full_path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        try:
+            return os.open(full_path, self.OS_OPEN_FLAGS, 0o666)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        return None
+
+    def _save(self, name, content):
+        # Reserve the name in this root before checking the other ones: of
+        # two concurrent uploads in different roots, at least the last one
+        # sees the file of the other. The retries are derived from the
+        # original name so that it does not grow with each collision.
+        original = name
+        while True:
+            full_path = self.path(name)
+            fd = self._reserve(full_path)
+            if fd is not None:
+                if not self.is_taken(name):
+                    break
+                os.close(fd)
+                os.unlink(full_path)
+            name = self.unique_name(original)
+
+        try:
+            if hasattr(content, "temporary_file_path"):
+                # Replace the reserved (empty) file
+                os.close(fd)
+                file_move_safe(content.temporary_file_path(), full_path,
+                               allow_overwrite=True)
+            else:
+                with os.fdopen(fd, "wb") as f_out:
+                    for chunk in content.chunks():
+                        if not isinstance(chunk, bytes):
+                            chunk = chunk.encode("utf-8")
+                        f_out.write(chunk)
+        except Exception:
+            os.unlink(full_path)
+            raise
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name.replace("\\", "/")
+
+
+_storages = {}
+
+
+def get_roots():
+    """
+    Return the storage roots: "" for MEDIA_ROOT and ARTIFACTORIAL_ROOTS
+    """
+    roots = {"": settings.MEDIA_ROOT}
+    roots.update(getattr(settings, "ARTIFACTORIAL_ROOTS", {}))
+    return roots
+
+
+def get_storage(root=""):
+    """
+    Return the storage of the root ("" for MEDIA_ROOT)
+    """
+    try:
+        location = get_roots()[root]
+    except KeyError:
+        raise ImproperlyConfigured("Unknown storage root '%s'" % root)
+    if (root, location) not in _storages:
+        _storages[(root, location)] = ArtifactStorage(location=location)
+    return _storages[(root, location)]
+
+
+def free_space(root):
+    try:
+        stat = os.statvfs(get_roots()[root])
+    except OSError:
+        return 0
+    return stat.f_bavail * stat.f_frsize
+
+
+def choose_root(directory=None, exclude=()):
+    """
+    Return the root where to store a new artifact: the root pinned on the
+    directory or one of ARTIFACTORIAL_PLACEMENT_ROOTS according to
+    ARTIFACTORIAL_PLACEMENT:
+    * "free_space": the root with the most free space
+    * "weighted": random choice according to ARTIFACTORIAL_ROOT_WEIGHTS
+    """
+    if directory is not None and directory.root:
+        return directory.root
+    roots = [root for root in getattr(settings, "ARTIFACTORIAL_PLACEMENT_ROOTS", [""])
+             if root not in exclude]
+    if not roots:
+        raise ImproperlyConfigured("No storage root available")
+    if len(roots) == 1:
+        return roots[0]
+
+    policy = getattr(settings, "ARTIFACTORIAL_PLACEMENT", "free_space")
+    if policy == "free_space":
+        return max(roots, key=free_space)
+    elif policy == "weighted":
+        weights = getattr(settings, "ARTIFACTORIAL_ROOT_WEIGHTS", {})
+        weights = [(root, weights.get(root, 1)) for root in roots]
+        value = random.uniform(0, sum([w for (_, w) in weights]))
+        for (root, weight) in weights:
+            value -= weight
+            if value <= 0 and weight:
+                return root
+        return roots[-1]
+    raise ImproperlyConfigured("Unknown placement policy '%s'" % policy)
+
+
+class ArtifactFieldFile(FieldFile):
+    """
+    The storage depends on the root where the artifact is stored
+    """
+    def _get_storage(self):
+        root = getattr(self.instance, "root", "")
+        if not root:
+            return self.field.storage
+        return get_storage(root)
+
+    def _set_storage(self, storage):
+        # Set by FieldFile.__init__
+        pass
+
+    storage = property(_get_storage, _set_storage)
+
+    def save(self, name, content, save=True):
+        # Place the new file
+        if not getattr(self.instance, "root", ""):
+            self.instance.root = choose_root(getattr(self.instance, "directory", None))
+        super(ArtifactFieldFile, self).save(name, content, save)
+
+
+class ArtifactFileField(models.FileField):
+    attr_class = ArtifactFieldFile
+
+
+def _copy(src, dst):
+    """
+    Copy src to dst and return the md5 of the data read
+    """
+    md5 = hashlib.md5()
+    with open(src, "rb") as f_in:
+        with open(dst, "wb") as f_out:
+            while True:
+                data = f_in.read(1024 * 1024)
+                if not data:
+                    break
+                md5.update(data)
+                f_out.write(data)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+    return md5.hexdigest()
+
+
+def _md5(filename):
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f_in:
+        while True:
+            data = f_in.read(1024 * 1024)
+            if not data:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def move_to_root(artifact, root):
+    """
+    Move the file of the artifact to another storage root:
+    1/ copy the file to a temporary name in the new root
+    2/ verify the copy (and the stored md5) before renaming it
+    3/ switch the artifact to the new root in the database
+    4/ remove the old file
+    The file stays downloadable from the old root until the switch.
+
+    :return: False if the artifact was removed meanwhile
+    """
+    src = artifact.path.path
+    dst = get_storage(root).path(artifact.path.name)
+    tmp = "%s.%s.tmp" % (dst, binascii.b2a_hex(os.urandom(4)).decode("utf-8"))
+    try:
+        os.makedirs(os.path.dirname(dst))
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    try:
+        md5 = _copy(src, tmp)
+        if _md5(tmp) != md5 or (artifact.md5 and artifact.md5 != md5):
+            raise IOError("Checksum mismatch when copying %s" % src)
+        # Never replace the file of another artifact
+        try:
+            os.link(tmp, dst)
+            os.unlink(tmp)
+        except OSError as exc:
+            if exc.errno == errno.EEXIST:
+                raise IOError("%s already exists" % dst)
+            if exc.errno not in [errno.EPERM, errno.ENOTSUP]:
+                raise
+            if os.path.exists(dst):
+                raise IOError("%s already exists" % dst)
+            os.rename(tmp, dst)
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    query = type(artifact).objects.filter(pk=artifact.pk)
+    if not query.filter(root=artifact.root).update(root=root):
+        # Unless moved concurrently to the same root
+        if not query.filter(root=root).exists():
+            os.unlink(dst)
+        return False
+    os.unlink(src)
+    artifact.root = root
+    return True
+
+
+_unlink_pool = None
+_unlink_lock = threading.Lock()
+
+
+def _unlink(filenames):
+    for filename in filenames:
+        try:
+            os.unlink(filename)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                LOGGER.warning("Unable to remove %s: %s", filename, exc)
+
+
+def unlink_later(filenames):
+    """
+    Remove the files in a background thread.
+    The files left by a crash are found by the reconcile command.
+    """
+    global _unlink_pool
+    with _unlink_lock:
+        if _unlink_pool is None:
+            _unlink_pool = ThreadPool(1)
+    return _unlink_pool.apply_async(_unlink, (list(filenames),))
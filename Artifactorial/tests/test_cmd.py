@@ -20,15 +20,22 @@
 from __future__ import unicode_literals
 
 from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.files.base import ContentFile
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
 
-from Artifactorial.models import Artifact, Directory
+from Artifactorial.management.commands import scrub
+from Artifactorial.models import Artifact, Directory, DirectoryUsage
+from Artifactorial.storage import get_layout
 
 import binascii
 from datetime import timedelta
+from io import StringIO
 import os
 import pytest
 import sys
+import time
 
 
 def bytes2unicode(string):
@@ -130,3 +137,383 @@ class TestClean(object):
         assert os.path.exists(user2_arts[0].path.path) == False
         assert os.path.exists(user2_arts[1].path.path) == False
         assert os.path.exists(user2_arts[2].path.path) == False
+
+
+class TestRollup(object):
+    def test_rollup(self, users):
+        dir1 = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        Directory.objects.create(path="/home/user2", user=users["u"][1])
+        for index in range(3):
+            Artifact.objects.create(directory=dir1, path="home/user1/%d" % index, size=10)
+
+        call_command("rollup")
+        assert DirectoryUsage.objects.count() == 2
+        usage = DirectoryUsage.objects.get(directory=dir1)
+        assert usage.size == 30
+        assert usage.artifacts == 3
+        assert usage.uploads == 0
+
+        # Update the snapshot of the current hour
+        DirectoryUsage.record(dir1, uploads=1, uploaded_bytes=10)
+        Artifact.objects.create(directory=dir1, path="home/user1/3", size=10)
+        call_command("rollup")
+        usage = DirectoryUsage.objects.get(directory=dir1)
+        assert usage.size == 40
+        assert usage.artifacts == 4
+        assert usage.uploads == 1
+        assert usage.uploaded_bytes == 10
+
+        # Expired artifacts
+        dir1.ttl = 1
+        dir1.save()
+        Artifact.objects.filter(path="home/user1/0").update(created_at=timezone.now() - timedelta(days=2))
+        call_command("clean")
+        usage = DirectoryUsage.objects.get(directory=dir1)
+        assert usage.expired == 1
+        assert usage.expired_bytes == 10
+        assert usage.size == 30
+
+        DirectoryUsage.objects.update(timestamp=timezone.now() - timedelta(days=3))
+        call_command("rollup", keep=2)
+        assert DirectoryUsage.objects.filter(timestamp__lt=timezone.now() - timedelta(days=2)).count() == 0
+        assert DirectoryUsage.objects.count() == 2
+
+
+class TestScrub(object):
+    def test_scrub(self, db, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+        settings.ARTIFACTORIAL_THROTTLE_ROOT = str(tmpdir.mkdir("throttle"))
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        root = tmpdir.join("media").mkdir("pub")
+        for name in ["good.txt", "new.txt", "bad.txt", "missing.txt"]:
+            if name != "missing.txt":
+                root.join(name).write("some sort of test data")
+            Artifact.objects.create(directory=pub, path="pub/%s" % name, size=22)
+        Artifact.objects.filter(path="pub/good.txt").update(md5="600ae9d6304b5d939e3dc10191536c58")
+        Artifact.objects.filter(path="pub/bad.txt").update(md5="0" * 32)
+
+        out = StringIO()
+        err = StringIO()
+        with pytest.raises(CommandError):
+            call_command("scrub", workers=2, rate=100, stdout=out, stderr=err)
+        assert "Checked 4 artifacts" in out.getvalue()
+        assert "* backfilled: 1" in out.getvalue()
+        assert "Corrupted: pub/bad.txt" in err.getvalue()
+        assert "Unreadable: pub/missing.txt" in err.getvalue()
+        assert Artifact.objects.get(path="pub/new.txt").md5 == "600ae9d6304b5d939e3dc10191536c58"
+        assert Artifact.objects.filter(verified_at=None).count() == 0
+
+        # Nothing to check before the interval
+        out = StringIO()
+        call_command("scrub", stdout=out)
+        assert "Checked 0 artifacts" in out.getvalue()
+
+        # Move the corrupted file away
+        quarantine = tmpdir.join("quarantine")
+        with pytest.raises(CommandError):
+            call_command("scrub", interval=0, quarantine=str(quarantine),
+                         stdout=StringIO(), stderr=StringIO())
+        assert quarantine.join("pub", "bad.txt").check()
+        assert not root.join("bad.txt").check()
+        assert not Artifact.objects.filter(path="pub/bad.txt").exists()
+
+    def test_resume(self, db, monkeypatch, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        root = tmpdir.mkdir("pub")
+        for index in range(5):
+            root.join("%d.txt" % index).write("data")
+            Artifact.objects.create(directory=pub, path="pub/%d.txt" % index)
+
+        # Nothing is checked after the deadline
+        call_command("scrub", batch_size=2, duration=0, stdout=StringIO())
+        assert Artifact.objects.exclude(verified_at=None).count() == 0
+
+        # The clock jumps past the deadline after the first checkpoint
+        class Clock(object):
+            @staticmethod
+            def time():
+                return 3600 if Artifact.objects.exclude(verified_at=None).exists() else 0
+
+        monkeypatch.setattr(scrub, "time", Clock)
+        out = StringIO()
+        call_command("scrub", batch_size=2, duration=60, stdout=out)
+        assert "Checked 2 artifacts" in out.getvalue()
+        assert sorted(Artifact.objects.exclude(verified_at=None).values_list("path", flat=True)) == \
+            ["pub/0.txt", "pub/1.txt"]
+        monkeypatch.undo()
+
+        # The second run continues with the other artifacts
+        out = StringIO()
+        call_command("scrub", batch_size=2, stdout=out)
+        assert "Checked 3 artifacts" in out.getvalue()
+        assert Artifact.objects.filter(verified_at=None).count() == 0
+
+
+class TestReconcile(object):
+    def test_reconcile(self, client, db, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        root = tmpdir.mkdir("pub")
+        # "pub/a.txt" is sorted before "pub/a/..." but "a" before "a.txt"
+        for name in ["a.txt", "a/b.txt", "a/c/d.txt", "z.txt"]:
+            root.join(name).write("data", ensure=True)
+            Artifact.objects.create(directory=pub, path="pub/%s" % name)
+        Artifact.objects.create(directory=pub, path="pub/a/gone.txt", size=10)
+        Artifact.objects.create(directory=pub, path="pub/zz/gone.txt", size=20)
+        root.join("a", "orphan.txt").write("orphan", ensure=True)
+        root.join("orphan.txt").write("new")
+        old = time.time() - 7200
+        os.utime(str(root.join("a", "orphan.txt")), (old, old))
+        tmpdir.join("lost+found", "file").write("ignored", ensure=True)
+
+        out = StringIO()
+        call_command("reconcile", exclude=["lost+found"], chunk_size=2, workers=2,
+                     list=True, stdout=out)
+        lines = out.getvalue().splitlines()
+        assert "* orphan: pub/a/orphan.txt" in lines
+        assert "* orphan: pub/orphan.txt" in lines
+        assert "* missing: pub/a/gone.txt" in lines
+        assert "* missing: pub/zz/gone.txt" in lines
+        assert "Orphan files: 2 (9 bytes)" in lines
+        assert "Missing files: 2 (30 bytes)" in lines
+
+        # Only remove old orphans
+        out = StringIO()
+        call_command("reconcile", exclude=["lost+found"], delete_orphans=True,
+                     mark_missing=True, stdout=out)
+        assert "* removed: 1" in out.getvalue()
+        assert "* marked: 2" in out.getvalue()
+        assert not root.join("a", "orphan.txt").check()
+        assert root.join("orphan.txt").check()
+        assert tmpdir.join("lost+found", "file").check()
+        assert sorted(Artifact.objects.filter(is_missing=True).values_list("path", flat=True)) == \
+            ["pub/a/gone.txt", "pub/zz/gone.txt"]
+        response = client.get("/artifacts/pub/a/gone.txt")
+        assert response.status_code == 410
+
+        # Restored from a backup
+        root.join("a", "gone.txt").write("back")
+        out = StringIO()
+        call_command("reconcile", mark_missing=True, exclude=["lost+found"], stdout=out)
+        assert "* found again: 1" in out.getvalue()
+        assert not Artifact.objects.get(path="pub/a/gone.txt").is_missing
+
+    def test_relocating(self, db, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            tmpdir.join("pub", name).write(name, ensure=True)
+            Artifact.objects.create(directory=pub, path="pub/%s" % name)
+        Artifact.objects.create(directory=pub, path="pub/gone.txt", size=10)
+        Artifact.objects.filter(path="pub/b.txt").update(is_missing=True)
+
+        # Half relocated: only a.txt was moved
+        settings.ARTIFACTORIAL_LAYOUT = "hashed"
+        settings.ARTIFACTORIAL_PREVIOUS_LAYOUTS = ["direct"]
+        storage = Artifact._meta.get_field("path").storage
+        os.renames(str(tmpdir.join("pub", "a.txt")),
+                   storage.layout_path("pub/a.txt", get_layout("hashed")))
+
+        out = StringIO()
+        call_command("reconcile", chunk_size=2, delete_orphans=True, min_age=0,
+                     mark_missing=True, list=True, stdout=out)
+        lines = out.getvalue().splitlines()
+        assert "Orphan files: 0 (0 bytes)" in lines
+        assert "* missing: pub/gone.txt" in lines
+        assert "Missing files: 1 (10 bytes)" in lines
+        assert "* found again: 1" in lines
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            artifact = Artifact.objects.get(path="pub/%s" % name)
+            assert not artifact.is_missing
+            assert open(artifact.path.path).read() == name
+        assert Artifact.objects.get(path="pub/gone.txt").is_missing
+
+
+class TestRelocate(object):
+    def test_relocate(self, client, db, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        for name in ["a.txt", "2026/10/19/12/00/b.txt"]:
+            tmpdir.join("pub", name).write(name, ensure=True)
+            Artifact.objects.create(directory=pub, path="pub/%s" % name)
+        Artifact.objects.create(directory=pub, path="pub/gone.txt")
+
+        # Served from the previous layout while relocating
+        settings.ARTIFACTORIAL_LAYOUT = "hashed"
+        settings.ARTIFACTORIAL_PREVIOUS_LAYOUTS = ["direct"]
+        response = client.get("/artifacts/pub/a.txt")
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == b"a.txt"
+
+        out = StringIO()
+        call_command("relocate", chunk_size=2, dry_run=True, stdout=out)
+        assert "Moved: 2 (27 bytes)" in out.getvalue()
+        assert tmpdir.join("pub", "a.txt").check()
+
+        out = StringIO()
+        call_command("relocate", chunk_size=2, stdout=out)
+        assert "Moved: 2 (27 bytes)" in out.getvalue()
+        assert "Missing: 1" in out.getvalue()
+        assert not tmpdir.join("pub", "a.txt").check()
+        artifact = Artifact.objects.get(path="pub/a.txt")
+        assert os.path.relpath(artifact.path.path, str(tmpdir)) == \
+            "e7/db/e7dbcd880b8a9f03cf916c1b9d8442ce4f9e4214"
+        response = client.get("/artifacts/pub/a.txt")
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == b"a.txt"
+
+        out = StringIO()
+        call_command("relocate", stdout=out)
+        assert "Already moved: 2" in out.getvalue()
+
+        # The physical paths are not sorted like the logical ones
+        settings.ARTIFACTORIAL_PREVIOUS_LAYOUTS = []
+        call_command("clean", stdout=StringIO())
+        out = StringIO()
+        call_command("reconcile", chunk_size=2, list=True, stdout=out)
+        assert "Orphan files: 0 (0 bytes)" in out.getvalue()
+        assert "* missing: pub/gone.txt" in out.getvalue()
+        assert "Missing files: 1 (0 bytes)" in out.getvalue()
+
+        Artifact.objects.get(path="pub/a.txt").delete()
+        assert not os.path.exists(artifact.path.path)
+
+        with pytest.raises(CommandError):
+            call_command("relocate", stdout=StringIO())
+
+
+class TestTier(object):
+    def test_tier(self, client, db, settings, tmpdir):
+        hot = tmpdir.mkdir("hot")
+        cold = tmpdir.mkdir("cold")
+        settings.MEDIA_ROOT = str(hot)
+        settings.ARTIFACTORIAL_ROOTS = {"cold": str(cold)}
+        pub = Directory.objects.create(path="/pub", is_public=True, cold_after=10)
+        tmp = Directory.objects.create(path="/tmp", is_public=True)
+        for path in ["pub/old.txt", "pub/read.txt", "pub/new.txt", "pub/bad.txt", "tmp/old.txt"]:
+            hot.join(path).write("some sort of test data", ensure=True)
+            Artifact.objects.create(directory=Directory.objects.get(path="/" + os.path.dirname(path)),
+                                    path=path)
+        Artifact.objects.exclude(path="pub/new.txt").update(created_at=timezone.now() - timedelta(days=20))
+        Artifact.objects.filter(path="pub/old.txt").update(md5="600ae9d6304b5d939e3dc10191536c58")
+        Artifact.objects.filter(path="pub/bad.txt").update(md5="0" * 32)
+        response = client.get("/artifacts/pub/read.txt")
+        assert response.status_code == 200
+        assert Artifact.objects.get(path="pub/read.txt").accessed_at is not None
+
+        out = StringIO()
+        call_command("tier", dry_run=True, stdout=out)
+        assert "Moved to cold: 2 (44 bytes)" in out.getvalue()
+
+        out = StringIO()
+        err = StringIO()
+        with pytest.raises(CommandError):
+            call_command("tier", batch_size=1, stdout=out, stderr=err)
+        assert "Moved to cold: 1 (22 bytes)" in out.getvalue()
+        assert "Unable to move pub/bad.txt: Checksum mismatch" in err.getvalue()
+        assert sorted(Artifact.objects.filter(root="cold").values_list("path", flat=True)) == \
+            ["pub/old.txt"]
+        assert not hot.join("pub", "old.txt").check()
+        assert cold.join("pub", "old.txt").check()
+        assert hot.join("pub", "bad.txt").check()
+        assert not cold.join("pub", "bad.txt").check()
+        assert len(cold.join("pub").listdir()) == 1
+
+        # Served from the cold storage
+        response = client.get("/artifacts/pub/old.txt")
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == b"some sort of test data"
+        out = StringIO()
+        call_command("reconcile", stdout=out)
+        assert "Orphan files: 0 (0 bytes)" in out.getvalue()
+        assert "Missing files: 0 (0 bytes)" in out.getvalue()
+
+        Artifact.objects.get(path="pub/old.txt").delete()
+        assert not cold.join("pub", "old.txt").check()
+
+        with pytest.raises(CommandError):
+            call_command("tier", root="unknown", stdout=StringIO())
+
+
+class TestRebalance(object):
+    def test_rebalance(self, client, db, settings, tmpdir):
+        disks = [tmpdir.mkdir("disk1"), tmpdir.mkdir("disk2")]
+        settings.MEDIA_ROOT = str(disks[0])
+        settings.ARTIFACTORIAL_ROOTS = {"disk2": str(disks[1])}
+        settings.ARTIFACTORIAL_PLACEMENT_ROOTS = ["", "disk2"]
+        settings.ARTIFACTORIAL_PLACEMENT = "weighted"
+        settings.ARTIFACTORIAL_ROOT_WEIGHTS = {"": 0, "disk2": 1}
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        pinned = Directory.objects.create(path="/pinned", is_public=True, root="disk2")
+
+        for name in ["a.txt", "b.txt"]:
+            artifact = Artifact(directory=pub, is_permanent=True)
+            artifact.path.save(name, ContentFile(b"data"))
+        assert list(Artifact.objects.order_by("id").values_list("root", flat=True)) == ["disk2", "disk2"]
+        assert disks[1].join("pub", "a.txt").check()
+
+        # Drain disk2
+        settings.ARTIFACTORIAL_PLACEMENT = "free_space"
+        out = StringIO()
+        call_command("rebalance", source="disk2", bytes=1, stdout=out)
+        assert "Moved: 1 (4 bytes)" in out.getvalue()
+        call_command("rebalance", source="disk2", stdout=StringIO())
+        assert list(Artifact.objects.order_by("id").values_list("root", flat=True)) == ["", ""]
+        assert disks[0].join("pub", "b.txt").check()
+        assert not disks[1].join("pub", "b.txt").check()
+        response = client.get("/artifacts/pub/b.txt")
+        assert b"".join(response.streaming_content) == b"data"
+
+        # Move the artifacts to the pinned root
+        disks[0].join("pinned", "c.txt").write("pinned", ensure=True)
+        Artifact.objects.create(directory=pinned, path="pinned/c.txt")
+        out = StringIO()
+        call_command("rebalance", stdout=out)
+        assert "Moved: 1 (6 bytes)" in out.getvalue()
+        assert Artifact.objects.get(path="pinned/c.txt").root == "disk2"
+        assert disks[1].join("pinned", "c.txt").read() == "pinned"
+
+        with pytest.raises(CommandError):
+            call_command("rebalance", source="unknown", stdout=StringIO())
+
+
+class TestPopulate(object):
+    def test_populate(self, db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        with open(os.devnull, "w") as devnull:
+            call_command("populate", prefix="/a", seed=42, users=5, groups=2,
+                         directories=10, artifacts=200, files="sparse",
+                         sizes="uniform:1,1000", max_age=10, stdout=devnull)
+            call_command("populate", prefix="/b", seed=42, users=5, groups=2,
+                         directories=10, artifacts=200, files="none",
+                         sizes="uniform:1,1000", max_age=10, stdout=devnull)
+
+        assert Directory.objects.filter(path__startswith="/a/").count() == 10
+        assert Artifact.objects.filter(path__startswith="a/").count() == 200
+        assert User.objects.filter(username__startswith="a-user-").count() == 5
+        assert Group.objects.filter(name__startswith="a-group-").count() == 2
+
+        # Same seed => same shape
+        shape_a = sorted([(a.directory.path[3:], os.path.basename(a.path.name), a.is_permanent)
+                          for a in Artifact.objects.filter(path__startswith="a/")])
+        shape_b = sorted([(a.directory.path[3:], os.path.basename(a.path.name), a.is_permanent)
+                          for a in Artifact.objects.filter(path__startswith="b/")])
+        assert shape_a == shape_b
+
+        for artifact in Artifact.objects.filter(path__startswith="a/"):
+            assert 1 <= artifact.path.size < 1000
+            assert timezone.now() - artifact.created_at <= timedelta(days=10)
+            # The path matches the upload date
+            if not artifact.is_permanent:
+                assert timezone.localtime(artifact.created_at).strftime("/%Y/%m/%d/%H/%M/") in artifact.path.name
+        # The upload dates are spread (not overridden by auto_now_add)
+        oldest = Artifact.objects.filter(path__startswith="a/").order_by("created_at")[0]
+        assert timezone.now() - oldest.created_at > timedelta(days=1)
+        assert Artifact._meta.get_field("created_at").auto_now_add
+        assert not os.path.exists(str(media.join("b")))
+
+        # Prefix already populated
+        with pytest.raises(CommandError):
+            call_command("populate", prefix="/a", stdout=open(os.devnull, "w"))
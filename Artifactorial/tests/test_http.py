@@ -21,17 +21,29 @@ from __future__ import unicode_literals
 
 from django.contrib.auth.models import AnonymousUser, Group, User
 from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from django.urls import reverse
+from django.utils import timezone
 
-from Artifactorial.models import Artifact, AuthToken, Directory, Share
+from Artifactorial.models import ArchiveMember, Artifact, AuthToken, Change, Directory, DirectoryUsage, Share
+from Artifactorial import grep as a_grep
+from Artifactorial import metrics as a_metrics
+from Artifactorial import throttling
+from Artifactorial.storage import ArtifactStorage, move_to_root
 
 import base64
 import binascii
+import io
 from datetime import timedelta
+import json
 import os
 import pytest
 import re
 import sys
+import tarfile
+import time
+import zipfile
 
 
 def bytes2unicode(string):
@@ -183,6 +195,796 @@ class TestDirectories(object):
         assert response.context["directories"][2][0].path == "/home/user3"
         assert response.context["directories"][2][1] == True
 
+    def test_usage_and_json(self, client, db, users, django_assert_max_num_queries):
+        token = AuthToken.objects.create(user=users["u"][1])
+        grp1 = Directory.objects.create(path="/home/grp1", group=users["g"][0], quota=1000)
+        Directory.objects.create(path="/home/grp2", group=users["g"][1])
+        Directory.objects.create(path="/pub", is_public=True)
+        for index in range(20):
+            Artifact.objects.create(directory=grp1, path="home/grp1/%d.txt" % index, size=10)
+
+        # The token, the groups of the user and the annotated directories
+        with django_assert_max_num_queries(3):
+            response = client.get("%s?token=%s" % (reverse("directories.index"), token.secret))
+        assert response.status_code == 200
+        dirs = response.context["directories"]
+        assert [(d.path, w) for (d, w) in dirs] == [("/home/grp1", True), ("/pub", True)]
+        assert dirs[0][0].size() == 200
+        assert dirs[0][0].artifacts_count == 20
+        assert dirs[0][0].quota_progress() == 20
+        assert dirs[1][0].size() == 0
+        assert dirs[1][0].last_upload is None
+
+        response = client.get("%s?format=json&token=%s" % (reverse("directories.index"), token.secret))
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/json"
+        data = json.loads(response.content.decode("utf-8"))
+        assert [d["path"] for d in data["directories"]] == ["/home/grp1", "/pub"]
+        assert data["directories"][0]["group"] == "grp1"
+        assert data["directories"][0]["size"] == 200
+        assert data["directories"][0]["artifacts"] == 20
+        assert data["directories"][0]["progress"] == 20
+        assert data["directories"][0]["last_upload"] is not None
+        assert data["directories"][1]["last_upload"] is None
+
+        # The names are escaped
+        weird = Group.objects.create(name='r"&\\d')
+        users["u"][1].groups.add(weird)
+        Directory.objects.create(path="/r&d", group=weird)
+        response = client.get("%s?format=json&token=%s" % (reverse("directories.index"), token.secret))
+        data = json.loads(response.content.decode("utf-8"))
+        assert [(d["path"], d["group"]) for d in data["directories"]] == \
+            [("/home/grp1", "grp1"), ("/pub", None), ("/r&d", 'r"&\\d')]
+
+        response = client.get("%s?format=yaml" % reverse("directories.index"))
+        assert response.status_code == 400
+
+    def test_pagination(self, client, db):
+        for index in range(5):
+            Directory.objects.create(path="/pub/%d" % index, is_public=True)
+
+        response = client.get(reverse("directories.index"))
+        assert len(response.context["directories"]) == 5
+        assert response.context["page"] is None
+
+        response = client.get("%s?page=2&per_page=2" % reverse("directories.index"))
+        assert response.status_code == 200
+        assert [d.path for (d, _) in response.context["directories"]] == ["/pub/2", "/pub/3"]
+
+        response = client.get("%s?page=3&per_page=2&format=json" % reverse("directories.index"))
+        data = json.loads(response.content.decode("utf-8"))
+        assert [d["path"] for d in data["directories"]] == ["/pub/4"]
+        assert data["page"] == 3
+        assert data["pages"] == 3
+        assert data["count"] == 5
+
+        response = client.get("%s?page=4&per_page=2" % reverse("directories.index"))
+        assert response.status_code == 404
+        response = client.get("%s?page=a" % reverse("directories.index"))
+        assert response.status_code == 400
+
+
+class TestUsage(object):
+    def test_usage(self, client, settings, tmpdir, users):
+        settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+        filename = str(tmpdir.join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("Hello World!!!")
+        Directory.objects.create(path="/home/user1", user=users["u"][0])
+        token = AuthToken.objects.create(user=users["u"][0])
+        url = reverse("directories.usage")
+
+        urls = []
+        for _ in range(2):
+            with open(filename, "r") as f_in:
+                response = client.post(reverse("artifacts", args=["home/user1"]),
+                                       data={"path": f_in, "token": token.secret})
+            assert response.status_code == 200
+            urls.append(bytes2unicode(response.content)[len("http://testserver"):])
+        response = client.delete("%s?token=%s" % (urls[0], token.secret))
+        assert response.status_code == 200
+        call_command("rollup")
+
+        response = client.get("%s?token=%s&resolution=hour" % (url, token.secret))
+        assert response.status_code == 200
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["resolution"] == "hour"
+        assert len(data["directories"]) == 1
+        assert data["directories"][0]["path"] == "/home/user1"
+        usage = data["directories"][0]["usage"]
+        assert len(usage) == 1
+        assert usage[0]["uploads"] == 2
+        assert usage[0]["uploaded_bytes"] == 28
+        assert usage[0]["deletes"] == 1
+        assert usage[0]["deleted_bytes"] == 14
+        assert usage[0]["size"] == 14
+        assert usage[0]["artifacts"] == 1
+
+        # Previous hours are merged in the daily view
+        DirectoryUsage.objects.filter(size=None).update(size=0)
+        previous = DirectoryUsage.objects.get()
+        previous.pk = None
+        previous.timestamp = previous.timestamp.replace(hour=0) - timedelta(hours=1)
+        previous.save()
+        response = client.get("%s?token=%s&path=/home/user1" % (url, token.secret))
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["resolution"] == "day"
+        assert [u["uploads"] for u in data["directories"][0]["usage"]] == [2, 2]
+
+        # The directory is private
+        response = client.get("%s?path=/home/user1" % url)
+        assert response.status_code == 404
+        response = client.get(url)
+        assert json.loads(response.content.decode("utf-8"))["directories"] == []
+        response = client.get("%s?resolution=week" % url)
+        assert response.status_code == 400
+
+
+class TestListingCache(object):
+    def test_cache(self, client, settings, tmpdir, transactional_db, users,
+                   django_assert_max_num_queries):
+        settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                       "LOCATION": "test-listing-cache"}}
+        settings.ARTIFACTORIAL_LISTING_CACHE_TIMEOUT = 300
+        settings.MEDIA_ROOT = str(tmpdir)
+        tmpdir.mkdir("pub").join("a.txt").write("a")
+        tmpdir.join("pub", "b.txt").write("b")
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        Directory.objects.create(path="/pub/private", user=users["u"][0])
+        Artifact.objects.create(directory=pub, path="pub/a.txt", size=1)
+        url = "%s?format=json" % reverse("artifacts", args=["pub/"])
+
+        hits = a_metrics.LISTING_CACHE_HITS._value.get()
+        response = client.get(url)
+        assert response.status_code == 200
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["directories"] == []
+        assert [f["path"] for f in data["files"]] == ["a.txt"]
+
+        # Served from the cache
+        with django_assert_max_num_queries(0):
+            cached = client.get(url)
+        assert cached.content == response.content
+        assert cached["Content-Type"] == "application/json"
+        assert a_metrics.LISTING_CACHE_HITS._value.get() == hits + 1
+
+        # The private directory is only visible to its owner
+        token = AuthToken.objects.create(user=users["u"][0])
+        response = client.get("%s&token=%s" % (url, token.secret))
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["directories"] == ["private"]
+
+        # Uploads and deletions invalidate the listing
+        artifact = Artifact.objects.create(directory=pub, path="pub/b.txt", size=1)
+        data = json.loads(client.get(url).content.decode("utf-8"))
+        assert [f["path"] for f in data["files"]] == ["a.txt", "b.txt"]
+        artifact.delete()
+        data = json.loads(client.get(url).content.decode("utf-8"))
+        assert [f["path"] for f in data["files"]] == ["a.txt"]
+
+        # The listing is invalidated after the commit: a listing cached
+        # meanwhile by another request would otherwise be kept
+        with transaction.atomic():
+            Artifact.objects.create(directory=pub, path="pub/b.txt", size=1)
+            with django_assert_max_num_queries(0):
+                cached = client.get(url)
+            assert [f["path"] for f in json.loads(cached.content.decode("utf-8"))["files"]] == ["a.txt"]
+        data = json.loads(client.get(url).content.decode("utf-8"))
+        assert [f["path"] for f in data["files"]] == ["a.txt", "b.txt"]
+
+        # And so do the changes to the directories
+        Directory.objects.create(path="/pub/other", is_public=True)
+        data = json.loads(client.get(url).content.decode("utf-8"))
+        assert data["directories"] == ["other"]
+
+
+class TestSearch(object):
+    def search(self, client, **params):
+        response = client.get(reverse("search"), params)
+        assert response.status_code == 200
+        return json.loads(response.content.decode("utf-8"))
+
+    def paths(self, client, **params):
+        return [r["path"] for r in self.search(client, **params)["results"]]
+
+    def test_search(self, client, users):
+        lava = Directory.objects.create(path="/lava", is_public=True)
+        private = Directory.objects.create(path="/private", user=users["u"][0])
+        Artifact.objects.bulk_create([
+            Artifact(directory=lava, path="lava/2026/jobs/1/board.dtb", size=10),
+            Artifact(directory=lava, path="lava/2026/jobs/2/board.dtb", size=10),
+            Artifact(directory=lava, path="lava/2026/jobs/2/kernel.log", size=10),
+            Artifact(directory=lava, path="lava/2026/jobs/2/ramdisk_50%.img", size=10),
+            Artifact(directory=private, path="private/board.dtb", size=10)])
+
+        assert self.paths(client, glob="*.dtb") == ["/lava/2026/jobs/1/board.dtb",
+                                                    "/lava/2026/jobs/2/board.dtb"]
+        assert self.paths(client, glob="*/jobs/[!1]/*.dtb") == ["/lava/2026/jobs/2/board.dtb"]
+        assert self.paths(client, glob="*/?/kernel.*") == ["/lava/2026/jobs/2/kernel.log"]
+        assert self.paths(client, substring="disk_50%") == ["/lava/2026/jobs/2/ramdisk_50%.img"]
+        assert self.paths(client, substring="disk_5%") == []
+        assert self.paths(client, regex=r"jobs/\d/k.*\.log$") == ["/lava/2026/jobs/2/kernel.log"]
+        assert self.paths(client, regex=r"(kernel|ramdisk)") == ["/lava/2026/jobs/2/kernel.log",
+                                                                 "/lava/2026/jobs/2/ramdisk_50%.img"]
+
+        # Prefix
+        assert self.paths(client, glob="*.dtb", prefix="/lava/2026/jobs/2/") == ["/lava/2026/jobs/2/board.dtb"]
+
+        # Visibility
+        token = AuthToken.objects.create(user=users["u"][0])
+        assert self.paths(client, glob="*.dtb", token=token.secret) == ["/lava/2026/jobs/1/board.dtb",
+                                                                         "/lava/2026/jobs/2/board.dtb",
+                                                                         "/private/board.dtb"]
+        data = self.search(client, substring="private/board", token=token.secret)
+        assert data["results"][0]["url"] == "http://testserver/artifacts/private/board.dtb"
+        assert data["results"][0]["size"] == 10
+
+        # The index is updated on delete
+        Artifact.objects.get(path="lava/2026/jobs/1/board.dtb").delete()
+        assert self.paths(client, glob="*.dtb") == ["/lava/2026/jobs/2/board.dtb"]
+
+    def test_dates_and_pages(self, client, db):
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        for index in range(5):
+            Artifact.objects.create(directory=pub, path="pub/file-%d.txt" % index)
+        Artifact.objects.filter(path="pub/file-0.txt").update(created_at=timezone.now() - timedelta(days=10))
+
+        assert len(self.paths(client, glob="*.txt")) == 5
+        since = (timezone.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        assert len(self.paths(client, glob="*.txt", since=since)) == 4
+        assert self.paths(client, glob="*.txt", until=since) == ["/pub/file-0.txt"]
+
+        data = self.search(client, substring="file", per_page=2, page=2)
+        assert [r["path"] for r in data["results"]] == ["/pub/file-2.txt", "/pub/file-3.txt"]
+        assert data["next"] == True
+        data = self.search(client, substring="file", per_page=2, page=3)
+        assert [r["path"] for r in data["results"]] == ["/pub/file-4.txt"]
+        assert data["next"] == False
+
+        url = reverse("search")
+        assert client.get(url).status_code == 400
+        assert client.get(url, {"glob": "*", "regex": "a"}).status_code == 400
+        assert client.get(url, {"regex": "a("}).status_code == 400
+        assert client.get(url, {"glob": "*", "since": "yesterday"}).status_code == 400
+        assert client.get(url, {"glob": "*", "page": 0}).status_code == 400
+
+    def test_expensive_patterns(self, client, settings, db):
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        Artifact.objects.create(directory=pub, path="pub/" + "a" * 200)
+
+        url = reverse("search")
+        for regex in ["(a+)+$", "(a|aa)*$", r"(a)\1", ".*a.*a.*a.*b", "a" * 257]:
+            assert client.get(url, {"regex": regex}).status_code == 400
+        assert client.get(url, {"glob": "*a*a*a*b"}).status_code == 400
+        assert self.paths(client, regex="a{2}.*a+$") == ["/pub/" + "a" * 200]
+        assert self.paths(client, glob="*a*a*") == ["/pub/" + "a" * 200]
+
+        settings.ARTIFACTORIAL_SEARCH_REGEX_MAX_REPEATS = 4
+        assert self.paths(client, glob="*a*a*a*") == ["/pub/" + "a" * 200]
+        settings.ARTIFACTORIAL_SEARCH_REGEX_MAX_LENGTH = 10
+        assert client.get(url, {"regex": "a" * 11}).status_code == 400
+
+
+class TestCollisions(object):
+    def test_unique_names(self, client, monkeypatch, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        filename = str(tmpdir.join("console.log"))
+        Directory.objects.create(path="/home/user1", user=users["u"][0])
+        token = AuthToken.objects.create(user=users["u"][0])
+
+        urls = []
+        for index in range(3):
+            with open(filename, "w") as f_out:
+                f_out.write("run %d" % index)
+            with open(filename, "r") as f_in:
+                response = client.post(reverse("artifacts", args=["home/user1"]),
+                                       data={"path": f_in, "token": token.secret,
+                                             "is_permanent": True})
+            assert response.status_code == 200
+            urls.append(bytes2unicode(response.content)[len("http://testserver"):])
+        assert urls[0] == "/artifacts/home/user1/console.log"
+        for url in urls[1:]:
+            assert re.match(r"^/artifacts/home/user1/console_[0-9a-f]{16}\.log$", url)
+        assert len(set(urls)) == 3
+        assert sorted(os.listdir(str(media.join("home", "user1")))) == \
+            sorted([os.path.basename(url) for url in urls])
+
+        # The original name is kept for the downloads
+        for (index, url) in enumerate(urls):
+            response = client.get("%s?token=%s" % (url, token.secret))
+            assert response.status_code == 200
+            assert response["Content-Disposition"] == 'inline; filename="console.log"'
+            assert b"".join(response.streaming_content) == ("run %d" % index).encode("utf-8")
+        artifact = Artifact.objects.get(path=urls[1][len("/artifacts/"):])
+        assert artifact.filename == "console.log"
+
+        # The retries do not stack the suffixes
+        taken = [True, True, False]
+        monkeypatch.setattr(ArtifactStorage, "is_taken", lambda self, name: taken.pop(0))
+        with open(filename, "r") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"path": f_in, "token": token.secret,
+                                         "is_permanent": True})
+        assert response.status_code == 200
+        url = bytes2unicode(response.content)[len("http://testserver"):]
+        assert re.match(r"^/artifacts/home/user1/console_[0-9a-f]{16}\.log$", url)
+        assert taken == []
+        monkeypatch.undo()
+
+        # Non-ascii names are quoted
+        filename = str(tmpdir.join("résumé.log"))
+        with open(filename, "w") as f_out:
+            f_out.write("data")
+        with open(filename, "r") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"path": f_in, "token": token.secret,
+                                         "is_permanent": True})
+        assert response.status_code == 200
+        response = client.get(reverse("artifacts", args=["home/user1/résumé.log"]), {"token": token.secret})
+        assert response.status_code == 200
+        assert response["Content-Disposition"] == "inline; filename*=utf-8''r%C3%A9sum%C3%A9.log"
+
+    def test_unique_across_roots(self, client, db, settings, tmpdir):
+        disks = [tmpdir.mkdir("disk1"), tmpdir.mkdir("disk2")]
+        settings.MEDIA_ROOT = str(disks[0])
+        settings.ARTIFACTORIAL_ROOTS = {"disk2": str(disks[1])}
+        settings.ARTIFACTORIAL_PLACEMENT_ROOTS = ["", "disk2"]
+        settings.ARTIFACTORIAL_PLACEMENT = "weighted"
+        Directory.objects.create(path="/pub", is_public=True)
+        filename = str(tmpdir.join("a.txt"))
+
+        urls = []
+        for (index, weights) in enumerate([{"": 0, "disk2": 1}, {"": 1, "disk2": 0}]):
+            settings.ARTIFACTORIAL_ROOT_WEIGHTS = weights
+            with open(filename, "w") as f_out:
+                f_out.write("run %d" % index)
+            with open(filename, "r") as f_in:
+                response = client.post(reverse("artifacts", args=["pub"]),
+                                       data={"path": f_in, "is_permanent": True})
+            assert response.status_code == 200
+            urls.append(bytes2unicode(response.content)[len("http://testserver"):])
+        assert urls[0] == "/artifacts/pub/a.txt"
+        assert re.match(r"^/artifacts/pub/a_[0-9a-f]{16}\.txt$", urls[1])
+        assert list(Artifact.objects.order_by("id").values_list("root", flat=True)) == ["disk2", ""]
+        for (index, url) in enumerate(urls):
+            response = client.get(url)
+            assert response.status_code == 200
+            assert b"".join(response.streaming_content) == ("run %d" % index).encode("utf-8")
+
+        # Moving a file never replaces the file of another artifact
+        disks[0].join("pub", "a.txt").write("stray")
+        with pytest.raises(IOError):
+            move_to_root(Artifact.objects.get(path="pub/a.txt"), "")
+        assert disks[0].join("pub", "a.txt").read() == "stray"
+        assert Artifact.objects.get(path="pub/a.txt").root == "disk2"
+        assert sorted(os.listdir(str(disks[0].join("pub")))) == ["a.txt", os.path.basename(urls[1])]
+
+
+class TestChanges(object):
+    def test_changes(self, client, settings, tmpdir, users):
+        settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+        filename = str(tmpdir.join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("Hello World!!!")
+        home = Directory.objects.create(path="/home/user1", user=users["u"][0], ttl=1)
+        Directory.objects.create(path="/pub", is_public=True)
+        token = AuthToken.objects.create(user=users["u"][0])
+        url = reverse("changes")
+        settings.ARTIFACTORIAL_CHANGES_SAFETY_WINDOW = 0
+
+        response = client.get("%s?since=latest" % url)
+        assert response.status_code == 200
+        cursor = json.loads(response.content.decode("utf-8"))["next"]
+
+        urls = []
+        for (path, data) in [("home/user1", {"token": token.secret}), ("pub", {})]:
+            with open(filename, "r") as f_in:
+                data["path"] = f_in
+                response = client.post(reverse("artifacts", args=[path]), data=data)
+            assert response.status_code == 200
+            urls.append(bytes2unicode(response.content)[len("http://testserver"):])
+        response = client.delete("%s?token=%s" % (urls[0], token.secret))
+        assert response.status_code == 200
+        with open(filename, "r") as f_in:
+            client.post(reverse("artifacts", args=["home/user1"]),
+                        data={"path": f_in, "token": token.secret})
+        Artifact.objects.filter(directory=home).update(created_at=timezone.now() - timedelta(days=2))
+        home.clean_old_files(False)
+
+        # Only the visible changes
+        response = client.get("%s?since=%d" % (url, cursor))
+        data = json.loads(response.content.decode("utf-8"))
+        assert [(c["event"], c["path"]) for c in data["changes"]] == \
+            [("created", urls[1][len("/artifacts"):])]
+        assert data["next"] == Change.objects.order_by("-id")[0].id
+
+        response = client.get("%s?since=%d&token=%s&prefix=/home/&limit=2" % (url, cursor, token.secret))
+        data = json.loads(response.content.decode("utf-8"))
+        assert [c["event"] for c in data["changes"]] == ["created", "deleted"]
+        assert data["changes"][0]["size"] == 14
+        assert data["more"]
+        response = client.get("%s?since=%d&token=%s&prefix=/home/" % (url, data["next"], token.secret))
+        data = json.loads(response.content.decode("utf-8"))
+        assert [c["event"] for c in data["changes"]] == ["created", "expired"]
+        assert not data["more"]
+        response = client.get("%s?since=%d&token=%s" % (url, data["next"], token.secret))
+        assert json.loads(response.content.decode("utf-8"))["changes"] == []
+
+        # The changes of the last seconds might be followed by lower ids
+        settings.ARTIFACTORIAL_CHANGES_SAFETY_WINDOW = 60
+        last = data["next"]
+        Change.objects.update(timestamp=timezone.now() - timedelta(seconds=120))
+        Change.record(Change.CREATED, [(home.id, "home/user1/late.txt", 1)])
+        response = client.get("%s?since=%d&token=%s" % (url, last, token.secret))
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["changes"] == []
+        assert data["next"] == last
+        response = client.get("%s?since=latest" % url)
+        assert json.loads(response.content.decode("utf-8"))["next"] == last
+        settings.ARTIFACTORIAL_CHANGES_SAFETY_WINDOW = 0
+        response = client.get("%s?since=%d&token=%s" % (url, last, token.secret))
+        data = json.loads(response.content.decode("utf-8"))
+        assert [c["path"] for c in data["changes"]] == ["/home/user1/late.txt"]
+
+        # Pruned changes
+        Change.objects.filter(id__lte=cursor + 2).update(timestamp=timezone.now() - timedelta(days=40))
+        call_command("clean", stdout=io.StringIO())
+        assert Change.pruned() == cursor + 2
+        assert client.get("%s?since=%d" % (url, cursor)).status_code == 410
+        assert client.get("%s?since=%d" % (url, cursor + 2)).status_code == 200
+        assert client.get(url).status_code == 200
+        # Even when every change was pruned
+        Change.objects.update(timestamp=timezone.now() - timedelta(days=40))
+        call_command("clean", stdout=io.StringIO())
+        assert not Change.objects.exists()
+        assert client.get("%s?since=%d" % (url, cursor + 2)).status_code == 410
+        response = client.get("%s?since=latest" % url)
+        latest = json.loads(response.content.decode("utf-8"))["next"]
+        assert latest == Change.pruned()
+        assert client.get("%s?since=%d" % (url, latest)).status_code == 200
+        assert client.get("%s?since=a" % url).status_code == 400
+        assert client.get("%s?limit=0" % url).status_code == 400
+
+    def test_every_change(self, client, settings, tmpdir, users):
+        settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+        pub = Directory.objects.create(path="/pub", is_public=True, ttl=1)
+        other = Directory.objects.create(path="/other", is_public=True)
+
+        # Recorded by the signals, whatever creates or deletes the artifacts
+        for name in ["a", "b", "c", "d"]:
+            Artifact.objects.create(directory=pub, path="pub/%s.txt" % name, size=1)
+        Artifact.objects.create(directory=other, path="other/e.txt", size=1)
+        Artifact.objects.get(path="pub/a.txt").delete()
+        Artifact.objects.filter(path__in=["pub/b.txt", "pub/c.txt"]).delete()
+        Artifact.objects.filter(directory=pub).update(created_at=timezone.now() - timedelta(days=2))
+        pub.clean_old_files(False)
+        # The changes of a deleted directory are deleted with it
+        other.delete()
+
+        changes = list(Change.objects.order_by("id").values_list("event", "path"))
+        assert changes[:5] == [("created", "pub/a.txt"), ("created", "pub/b.txt"),
+                               ("created", "pub/c.txt"), ("created", "pub/d.txt"),
+                               ("deleted", "pub/a.txt")]
+        assert sorted(changes[5:7]) == [("deleted", "pub/b.txt"), ("deleted", "pub/c.txt")]
+        assert changes[7:] == [("expired", "pub/d.txt")]
+
+    def test_watch(self, client, settings, tmpdir, users):
+        settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+        settings.ARTIFACTORIAL_WATCH_INTERVAL = 0.01
+        settings.ARTIFACTORIAL_CHANGES_SAFETY_WINDOW = 0
+        Directory.objects.create(path="/home/user1", user=users["u"][0])
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        url = reverse("changes.watch")
+
+        # Nothing after the request
+        Change.record(Change.CREATED, [(pub.id, "pub/old.txt", 1)])
+        response = client.get("%s?timeout=0.05" % url)
+        assert response.status_code == 200
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["changes"] == []
+        cursor = data["next"]
+
+        Change.record(Change.CREATED, [(Directory.objects.get(path="/home/user1").id,
+                                        "home/user1/hidden.txt", 1),
+                                       (pub.id, "pub/a.txt", 2)])
+        response = client.get("%s?timeout=0.05&since=%d&prefix=/pub/" % (url, cursor))
+        data = json.loads(response.content.decode("utf-8"))
+        assert [c["path"] for c in data["changes"]] == ["/pub/a.txt"]
+
+        # Server-Sent Events
+        response = client.get("%s?timeout=0.05" % url, HTTP_ACCEPT="text/event-stream",
+                              HTTP_LAST_EVENT_ID=str(cursor))
+        assert response["Content-Type"] == "text/event-stream"
+        events = b"".join(response.streaming_content).decode("utf-8").split("\n\n")
+        assert events[0] == "retry: 10"
+        assert events[1].startswith("id: %d\nevent: created\ndata: {" % data["next"])
+        assert json.loads(events[1].split("data: ")[1])["path"] == "/pub/a.txt"
+        assert events[2:] == [""]
+
+        assert client.get("%s?timeout=a" % url).status_code == 400
+
+
+class TestStat(object):
+    def test_stat(self, client, settings, tmpdir, users, django_assert_max_num_queries):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub", is_public=True, ttl=10)
+        private = Directory.objects.create(path="/private", user=users["u"][0])
+        for (directory, name) in [(pub, "pub/a.txt"), (pub, "pub/b.tar.gz"), (private, "private/c.txt")]:
+            media.join(name).write("some sort of test data", ensure=True)
+            Artifact.objects.create(directory=directory, path=name)
+        Artifact.objects.filter(path="pub/a.txt").update(md5="600ae9d6304b5d939e3dc10191536c58")
+        Artifact.objects.filter(path="pub/b.tar.gz").update(is_permanent=True)
+        url = reverse("artifacts.stat")
+
+        paths = ["/pub/a.txt", "pub/b.tar.gz", "/private/c.txt", "/pub/unknown.txt"]
+        with django_assert_max_num_queries(3):
+            response = client.post(url, data=json.dumps({"paths": paths}),
+                                   content_type="application/json")
+        assert response.status_code == 200
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["missing"] == ["/private/c.txt", "/pub/unknown.txt"]
+        assert sorted(data["artifacts"].keys()) == ["/pub/a.txt", "/pub/b.tar.gz"]
+        a = data["artifacts"]["/pub/a.txt"]
+        assert a["size"] == 22
+        assert a["content_type"] == "text/plain"
+        assert a["md5"] == "600ae9d6304b5d939e3dc10191536c58"
+        assert not a["is_permanent"]
+        created_at = Artifact.objects.get(path="pub/a.txt").created_at
+        assert a["expires_at"] == json.loads(json.dumps(created_at + timedelta(days=10),
+                                                        cls=DjangoJSONEncoder))
+        b = data["artifacts"]["/pub/b.tar.gz"]
+        assert b["content_type"] == "application/x-tar"
+        assert b["is_permanent"]
+        assert b["expires_at"] is None
+        # Not computed during the request
+        assert b["md5"] is None
+        assert Artifact.objects.get(path="pub/b.tar.gz").md5 == ""
+        # Until scrub stores it
+        call_command("scrub", stdout=io.StringIO())
+        response = client.post(url, data=json.dumps(paths), content_type="application/json")
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["artifacts"]["/pub/b.tar.gz"]["md5"] == "600ae9d6304b5d939e3dc10191536c58"
+
+        token = AuthToken.objects.create(user=users["u"][0])
+        response = client.post("%s?token=%s" % (url, token.secret), data=json.dumps(paths),
+                               content_type="application/json")
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["missing"] == ["/pub/unknown.txt"]
+
+        response = client.post(url, data="{", content_type="application/json")
+        assert response.status_code == 400
+        response = client.post(url, data=json.dumps({"paths": [1]}), content_type="application/json")
+        assert response.status_code == 400
+        # Still a directory for the other requests
+        assert client.get(url).status_code == 404
+
+
+class TestGrep(object):
+    def test_grep(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        private = Directory.objects.create(path="/private", user=users["u"][0])
+        files = [(pub, "pub/a.log", "start\nERROR one\nok\nok\nok\nerror two\nend\n"),
+                 (pub, "pub/b.log", "ERROR three\n"),
+                 (pub, "pub/c.bin", "ERROR\0binary\n"),
+                 (private, "private/d.log", "ERROR secret\n")]
+        for (directory, name, content) in files:
+            media.join(name).write(content, ensure=True)
+            Artifact.objects.create(directory=directory, path=name)
+        url = reverse("grep")
+
+        def grep(**params):
+            response = client.get(url, params)
+            assert response.status_code == 200
+            return b"".join(response.streaming_content).decode("utf-8").splitlines()
+
+        assert grep(path="/pub/a.log", pattern="ERROR") == ["/pub/a.log:2:ERROR one"]
+        assert grep(path="/pub/a.log", pattern="error", ignore_case=1) == \
+            ["/pub/a.log:2:ERROR one", "/pub/a.log:6:error two"]
+        assert grep(path="/pub/a.log", pattern="^e.+o$", regex=1) == ["/pub/a.log:6:error two"]
+        # Literal by default
+        assert grep(path="/pub/a.log", pattern="^e.+o$") == []
+        assert grep(path="/pub/a.log", pattern="error", ignore_case=1, context=1) == \
+            ["/pub/a.log-1-start", "/pub/a.log:2:ERROR one", "/pub/a.log-3-ok",
+             "--",
+             "/pub/a.log-5-ok", "/pub/a.log:6:error two", "/pub/a.log-7-end"]
+        # Binary and invisible files are skipped
+        assert grep(prefix="/", pattern="ERROR") == ["/pub/a.log:2:ERROR one",
+                                                     "/pub/b.log:1:ERROR three"]
+        assert grep(prefix="/pub/", glob="b*", pattern="ERROR") == ["/pub/b.log:1:ERROR three"]
+        assert grep(prefix="/", pattern="ERROR", limit=1) == ["/pub/a.log:2:ERROR one",
+                                                              "# stopped after 1 matches"]
+        token = AuthToken.objects.create(user=users["u"][0])
+        assert grep(prefix="/private/", pattern="ERROR", token=token.secret) == \
+            ["/private/d.log:1:ERROR secret"]
+
+        assert client.get(url, {"path": "/private/d.log", "pattern": "a"}).status_code == 403
+        assert client.get(url, {"path": "/pub/z.log", "pattern": "a"}).status_code == 404
+        assert client.get(url, {"path": "/pub/a.log"}).status_code == 400
+        assert client.get(url, {"pattern": "a"}).status_code == 400
+        assert client.get(url, {"path": "/pub/a.log", "pattern": "(", "regex": 1}).status_code == 400
+        assert client.get(url, {"path": "/pub/a.log", "pattern": "a", "context": "x"}).status_code == 400
+        settings.ARTIFACTORIAL_GREP_MAX_FILES = 1
+        assert client.get(url, {"prefix": "/pub/", "pattern": "a"}).status_code == 400
+
+        # A download slot is taken while searching
+        settings.ARTIFACTORIAL_THROTTLE_ROOT = str(tmpdir.mkdir("throttle"))
+        settings.ARTIFACTORIAL_TOKEN_MAX_DOWNLOADS = 1
+        response = client.get(url, {"path": "/pub/a.log", "pattern": "ERROR"})
+        assert response.status_code == 200
+        assert client.get(url, {"path": "/pub/b.log", "pattern": "ERROR"}).status_code == 429
+        b"".join(response.streaming_content)
+        response.close()
+        response = client.get(url, {"path": "/pub/b.log", "pattern": "ERROR"})
+        assert response.status_code == 200
+        response.close()
+
+        # And so is one of the pools of the server
+        settings.ARTIFACTORIAL_GREP_MAX_SEARCHES = 1
+        slot = throttling.acquire("grep", 1)
+        assert client.get(url, {"path": "/pub/b.log", "pattern": "ERROR"}).status_code == 429
+        slot.close()
+        response = client.get(url, {"path": "/pub/b.log", "pattern": "ERROR"})
+        assert response.status_code == 200
+        assert client.get(url, {"path": "/pub/a.log", "pattern": "ERROR"}).status_code == 429
+        response.close()
+        assert client.get(url, {"path": "/pub/a.log", "pattern": "ERROR"}).status_code == 200
+
+    def test_timeout(self, client, db, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        tmpdir.join("media").join("pub/a.log").write("ok\n" + "a" * 40 + "b\n", ensure=True)
+        Artifact.objects.create(directory=pub, path="pub/a.log")
+
+        # Catastrophic backtracking: the worker is killed at the deadline
+        start = time.time()
+        response = client.get(reverse("grep"), {"path": "/pub/a.log", "pattern": "(a+)+$",
+                                                "regex": 1, "timeout": 0.5})
+        assert response.status_code == 200
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        assert time.time() - start < 10
+        assert lines == ["# timeout after 0 matches"]
+
+    def test_chunks(self, monkeypatch, tmpdir):
+        # Compare with a naive implementation when the matches and the
+        # context are spread over many chunks
+        monkeypatch.setattr(a_grep, "CHUNK_SIZE", 16)
+        lines = ["line %d%s" % (i, " match" if i % 7 in [0, 1] or i == 40 else "")
+                 for i in range(1, 60)]
+        filename = tmpdir.join("file.log")
+        filename.write("\n".join(lines))
+        for context in [0, 1, 2, 5]:
+            expected = []
+            selected = set()
+            for (i, line) in enumerate(lines):
+                if "match" in line:
+                    selected.update(range(max(0, i - context), i + context + 1))
+            previous = None
+            for i in sorted(selected):
+                if i >= len(lines):
+                    continue
+                if context and previous is not None and i > previous + 1:
+                    expected.append("--")
+                sep = ":" if "match" in lines[i] else "-"
+                expected.append("f%s%d%s%s" % (sep, i + 1, sep, lines[i]))
+                previous = i
+
+            search = a_grep.Search(b"match", 0, context)
+            result = "".join(a_grep.stream(search, [("f", str(filename))])).splitlines()
+            assert result == expected
+
+
+class TestArchives(object):
+    def test_archives(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        Directory.objects.create(path="/private", user=users["u"][0])
+        results = b"<testsuite tests='2'/>\n" * 100
+        content = {"results.xml": results, "logs/job.log": b"job log\n"}
+
+        def make_tar(mode):
+            data = io.BytesIO()
+            with tarfile.open(fileobj=data, mode=mode) as tar:
+                for (name, value) in sorted(content.items()):
+                    info = tarfile.TarInfo("./" + name)
+                    info.size = len(value)
+                    tar.addfile(info, io.BytesIO(value))
+            return data.getvalue()
+
+        def make_zip():
+            data = io.BytesIO()
+            with zipfile.ZipFile(data, "w") as archive:
+                archive.writestr("results.xml", results, zipfile.ZIP_DEFLATED)
+                archive.writestr("logs/", b"")
+                archive.writestr("logs/job.log", content["logs/job.log"], zipfile.ZIP_STORED)
+            return data.getvalue()
+
+        # Indexed after the upload
+        filename = str(tmpdir.join("results.tar"))
+        with open(filename, "wb") as f_out:
+            f_out.write(make_tar("w"))
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["pub"]),
+                                   data={"path": f_in, "is_permanent": True})
+        assert response.status_code == 200
+        tar = Artifact.objects.get(path="pub/results.tar")
+        assert tar.archive == "tar"
+        assert ArchiveMember.objects.filter(artifact=tar).count() == 2
+        # Indexed on first use
+        for (name, data) in [("pub/results.zip", make_zip()),
+                             ("pub/results.tar.gz", make_tar("w:gz")),
+                             ("private/results.zip", make_zip())]:
+            media.join(name).write(data, mode="wb", ensure=True)
+            Artifact.objects.create(directory=Directory.objects.get(path="/" + name.split("/")[0]),
+                                    path=name)
+
+        for archive in ["pub/results.tar", "pub/results.zip", "pub/results.tar.gz"]:
+            for (name, value) in content.items():
+                response = client.get(reverse("artifacts", args=["%s/!/%s" % (archive, name)]))
+                assert response.status_code == 200
+                assert response["Content-Length"] == str(len(value))
+                assert response["Content-Disposition"] == 'inline; filename="%s"' % os.path.basename(name)
+                assert b"".join(response.streaming_content) == value
+            assert response["Content-Type"] == "text/plain"
+            assert client.get(reverse("artifacts", args=["%s/!/missing.txt" % archive])).status_code == 404
+
+            response = client.get(reverse("artifacts", args=["%s/!/" % archive]), {"format": "json"})
+            assert response.status_code == 200
+            data = json.loads(response.content.decode("utf-8"))
+            assert data["directory"] == "/%s/!/" % archive
+            assert data["files"] == [{"path": "logs/job.log", "size": 8},
+                                     {"path": "results.xml", "size": len(results)}]
+            response = client.get(reverse("artifacts", args=["%s/!/logs/" % archive]), {"format": "json"})
+            data = json.loads(response.content.decode("utf-8"))
+            assert data["files"] == [{"path": "job.log", "size": 8}]
+            assert client.get(reverse("artifacts", args=["%s/!/" % archive])).status_code == 200
+        assert Artifact.objects.get(path="pub/results.zip").archive == "zip"
+        # The compressed tar are indexed when listed
+        assert Artifact.objects.get(path="pub/results.tar.gz").archive == "stream"
+        assert ArchiveMember.objects.count() == 6
+        assert client.get(reverse("artifacts", args=["pub/results.tar.gz/!/missing.txt"])).status_code == 404
+
+        # The corrupted archives are only read once
+        media.join("pub/corrupted.tar.gz").write(make_tar("w:gz")[:50], mode="wb")
+        corrupted = Artifact.objects.create(directory=pub, path="pub/corrupted.tar.gz")
+        response = client.get(reverse("artifacts", args=["pub/corrupted.tar.gz/!/"]), {"format": "json"})
+        assert json.loads(response.content.decode("utf-8"))["files"] == []
+        corrupted.refresh_from_db()
+        assert corrupted.archive == "bad"
+        media.join("pub/corrupted.tar.gz").write(make_tar("w:gz"), mode="wb")
+        assert client.get(reverse("artifacts", args=["pub/corrupted.tar.gz/!/results.xml"])).status_code == 404
+
+        # The names are escaped in the json listing
+        content = {'we"ird\\name.txt': b"data"}
+        media.join("pub/weird.tar").write(make_tar("w"), mode="wb")
+        Artifact.objects.create(directory=pub, path="pub/weird.tar")
+        response = client.get(reverse("artifacts", args=["pub/weird.tar/!/"]), {"format": "json"})
+        assert json.loads(response.content.decode("utf-8"))["files"] == \
+            [{"path": 'we"ird\\name.txt', "size": 4}]
+
+        # The listings count as downloads
+        settings.ARTIFACTORIAL_THROTTLE_ROOT = str(tmpdir.mkdir("throttle"))
+        settings.ARTIFACTORIAL_DIRECTORY_MAX_DOWNLOADS = 1
+        slot = throttling.acquire("downloads-directory-%d" % pub.pk, 1)
+        assert client.get(reverse("artifacts", args=["pub/weird.tar/!/"])).status_code == 429
+        slot.close()
+        assert client.get(reverse("artifacts", args=["pub/weird.tar/!/"])).status_code == 200
+
+        assert client.get(reverse("artifacts", args=["private/results.zip/!/results.xml"])).status_code == 403
+        assert client.get(reverse("artifacts", args=["pub/results.zip/!/logs/missing/"])).status_code == 404
+        assert client.get(reverse("artifacts", args=["pub/missing.zip/!/results.xml"])).status_code == 404
+        media.join("pub/a.txt").write("not an archive")
+        Artifact.objects.create(directory=pub, path="pub/a.txt")
+        assert client.get(reverse("artifacts", args=["pub/a.txt/!/results.xml"])).status_code == 404
+
+        # The index is removed with the artifact
+        assert client.delete(reverse("artifacts", args=["pub/results.tar"])).status_code == 200
+        assert ArchiveMember.objects.count() == 5
+
 
 class TestShares(object):
     def test_invalid_verbs(self, client):
@@ -395,7 +1197,8 @@ class TestPostingArtifacts(object):
         with open(filename, "r") as f_in:
             response = client.post(reverse("artifacts", args=["home/user1"]),
                                    data={"path": f_in})
-        assert response.status_code == 403
+        assert response.status_code == 413
+        assert d.artifact_set.count() == 1
 
         # Fill completely the directory
         d.quota = 28
@@ -405,6 +1208,64 @@ class TestPostingArtifacts(object):
                                    data={"path": f_in})
         assert response.status_code == 200
 
+    def test_quota_content_length(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        filename = str(tmpdir.join("data.bin"))
+        with open(filename, "wb") as f_out:
+            f_out.write(b"0" * 10000)
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/home/user1", user=users["u"][0],
+                                     quota=5000)
+
+        # The request is rejected before reading the body (and the token of
+        # the form)
+        token = AuthToken.objects.create(user=users["u"][0])
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"path": f_in,
+                                         "token": token.secret})
+        assert response.status_code == 413
+        assert d.artifact_set.count() == 0
+        assert media.listdir() == []
+        url = "%s?token=%s" % (reverse("artifacts", args=["home/user1"]), token.secret)
+        with open(filename, "rb") as f_in:
+            response = client.post(url, data={"path": f_in})
+        assert response.status_code == 413
+        assert media.listdir() == []
+
+        # The quota is not disclosed to the clients that can not write
+        other = AuthToken.objects.create(user=users["u"][1])
+        with open(filename, "rb") as f_in:
+            response = client.post("%s?token=%s" % (reverse("artifacts", args=["home/user1"]), other.secret),
+                                   data={"path": f_in})
+        assert response.status_code == 403
+        # The token of the form is received before the upload is aborted
+        d.quota = 8000
+        d.save()
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"token": other.secret, "path": f_in})
+        assert response.status_code == 403
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"token": token.secret, "path": f_in})
+        assert response.status_code == 413
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"path": f_in, "token": token.secret})
+        assert response.status_code == 413
+        assert media.listdir() == []
+
+        # Just enough space
+        d.quota = 10000
+        d.save()
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"path": f_in,
+                                         "token": token.secret})
+        assert response.status_code == 200
+        assert d.artifact_set.count() == 1
+
     def test_group_write(self, client, settings, tmpdir, users):
         media = tmpdir.mkdir("media")
         filename = str(tmpdir.join("data.txt"))
@@ -699,6 +1560,43 @@ class TestGet(object):
         assert len(resp) == 1
         assert bytes2unicode(resp[0]) == "One image"
 
+    def test_listing_filters(self, client, db):
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        now = timezone.now()
+        for (name, size, age, permanent) in [("a.txt", 300, 1, False), ("b.txt", 100, 3, True),
+                                             ("c.txt", 200, 2, False), ("sub/d.txt", 10, 0, False)]:
+            artifact = Artifact.objects.create(directory=pub, path="pub/%s" % name, size=size,
+                                               is_permanent=permanent)
+            Artifact.objects.filter(pk=artifact.pk).update(created_at=now - timedelta(days=age))
+        url = reverse("artifacts", args=["pub/"])
+
+        def files(**params):
+            response = client.get(url, params)
+            assert response.status_code == 200
+            assert response.context["directories"] == ["sub"]
+            return [f[0] for f in response.context["files"]]
+
+        assert files() == ["a.txt", "b.txt", "c.txt"]
+        assert files(order="desc") == ["c.txt", "b.txt", "a.txt"]
+        assert files(sort="size") == ["b.txt", "c.txt", "a.txt"]
+        assert files(sort="date", order="desc", limit=2) == ["a.txt", "c.txt"]
+        assert files(min_size=150) == ["a.txt", "c.txt"]
+        assert files(max_size=200, min_size=150) == ["c.txt"]
+        assert files(permanent="true") == ["b.txt"]
+        assert files(permanent="0") == ["a.txt", "c.txt"]
+        assert files(since=(now - timedelta(days=2, hours=12)).isoformat()) == ["a.txt", "c.txt"]
+        assert files(until=(now - timedelta(days=1, hours=12)).isoformat()) == ["b.txt", "c.txt"]
+        # Every file is filtered out but the directory exists
+        assert files(min_size=1000) == []
+
+        response = client.get(url, {"sort": "size", "order": "desc", "limit": 1, "format": "json"})
+        data = json.loads(response.content.decode("utf-8"))
+        assert data["files"] == [{"path": "a.txt", "size": 300}]
+
+        for params in [{"sort": "owner"}, {"order": "up"}, {"limit": "a"}, {"limit": -1},
+                       {"min_size": "1G"}, {"permanent": "maybe"}, {"since": "yesterday"}]:
+            assert client.get(url, params).status_code == 400
+
 
 class TestHead(object):
     def test_public_artifact(self, client, settings, tmpdir, users):
@@ -738,6 +1636,27 @@ class TestHead(object):
         assert response["Content-Type"] == "text/plain"
         assert response["Content-Length"] == "22"
 
+    def test_stored_md5(self, client, settings, tmpdir, users):
+        settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+        filename = str(tmpdir.join("take_my_sum.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("some sort of test data")
+        Directory.objects.create(path="/pub", is_public=True)
+
+        # The MD5 is computed during the upload
+        with open(filename, "r") as f_in:
+            response = client.post(reverse("artifacts", args=["pub"]), data={"path": f_in})
+        assert response.status_code == 200
+        artifact = Artifact.objects.get()
+        assert artifact.md5 == "600ae9d6304b5d939e3dc10191536c58"
+
+        # And not read again from the file
+        with open(artifact.path.path, "w") as f_out:
+            f_out.write("corrupted")
+        response = client.head(reverse("artifacts", args=[artifact.path.name]))
+        assert response.status_code == 200
+        assert bytes2unicode(base64.b64decode(response["Content-MD5"])) == "600ae9d6304b5d939e3dc10191536c58"
+
 
 class TestDelete(object):
     def test_invalid_delete(self, client):
@@ -838,3 +1757,268 @@ class TestDelete(object):
         assert response.status_code == 200
         assert Artifact.objects.filter(directory=d1).count() == 0
         assert not os.path.exists(path)
+
+    def test_recursive_delete(self, client, monkeypatch, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        settings.ARTIFACTORIAL_DELETE_BATCH_SIZE = 2
+        build = Directory.objects.create(path="/build/user1", user=users["u"][0])
+        other = Directory.objects.create(path="/build/user1/other", user=users["u"][1])
+        token = AuthToken.objects.create(user=users["u"][0])
+        for path in ["build/user1/a.log", "build/user1/b.log", "build/user1/1/c.log",
+                     "build/user1/1/d.txt", "build/user1/old.log"]:
+            media.join(path).write("data", ensure=True)
+            Artifact.objects.create(directory=build, path=path)
+        Artifact.objects.filter(path="build/user1/old.log").update(created_at=timezone.now() - timedelta(days=2))
+        media.join("build/user1/other/e.log").write("data", ensure=True)
+        Artifact.objects.create(directory=other, path="build/user1/other/e.log")
+        url = reverse("artifacts", args=["build/user1/"])
+
+        # Not writable to everything under the prefix
+        response = client.delete("%s?recursive=1&glob=*.log&token=%s" % (url, token.secret))
+        assert response.status_code == 403
+        assert Artifact.objects.count() == 6
+
+        response = client.delete("%s?recursive=1&token=%s&until=%s" % (url, token.secret,
+                                                                       timezone.now().date().isoformat()))
+        assert response.status_code == 200
+        assert json.loads(response.content.decode("utf-8")) == {"count": 1, "bytes": 4}
+
+        response = client.delete("%s?recursive=1&glob=*.log&token=%s" % (reverse("artifacts", args=["build/user1/1/"]),
+                                                                         token.secret))
+        assert response.status_code == 200
+        assert json.loads(response.content.decode("utf-8")) == {"count": 1, "bytes": 4}
+        response = client.delete("%s?recursive=1&glob=?.log&token=%s" % (url, token.secret))
+        assert response.status_code == 200
+        assert json.loads(response.content.decode("utf-8")) == {"count": 2, "bytes": 8}
+        assert sorted(Artifact.objects.values_list("path", flat=True)) == \
+            ["build/user1/1/d.txt", "build/user1/other/e.log"]
+        assert Change.objects.filter(event=Change.DELETED).count() == 4
+        assert DirectoryUsage.objects.get(directory=build).deletes == 4
+
+        # The files are removed in background
+        for _ in range(100):
+            if not media.join("build/user1/a.log").check():
+                break
+            time.sleep(0.01)
+        for name in ["a.log", "b.log", "old.log", "1/c.log"]:
+            assert not media.join("build/user1", name).check()
+        assert media.join("build/user1/1/d.txt").check()
+
+        response = client.delete("%s?recursive=1&glob=*.bin&token=%s" % (url, token.secret))
+        assert response.status_code == 404
+        response = client.delete("%s?recursive=1&until=a&token=%s" % (url, token.secret))
+        assert response.status_code == 400
+
+        # Artifacts added after the permission check are not deleted
+        is_writable_to = Directory.is_writable_to
+
+        def racing(directory, user):
+            Artifact.objects.get_or_create(directory=other, path="build/user1/1/f.txt")
+            return is_writable_to(directory, user)
+
+        monkeypatch.setattr(Directory, "is_writable_to", racing)
+        response = client.delete("%s?recursive=1&glob=1/*.txt&token=%s" % (url, token.secret))
+        assert response.status_code == 200
+        assert json.loads(response.content.decode("utf-8")) == {"count": 1, "bytes": 4}
+        assert sorted(Artifact.objects.values_list("path", flat=True)) == \
+            ["build/user1/1/f.txt", "build/user1/other/e.log"]
+
+
+class TestThrottling(object):
+    def test_downloads(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        settings.ARTIFACTORIAL_THROTTLE_ROOT = str(tmpdir.mkdir("throttle"))
+        settings.ARTIFACTORIAL_TOKEN_MAX_DOWNLOADS = 1
+        settings.ARTIFACTORIAL_THROTTLE_RETRY_AFTER = 2
+
+        filename = str(media.mkdir("pub").join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("some data")
+        d = Directory.objects.create(path="/pub", is_public=True)
+        Artifact.objects.create(path="pub/data.txt", directory=d)
+        token = AuthToken.objects.create(user=users["u"][0])
+        url = "%s?token=%s" % (reverse("artifacts", args=["pub/data.txt"]), token.secret)
+
+        # The slot is kept until the response is consumed
+        response = client.get(url)
+        assert response.status_code == 200
+        response2 = client.get(url)
+        assert response2.status_code == 429
+        assert response2["Retry-After"] == "2"
+
+        # Another identity is not limited
+        assert client.get(reverse("artifacts", args=["pub/data.txt"])).status_code == 200
+
+        assert b"".join(response.streaming_content) == b"some data"
+        response = client.get(url)
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == b"some data"
+
+        # The slot is released when the file can not be opened
+        Artifact.objects.create(path="pub/gone.txt", directory=d)
+        with pytest.raises(IOError):
+            client.get("%s?token=%s" % (reverse("artifacts", args=["pub/gone.txt"]), token.secret))
+        response = client.get(url)
+        assert response.status_code == 200
+        response.close()
+
+        # Or when the search is closed without being read
+        response = client.get(reverse("grep"), {"path": "/pub/data.txt", "pattern": "data",
+                                                "token": token.secret})
+        assert response.status_code == 200
+        assert client.get(url).status_code == 429
+        response.close()
+        response = client.get(url)
+        assert response.status_code == 200
+        response.close()
+
+    def test_directory_uploads(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        settings.ARTIFACTORIAL_THROTTLE_ROOT = str(tmpdir.mkdir("throttle"))
+        settings.ARTIFACTORIAL_DIRECTORY_MAX_UPLOADS = 1
+        d = Directory.objects.create(path="/pub")
+        filename = str(tmpdir.join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("Hello World!!!")
+
+        slot = throttling.acquire("uploads-directory-%d" % d.pk, 1)
+        assert slot is not None
+        with open(filename, "r") as f_in:
+            response = client.post(reverse("artifacts", args=["pub"]),
+                                   data={"path": f_in})
+        assert response.status_code == 429
+
+        # With the token in the query string, the permissions are checked
+        # before taking a slot
+        home = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        token = AuthToken.objects.create(user=users["u"][1])
+        home_slot = throttling.acquire("uploads-directory-%d" % home.pk, 1)
+        assert home_slot is not None
+        with open(filename, "r") as f_in:
+            response = client.post("%s?token=%s" % (reverse("artifacts", args=["home/user1"]), token.secret),
+                                   data={"path": f_in})
+        assert response.status_code == 403
+        with open(filename, "r") as f_in:
+            response = client.post(reverse("artifacts", args=["home/user1"]),
+                                   data={"path": f_in, "token": token.secret})
+        assert response.status_code == 429
+        home_slot.close()
+
+        slot.close()
+        with open(filename, "r") as f_in:
+            response = client.post(reverse("artifacts", args=["pub"]),
+                                   data={"path": f_in})
+        assert response.status_code == 200
+        assert d.artifact_set.count() == 1
+        token = AuthToken.objects.create(user=users["u"][0])
+        with open(filename, "r") as f_in:
+            response = client.post("%s?token=%s" % (reverse("artifacts", args=["home/user1"]), token.secret),
+                                   data={"path": f_in})
+        assert response.status_code == 200
+        assert home.artifact_set.count() == 1
+
+    def test_token_bucket(self, settings, tmpdir):
+        settings.ARTIFACTORIAL_THROTTLE_ROOT = str(tmpdir)
+        bucket = throttling.TokenBucket("bucket", 1000)
+        assert bucket.consume(1000) == 0
+        assert bucket.consume(500) > 0.4
+
+
+class TestMetrics(object):
+    def test_metrics(self, client, settings, tmpdir, users):
+        pytest.importorskip("prometheus_client")
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        filename = str(media.mkdir("pub").join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("some data")
+        d = Directory.objects.create(path="/pub", is_public=True)
+        Artifact.objects.create(path="pub/data.txt", directory=d)
+
+        response = client.get(reverse("artifacts", args=["pub/data.txt"]))
+        assert response.status_code == 200
+        response = client.get(reverse("artifacts", args=["pub/"]))
+        assert response.status_code == 200
+
+        # Not exported by default
+        assert client.get(reverse("metrics")).status_code == 403
+        settings.ARTIFACTORIAL_METRICS_TOKEN = "secret"
+        assert client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong").status_code == 403
+        response = client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        assert response.status_code == 200
+        content = bytes2unicode(response.content)
+        assert 'artifactorial_request_duration_seconds_count{method="GET",view="artifacts"}' in content
+        assert "artifactorial_served_bytes_total" in content
+        assert "artifactorial_listing_entries_count" in content
+        assert "artifactorial_directory_usage_bytes" not in content
+
+        settings.ARTIFACTORIAL_METRICS_TOKEN = None
+        settings.ARTIFACTORIAL_METRICS_ALLOWED_IPS = ["127.0.0.1"]
+        settings.ARTIFACTORIAL_METRICS_DIRECTORIES = True
+        response = client.get(reverse("metrics"))
+        assert response.status_code == 200
+        content = bytes2unicode(response.content)
+        assert 'artifactorial_directory_usage_bytes{directory="/pub"} 9.0' in content
+        assert 'artifactorial_directory_quota_bytes{directory="/pub"}' in content
+
+
+class TestProfiling(object):
+    def test_profiling(self, client, settings, tmpdir, users):
+        settings.MIDDLEWARE = settings.MIDDLEWARE + ["Artifactorial.middleware.ProfilingMiddleware"]
+        settings.ARTIFACTORIAL_PROFILING_ROOT = str(tmpdir.mkdir("profiles"))
+        Directory.objects.create(path="/home/grp1", group=users["g"][0])
+
+        # Not enabled by default
+        response = client.get(reverse("artifacts", args=[""]))
+        assert response.status_code == 200
+        assert "Server-Timing" not in response
+
+        # Only for staff members
+        response = client.get(reverse("artifacts", args=[""]),
+                              HTTP_X_ARTIFACTORIAL_PROFILE="1")
+        assert "Server-Timing" not in response
+
+        users["u"][0].is_staff = True
+        users["u"][0].save()
+        token = AuthToken.objects.create(user=users["u"][0])
+        response = client.get("%s?token=%s" % (reverse("artifacts", args=[""]), token.secret),
+                              HTTP_X_ARTIFACTORIAL_PROFILE="1")
+        assert response.status_code == 200
+        timing = response["Server-Timing"]
+        assert timing.startswith("total;dur=")
+        assert re.search(r'sql;dur=[0-9.]+;desc="[0-9]+ queries"', timing)
+        assert 'stat;desc="' in timing
+        assert 'sql-top;desc="' in timing
+        assert sorted([f.ext for f in tmpdir.join("profiles").listdir()]) == [".prof", ".txt"]
+
+    def test_sampling(self, client, settings, db, caplog):
+        settings.MIDDLEWARE = settings.MIDDLEWARE + ["Artifactorial.middleware.ProfilingMiddleware"]
+        settings.ARTIFACTORIAL_PROFILING_SAMPLE_RATE = 1
+        with caplog.at_level("INFO", logger="Artifactorial.profiling"):
+            response = client.get(reverse("directories.index"))
+        assert response.status_code == 200
+        # The SQL summary is only logged
+        assert "Server-Timing" not in response
+        assert "GET /directories/: total;dur=" in caplog.text
+        assert "sql-top" in caplog.text
+
+
+class TestAdmin(object):
+    def test_changelists(self, admin_client, django_assert_max_num_queries, settings, tmpdir, users):
+        settings.MEDIA_ROOT = str(tmpdir)
+        for index in range(20):
+            d = Directory.objects.create(path="/dir/%d" % index, user=users["u"][index % 3])
+            Artifact.objects.bulk_create([Artifact(path="dir/%d/file-%d" % (index, i),
+                                                   directory=d, size=10)
+                                          for i in range(5)])
+        Share.objects.create(artifact=Artifact.objects.all()[0], user=users["u"][0])
+
+        for name in ["artifact", "directory", "share"]:
+            with django_assert_max_num_queries(10):
+                response = admin_client.get(reverse("admin:Artifactorial_%s_changelist" % name))
+            assert response.status_code == 200
+        response = admin_client.get(reverse("admin:Artifactorial_directory_changelist"))
+        assert "50\xa0bytes / 1.0\xa0GB" in bytes2unicode(response.content)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Admission control for uploads and downloads.
+
+The counters are shared by all the worker processes of one host by using
+files in ARTIFACTORIAL_THROTTLE_ROOT:
+* a concurrency slot is an exclusive flock() on one of the "limit" files of a
+  given key. The kernel releases the lock when the worker closes the file or
+  dies, so a crashed worker cannot leak a slot.
+* a token bucket is a small file holding the current level and the last
+  refill time, updated under an exclusive flock().
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+import errno
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import time
+
+
+def _setting(name, default=None):
+    return getattr(settings, "ARTIFACTORIAL_%s" % name, default)
+
+
+def _filename(key):
+    root = _setting("THROTTLE_ROOT",
+                    os.path.join(tempfile.gettempdir(), "artifactorial"))
+    try:
+        os.makedirs(root)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:  # pragma: no cover
+            raise
+    return os.path.join(root, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after):
+        super(Throttled, self).__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+class Slot(object):
+    def __init__(self, fd):
+        self.fd = fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def acquire(key, limit):
+    """
+    Grab one of the "limit" concurrency slots of the given key.
+
+    :return: the Slot or None if every slot is already used
+    """
+    base = _filename(key)
+    for index in range(limit):
+        fd = os.open("%s.%d" % (base, index), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as exc:
+            os.close(fd)
+            if exc.errno not in [errno.EACCES, errno.EAGAIN]:  # pragma: no cover
+                raise
+            continue
+        return Slot(fd)
+    return None
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled at "rate" bytes per second, holding at most one
+    second of traffic.
+    """
+    fmt = str("dd")
+
+    def __init__(self, key, rate):
+        self.filename = _filename(key) + ".bucket"
+        self.rate = float(rate)
+
+    def consume(self, amount):
+        """
+        Take "amount" bytes from the bucket.
+        The bucket can go into debt: the caller should then wait for the
+        returned number of seconds.
+        """
+        size = struct.calcsize(self.fmt)
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            data = os.read(fd, size)
+            if len(data) == size:
+                (level, last) = struct.unpack(self.fmt, data)
+                level = min(self.rate, level + (now - last) * self.rate)
+            else:
+                level = self.rate
+            level -= amount
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, struct.pack(self.fmt, level, now))
+        finally:
+            os.close(fd)
+        return 0 if level >= 0 else -level / self.rate
+
+
+class Admission(object):
+    """
+    Slots and buckets granted to one request.
+    """
+    # Bytes taken at once from the shared buckets
+    quantum = 256 * 1024
+
+    def __init__(self):
+        self.slots = []
+        self.buckets = []
+
+    def close(self):
+        for slot in self.slots:
+            slot.close()
+        self.slots = []
+
+    def wrap(self, fileobj):
+        """
+        Wrap the file to stream so that the slots are released when the
+        response is closed and the bandwidth caps are enforced while reading.
+        """
+        if not self.slots and not self.buckets:
+            return fileobj
+        if self.buckets:
+            return _ThrottledFile(fileobj, self)
+        return _AdmittedFile(fileobj, self)
+
+
+class _StreamedFile(object):
+    def __init__(self, fileobj, admission):
+        self.fileobj = fileobj
+        self.admission = admission
+
+    def read(self, size=-1):
+        return self.fileobj.read(size)
+
+    def close(self):
+        self.fileobj.close()
+        self.admission.close()
+
+
+class _AdmittedFile(_StreamedFile):
+    def fileno(self):
+        # Allow the wsgi server to use sendfile()
+        return self.fileobj.fileno()
+
+
+class _ThrottledFile(_StreamedFile):
+    # No fileno(): sendfile() would bypass the bandwidth cap
+    def __init__(self, fileobj, admission):
+        super(_ThrottledFile, self).__init__(fileobj, admission)
+        self.credit = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if len(data) > self.credit:
+            amount = max(len(data) - self.credit, self.admission.quantum)
+            delay = max([b.consume(amount) for b in self.admission.buckets])
+            self.credit += amount
+            if delay:
+                time.sleep(delay)
+        self.credit -= len(data)
+        return data
+
+
+def identity(request):
+    """
+    The key of the client: the token resolved by get_current_user, then the
+    logged-in user and finally the remote address.
+    """
+    token = getattr(request, "auth_token", None)
+    if token is not None:
+        return "token-%d" % token.pk
+    if request.user.is_authenticated:
+        return "user-%d" % request.user.pk
+    return "address-%s" % request.META.get("REMOTE_ADDR", "")
+
+
+def admit(request, directory, kind, scopes=("TOKEN", "DIRECTORY")):
+    """
+    Admit an upload or a download.
+
+    :param directory: the Directory (None when only checking the TOKEN scope)
+    :param kind: "uploads" or "downloads"
+    :param scopes: limits to check ("TOKEN" and/or "DIRECTORY")
+    :return: the Admission that should be closed at the end of the transfer
+    :raise Throttled: when one of the limits is reached
+    """
+    keys = {"TOKEN": identity(request),
+            "DIRECTORY": None if directory is None else "directory-%d" % directory.pk}
+    admission = Admission()
+    for scope in scopes:
+        limit = _setting("%s_MAX_%s" % (scope, kind.upper()))
+        if limit is not None:
+            slot = acquire("%s-%s" % (kind, keys[scope]), limit)
+            if slot is None:
+                admission.close()
+                raise Throttled(_setting("THROTTLE_RETRY_AFTER", 5))
+            admission.slots.append(slot)
+        rate = _setting("%s_BANDWIDTH" % scope)
+        if kind == "downloads" and rate:
+            admission.buckets.append(TokenBucket(keys[scope], rate))
+    return admission
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+from __future__ import unicode_literals
+
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+import hashlib
+
+
+class QuotaUploadHandler(FileUploadHandler):
+    """
+    Abort an upload as soon as it cannot fit in the directory quota.
+    The MD5 of each file is also computed while receiving it.
+
+    This handler should be the first one in request.upload_handlers: it only
+    counts the bytes and passes them to the next handlers.
+    """
+    # Room left for the multipart boundaries and the small form fields
+    # (token, is_permanent) that are sent along with the file.
+    overhead = 4096
+
+    def __init__(self, request, directory):
+        super(QuotaUploadHandler, self).__init__(request)
+        self.remaining = directory.quota - directory.size()
+        self.received = 0
+        self.exceeded = False
+        self.digests = {}
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        # Reject the request before reading anything from the client
+        if content_length > self.remaining + self.overhead:
+            self.exceeded = True
+            return QueryDict(encoding=encoding), MultiValueDict()
+
+    def new_file(self, field_name, *args, **kwargs):
+        super(QuotaUploadHandler, self).new_file(field_name, *args, **kwargs)
+        self.digests[field_name] = hashlib.md5()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.remaining:
+            self.exceeded = True
+            # Stop reading the request body right now
+            raise StopUpload(connection_reset=True)
+        self.digests[self.field_name].update(raw_data)
+        return raw_data
+
+    def md5(self, field_name):
+        """
+        Return the MD5 (in hexadecimal) of the file sent as field_name
+        """
+        if field_name not in self.digests:
+            return ""
+        return self.digests[field_name].hexdigest()
+
+    def file_complete(self, file_size):
+        # Let the next handlers build the uploaded file
+        return None
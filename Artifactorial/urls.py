@@ -37,10 +37,25 @@ urlpatterns = [
 
     # Artifacts interactions
     url(r'^artifacts/$', a_views.artifacts, name='artifacts.root'),
+    url(r'^artifacts/stat/$', a_views.artifacts_stat, name='artifacts.stat'),
     url(r'^artifacts/(?P<filename>.*)$', a_views.artifacts, name='artifacts'),
 
+    # Changes
+    url(r'^changes/$', a_views.changes, name='changes'),
+    url(r'^changes/watch/$', a_views.watch, name='changes.watch'),
+
     # Directories
     url(r'^directories/$', a_views.directories, name='directories.index'),
+    url(r'^directories/usage/$', a_views.directories_usage, name='directories.usage'),
+
+    # Grep
+    url(r'^grep/$', a_views.grep, name='grep'),
+
+    # Metrics
+    url(r'^metrics$', a_views.metrics, name='metrics'),
+
+    # Search
+    url(r'^search/$', a_views.search, name='search'),
 
     # Shares
     url(r'^shares/$', a_views.shares_root, name='shares.root'),
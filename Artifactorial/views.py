@@ -20,8 +20,13 @@
 from __future__ import unicode_literals
 
 from django.urls import reverse
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import CharField, Q, Value
+from django.db.models.functions import StrIndex, Substr
 from django.forms import ModelForm
 from django.http import (
   FileResponse,
@@ -31,17 +36,35 @@ from django.http import (
   HttpResponseForbidden,
   HttpResponseNotAllowed,
   HttpResponseRedirect,
-  QueryDict
+  JsonResponse,
+  QueryDict,
+  StreamingHttpResponse
 )
 from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.six.moves.urllib.parse import quote
 from django.views.decorators.csrf import csrf_exempt
 
-from Artifactorial.models import AuthToken, Artifact, Directory, Share
+from Artifactorial.models import AuthToken, Artifact, Change, Directory, DirectoryUsage, Share
+from Artifactorial import archives as a_archives
+from Artifactorial import cache as a_cache
+from Artifactorial import grep as a_grep
+from Artifactorial import metrics as a_metrics
+from Artifactorial import search as a_search
+from Artifactorial import signals as a_signals
+from Artifactorial import throttling
+from Artifactorial.storage import unlink_later
+from Artifactorial.uploadhandlers import QuotaUploadHandler
 
 import base64
-import hashlib
+from datetime import timedelta
+import hmac
+import json
 import mimetypes
 import os
+import re
+import time
 
 
 class ArtifactForm(ModelForm):
@@ -62,12 +85,59 @@ def get_current_user(request, token):
 
     # Try to match find the token
     try:
-        token = AuthToken.objects.get(secret=token)
+        token = AuthToken.objects.select_related("user").get(secret=token)
+        # Used as the throttling key
+        request.auth_token = token
         return token.user
     except AuthToken.DoesNotExist:
         return request.user
 
 
+def _too_many_requests(exc):
+    response = HttpResponse(status=429)
+    response['Retry-After'] = exc.retry_after
+    return response
+
+
+def _content_disposition(filename):
+    try:
+        filename.encode("ascii")
+        return 'inline; filename="%s"' % filename.replace("\\", "\\\\").replace('"', '\\"')
+    except UnicodeEncodeError:
+        return "inline; filename*=utf-8''%s" % quote(filename.encode("utf-8"))
+
+
+def _serve(request, artifact):
+    # The file was not found by the reconcile command
+    if artifact.is_missing:
+        return HttpResponse(status=410)
+
+    # Open the file before taking a slot, so that nothing is left to
+    # release when the file can not be read
+    fileobj = open(artifact.path.path, 'rb')
+    try:
+        size = os.fstat(fileobj.fileno()).st_size
+        admission = throttling.admit(request, artifact.directory, "downloads")
+    except throttling.Throttled as exc:
+        fileobj.close()
+        return _too_many_requests(exc)
+    except BaseException:
+        fileobj.close()
+        raise
+
+    # Guess the mimetype
+    mime = mimetypes.guess_type(artifact.path.name)
+    response = FileResponse(admission.wrap(fileobj),
+                            content_type=mime[0] if mime[0]
+                            else 'text/plain')
+
+    response['Content-Length'] = size
+    response['Content-Disposition'] = _content_disposition(artifact.get_filename())
+    a_metrics.SERVED_BYTES.inc(size)
+    artifact.touch()
+    return response
+
+
 def _delete(request, filename):
     # Get the current user
     user = get_current_user(request,
@@ -76,9 +146,11 @@ def _delete(request, filename):
     # The URL regexp removes the leading slash, so add it back
     filename = '/' + filename
 
-    # Only valid for artifacts
+    # Only valid for artifacts, unless deleting recursively
     if filename[-1] == '/':
-        return HttpResponseBadRequest()
+        if request.GET.get('recursive') not in ['1', 'true']:
+            return HttpResponseBadRequest()
+        return _delete_prefix(request, user, filename)
 
     artifact = get_object_or_404(Artifact, path=filename.lstrip('/'))
 
@@ -86,14 +158,119 @@ def _delete(request, filename):
         return HttpResponseForbidden()
 
     artifact.delete()
+    DirectoryUsage.record(artifact.directory, deletes=1,
+                          deleted_bytes=artifact.size)
     return HttpResponse('')
 
 
+def _delete_prefix(request, user, filename):
+    """
+    Delete every artifact under the prefix, optionally filtered by a glob
+    (relative to the prefix) and by the upload date (since and until).
+    The rows are deleted by batches and the files removed in background.
+    """
+    prefix = filename.lstrip('/')
+    artifacts = Artifact.objects.filter(path__startswith=prefix)
+    try:
+        if 'since' in request.GET:
+            artifacts = artifacts.filter(created_at__gte=_parse_date(request.GET['since']))
+        if 'until' in request.GET:
+            artifacts = artifacts.filter(created_at__lt=_parse_date(request.GET['until']))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if request.GET.get('glob'):
+        try:
+            artifacts = a_search.filter_queryset(artifacts, 'glob', prefix + request.GET['glob'])
+        except ValueError:
+            return HttpResponseBadRequest()
+
+    # Check the permissions once per directory
+    # The search filter can not be used in a subquery
+    directory_ids = set(artifacts.order_by().values_list("directory_id", flat=True).distinct())
+    directories = dict([(d.id, d) for d in Directory.objects.filter(id__in=directory_ids)])
+    if not directories:
+        raise Http404
+    if not all([d.is_writable_to(user) for d in directories.values()]):
+        return HttpResponseForbidden()
+    # Only delete in the checked directories: artifacts could be added
+    # meanwhile in other directories
+    artifacts = artifacts.filter(directory_id__in=list(directories))
+
+    batch_size = getattr(settings, "ARTIFACTORIAL_DELETE_BATCH_SIZE", 1000)
+    deleted = dict([(d, [0, 0]) for d in directories])
+    while True:
+        rows = list(artifacts.values_list("id", "directory_id", "path", "size")[:batch_size])
+        if not rows:
+            break
+        with transaction.atomic(), a_signals.defer_deletes() as files:
+            Artifact.objects.filter(id__in=[row[0] for row in rows]).delete()
+        unlink_later(files)
+        for (_, directory_id, _, size) in rows:
+            deleted[directory_id][0] += 1
+            deleted[directory_id][1] += size
+
+    for (directory_id, (count, size)) in deleted.items():
+        if count:
+            DirectoryUsage.record(directories[directory_id], deletes=count,
+                                  deleted_bytes=size)
+    return JsonResponse({"count": sum([c for (c, _) in deleted.values()]),
+                         "bytes": sum([s for (_, s) in deleted.values()])})
+
+
+LISTING_SORT = {'name': 'path', 'size': 'size', 'date': 'created_at',
+                'created_at': 'created_at'}
+
+
+def _filter_listing(request, files):
+    """
+    Apply the sort, order, since, until, min_size, max_size, permanent and
+    limit parameters to the files of the listing.
+    Return None if one parameter is invalid.
+    """
+    try:
+        if 'since' in request.GET:
+            files = files.filter(created_at__gte=_parse_date(request.GET['since']))
+        if 'until' in request.GET:
+            files = files.filter(created_at__lt=_parse_date(request.GET['until']))
+        if 'min_size' in request.GET:
+            files = files.filter(size__gte=int(request.GET['min_size']))
+        if 'max_size' in request.GET:
+            files = files.filter(size__lte=int(request.GET['max_size']))
+        limit = int(request.GET.get('limit', 0))
+    except ValueError:
+        return None
+
+    permanent = request.GET.get('permanent', None)
+    if permanent is not None:
+        if permanent.lower() not in ['0', '1', 'false', 'true']:
+            return None
+        files = files.filter(is_permanent=permanent.lower() in ['1', 'true'])
+
+    sort = request.GET.get('sort', 'name')
+    order = request.GET.get('order', 'asc')
+    if sort not in LISTING_SORT or order not in ['asc', 'desc'] or limit < 0:
+        return None
+    ordering = [LISTING_SORT[sort]]
+    # Entries with the same size or date are sorted by name
+    if sort != 'name':
+        ordering.append('path')
+    if order == 'desc':
+        ordering = ['-' + field for field in ordering]
+    files = files.order_by(*ordering)
+    if limit:
+        files = files[:limit]
+    return files
+
+
 def _get(request, filename):
     # Get the current user
     user = get_current_user(request,
                             request.GET.get('token', None))
 
+    # Files inside an archive
+    if '/!/' in filename:
+        return _get_member(request, user, *filename.split('/!/', 1))
+
     # The URL regexp removes the leading slash, so add it back
     filename = '/' + filename
     # Is it a file or a path
@@ -105,8 +282,23 @@ def _get(request, filename):
         if dirname == '/':
             dirname_length = 0
 
+        # Return the right formating (only html, json or yaml)
+        formating = request.GET.get('format', 'html')
+        content_types = {'html': 'text/html',
+                         'json': 'application/json',
+                         'yaml': 'application/yaml'}
+        if formating not in ['html', 'json', 'yaml']:
+            return HttpResponseBadRequest()
+
+        cache_key = a_cache.key(request, user, filename, formating)
+        if cache_key is not None:
+            content = a_cache.load(cache_key)
+            if content is not None:
+                a_metrics.LISTING_CACHE_HITS.inc()
+                return HttpResponse(content, content_type=content_types[formating])
+            a_metrics.LISTING_CACHE_MISSES.inc()
+
         dir_set = set()
-        art_list = list()
         in_real_directory = False
 
         # List real directories
@@ -125,32 +317,33 @@ def _get(request, filename):
             else:
                 in_real_directory = True
 
-        # List artifacts and pseudo directories
-        artifacts = Artifact.objects.filter(path__startswith=filename.lstrip('/'))
-        artifacts = artifacts.select_related("directory", "directory__user",
-                                             "directory__group")
-        for artifact in artifacts:
-            if not artifact.is_visible_to(user):
-                continue
-            relative_name = artifact.path.name[dirname_length:]
-            # Add pseudo directory (if the name contains a '/')
-            if '/' in relative_name:
-                dir_set.add(relative_name[:relative_name.index('/')])
-            else:
-                art_list.append((artifact.path.name[dirname_length:],
-                                 artifact.path.size))
+        # List artifacts and pseudo directories. The visibility is checked
+        # by the database.
+        prefix = filename.lstrip('/')
+        artifacts = Artifact.objects.filter(path__startswith=prefix,
+                                            directory__in=Directory.objects.visible_to(user))
+        artifacts = artifacts.annotate(relative=Substr("path", len(prefix) + 1,
+                                                          output_field=CharField()))
+
+        # Pseudo directories (artifacts in sub directories)
+        pseudo = artifacts.filter(relative__contains='/') \
+                          .annotate(segment=Substr("relative", 1, StrIndex("relative", Value("/")) - 1,
+                                                   output_field=CharField())) \
+                          .order_by().values_list("segment", flat=True).distinct()
+        dir_set.update(pseudo)
+
+        # Files: filtered, sorted and limited by the database
+        files = artifacts.exclude(relative__contains='/')
+        files = _filter_listing(request, files)
+        if files is None:
+            return HttpResponseBadRequest()
+        art_list = list(files.values_list("relative", "size"))
 
         # Raise an error if the directory does not exist
         if not dir_set and not art_list and not in_real_directory and not dirname_length == 0:
-            raise Http404
-
-        # Return the right formating (only html, json or yaml)
-        formating = request.GET.get('format', 'html')
-        content_types = {'html': 'text/html',
-                         'json': 'application/json',
-                         'yaml': 'application/yaml'}
-        if formating not in ['html', 'json', 'yaml']:
-            return HttpResponseBadRequest()
+            # The filters might have excluded every file
+            if not artifacts.exclude(relative__contains='/').exists():
+                raise Http404
 
         # Build the breadcrumb
         breadcrumb = []
@@ -162,13 +355,17 @@ def _get(request, filename):
         else:
             breadcrumb = []
 
-        return render(request, "Artifactorial/list.%s" % formating,
-                      {'directory': dirname,
-                       'breadcrumb': breadcrumb,
-                       'directories': sorted(dir_set),
-                       'files': sorted(art_list),
-                       'token': request.GET.get('token', None)},
-                      content_type=content_types[formating])
+        a_metrics.LISTING_ENTRIES.observe(len(dir_set) + len(art_list))
+        response = render(request, "Artifactorial/list.%s" % formating,
+                          {'directory': dirname,
+                           'breadcrumb': breadcrumb,
+                           'directories': sorted(dir_set),
+                           'files': art_list,
+                           'token': request.GET.get('token', None)},
+                          content_type=content_types[formating])
+        if cache_key is not None:
+            a_cache.store(cache_key, response.content)
+        return response
 
     else:
         # Serving the file
@@ -177,14 +374,85 @@ def _get(request, filename):
         if not artifact.is_visible_to(user):
             return HttpResponseForbidden()
 
-        # Guess the mimetype
-        mime = mimetypes.guess_type(artifact.path.name)
-        response = FileResponse(open(artifact.path.path, 'rb'),
-                                content_type=mime[0] if mime[0]
-                                else 'text/plain')
+        return _serve(request, artifact)
 
-        response['Content-Length'] = artifact.path.size
-        return response
+
+def _get_member(request, user, filename, member):
+    """
+    Serve a file from a tar or zip artifact, or list the files of the
+    archive when the member is empty or ends with a '/'
+    """
+    artifact = get_object_or_404(Artifact, path=filename.lstrip('/'))
+    if not artifact.is_visible_to(user):
+        return HttpResponseForbidden()
+    if artifact.is_missing:
+        return HttpResponse(status=410)
+    if a_archives.get_format(artifact.path.name) is None:
+        raise Http404
+
+    if not member or member[-1] == '/':
+        formating = request.GET.get('format', 'html')
+        content_types = {'html': 'text/html',
+                         'json': 'application/json',
+                         'yaml': 'application/yaml'}
+        if formating not in content_types:
+            return HttpResponseBadRequest()
+        # Listing an archive for the first time reads it entirely
+        try:
+            admission = throttling.admit(request, artifact.directory, "downloads")
+        except throttling.Throttled as exc:
+            return _too_many_requests(exc)
+        try:
+            files = [(name[len(member):], size) for (name, size) in a_archives.members(artifact)
+                     if name.startswith(member)]
+        finally:
+            admission.close()
+        if member and not files:
+            raise Http404
+
+        a_metrics.LISTING_ENTRIES.observe(len(files))
+        directory = "/%s/!/%s" % (filename, member)
+        if formating == 'json':
+            return JsonResponse({'directory': directory,
+                                 'directories': [],
+                                 'files': [{'path': name, 'size': size}
+                                           for (name, size) in files]})
+
+        breadcrumb = []
+        url_accumulator = ''
+        for d in ("%s/!/%s" % (filename, member)).rstrip('/').split('/'):
+            url_accumulator += d + '/'
+            breadcrumb.append((d, url_accumulator))
+        return render(request, "Artifactorial/list.%s" % formating,
+                      {'directory': directory,
+                       'breadcrumb': breadcrumb,
+                       'directories': [],
+                       'files': files,
+                       'token': request.GET.get('token', None)},
+                      content_type=content_types[formating])
+
+    try:
+        admission = throttling.admit(request, artifact.directory, "downloads")
+    except throttling.Throttled as exc:
+        return _too_many_requests(exc)
+    try:
+        (fileobj, size) = a_archives.open_member(artifact, member)
+    except KeyError:
+        admission.close()
+        raise Http404
+    except BaseException:
+        admission.close()
+        raise
+
+    mime = mimetypes.guess_type(member)
+    response = FileResponse(admission.wrap(fileobj),
+                            content_type=mime[0] if mime[0]
+                            else 'text/plain')
+    response['Content-Length'] = size
+    response['Content-Disposition'] = _content_disposition(os.path.basename(member))
+    a_metrics.SERVED_BYTES.inc(size)
+    artifact.touch()
+    return response
 
 
 def _head(request, filename):
@@ -199,11 +467,12 @@ def _head(request, filename):
     mime = mimetypes.guess_type(artifact.path.name)
     response['Content-Type'] = mime[0] if mime[0] else 'text/plain'
     response['Content-Length'] = artifact.path.size
-    # Compute the MD5
-    md5 = hashlib.md5()
-    for chunk in artifact.path.chunks():
-        md5.update(chunk)
-    response['Content-MD5'] = base64.b64encode(md5.hexdigest().encode('utf-8'))
+    # Use the MD5 computed during the upload or store it for the next time
+    md5 = artifact.md5
+    if not md5:
+        md5 = artifact.compute_md5()
+        Artifact.objects.filter(pk=artifact.pk).update(md5=md5)
+    response['Content-MD5'] = base64.b64encode(md5.encode('utf-8'))
 
     return response
 
@@ -215,30 +484,82 @@ def _post(request, filename):
     directory_path = '/' + filename
     directory = get_object_or_404(Directory, path=directory_path)
 
-    user = get_current_user(request,
-                            request.POST.get('token', ''))
-
-    # Is the directory writable to this user?
-    if not directory.is_writable_to(user):
-        return HttpResponseForbidden()
-
-    # Check the quota
-    if 'path' in request.FILES:
-        if request.FILES['path'].size + directory.size() > directory.quota:
+    # Check the quota while receiving the file and not after the fact.
+    # This should be done before accessing request.POST or request.FILES.
+    quota_handler = QuotaUploadHandler(request, directory)
+    request.upload_handlers.insert(0, quota_handler)
+
+    # With the token in the query string, the permissions and the token
+    # limit are checked before receiving the file. Otherwise the token is
+    # only known after receiving the request so only the directory limit can
+    # be checked before the upload.
+    token = request.GET.get('token', None)
+    if token is not None:
+        user = get_current_user(request, token)
+        if not directory.is_writable_to(user):
             return HttpResponseForbidden()
-
-    # Validate the updated form
-    form = ArtifactForm({'directory': directory.id,
-                         'is_permanent': request.POST.get('is_permanent', False)},
-                        request.FILES)
-    if form.is_valid():
-        artifact = form.save()
-        # TODO: does not work with alternate storage
-        return HttpResponse(request.build_absolute_uri(reverse("artifacts",
-                                                               args=[artifact.path.url])),
-                            content_type='text/plain')
+        scopes = ["TOKEN", "DIRECTORY"]
     else:
-        return HttpResponseBadRequest()
+        scopes = ["DIRECTORY"]
+    try:
+        admission = throttling.admit(request, directory, "uploads",
+                                     scopes=scopes)
+    except throttling.Throttled as exc:
+        return _too_many_requests(exc)
+
+    try:
+        # Receive the file (the quota is checked meanwhile)
+        if token is None:
+            user = get_current_user(request,
+                                    request.POST.get('token', ''))
+            # Is the directory writable to this user? Checked before the
+            # quota, which is not disclosed to the other clients, unless the
+            # upload was aborted before the token of the form was received.
+            if not directory.is_writable_to(user) and \
+               not (quota_handler.exceeded and 'token' not in request.POST):
+                return HttpResponseForbidden()
+        else:
+            request.FILES
+
+        # The upload was aborted
+        if quota_handler.exceeded:
+            a_metrics.QUOTA_REJECTIONS.inc()
+            return HttpResponse(status=413)
+
+        if token is None:
+            try:
+                admission.slots.extend(throttling.admit(request, directory, "uploads",
+                                                        scopes=["TOKEN"]).slots)
+            except throttling.Throttled as exc:
+                return _too_many_requests(exc)
+
+        # Check the quota
+        if 'path' in request.FILES:
+            if request.FILES['path'].size + directory.size() > directory.quota:
+                a_metrics.QUOTA_REJECTIONS.inc()
+                return HttpResponse(status=413)
+
+        # Validate the updated form
+        form = ArtifactForm({'directory': directory.id,
+                             'is_permanent': request.POST.get('is_permanent', False)},
+                            request.FILES)
+        if form.is_valid():
+            artifact = form.save(commit=False)
+            artifact.md5 = quota_handler.md5('path')
+            artifact.save()
+            a_metrics.UPLOADED_BYTES.inc(artifact.size)
+            DirectoryUsage.record(directory, uploads=1,
+                                  uploaded_bytes=artifact.size)
+            # Only the headers are read
+            a_archives.build_index(artifact)
+            # TODO: does not work with alternate storage
+            return HttpResponse(request.build_absolute_uri(reverse("artifacts",
+                                                                   args=[artifact.path.url])),
+                                content_type='text/plain')
+        else:
+            return HttpResponseBadRequest()
+    finally:
+        admission.close()
 
 
 @csrf_exempt
@@ -255,16 +576,494 @@ def artifacts(request, filename=''):
         return HttpResponseNotAllowed(['DELETE', 'GET', 'HEAD', 'POST'])
 
 
+@csrf_exempt
+def artifacts_stat(request):
+    """
+    Return the metadata of a list of artifacts in one request.
+    The body is a JSON list of paths (or an object with a "paths" list).
+    Other requests are for the directory called "/stat".
+    """
+    if request.method != 'POST' or request.content_type != 'application/json':
+        return artifacts(request, 'stat/')
+
+    user = get_current_user(request,
+                            request.GET.get('token', None))
+    try:
+        paths = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if isinstance(paths, dict):
+        paths = paths.get('paths')
+    if not isinstance(paths, list) or \
+       not all([isinstance(p, type('')) for p in paths]) or \
+       len(paths) > getattr(settings, "ARTIFACTORIAL_STAT_MAX_PATHS", 1000):
+        return HttpResponseBadRequest()
+
+    # Check the visibility in the database, by chunks to keep the number of
+    # parameters low
+    names = sorted(set([p.lstrip('/') for p in paths]))
+    visible = Directory.objects.visible_to(user)
+    found = {}
+    for index in range(0, len(names), 500):
+        query = Artifact.objects.filter(path__in=names[index:index + 500],
+                                        directory__in=visible) \
+                                .select_related("directory")
+        for artifact in query.filter(is_missing=False):
+            found[artifact.path.name] = artifact
+
+    results = {}
+    for (name, artifact) in sorted(found.items()):
+        mime = mimetypes.guess_type(name)
+        ttl = artifact.directory.ttl
+        results["/" + name] = {
+            "size": artifact.size,
+            "content_type": mime[0] if mime[0] else 'text/plain',
+            "created_at": artifact.created_at,
+            "expires_at": None if artifact.is_permanent or ttl <= 0
+            else artifact.created_at + timedelta(days=ttl),
+            "is_permanent": artifact.is_permanent,
+            # Not hashed here for the older artifacts: the scrub command
+            # stores it
+            "md5": artifact.md5 or None}
+    return JsonResponse({"artifacts": results,
+                         "missing": sorted(["/" + n for n in names if n not in found])})
+
+
 def directories(request):
     user = get_current_user(request,
                             request.GET.get('token', ''))
-    dirs_query = Directory.objects.all().order_by("path") \
-                          .select_related("user", "group") \
-                          .prefetch_related("artifact_set")
 
-    dirs = [(d, d.is_writable_to(user)) for d in dirs_query if d.is_visible_to(user)]
+    formating = request.GET.get('format', 'html')
+    content_types = {'html': 'text/html',
+                     'json': 'application/json'}
+    if formating not in content_types:
+        return HttpResponseBadRequest()
+
+    # Filter and compute the usage in the database instead of loading every
+    # artifact
+    dirs_query = Directory.objects.visible_to(user).with_usage() \
+                          .order_by("path") \
+                          .select_related("user", "group")
+
+    # Only paginate when requested
+    page = None
+    if 'page' in request.GET or 'per_page' in request.GET:
+        try:
+            per_page = int(request.GET.get('per_page',
+                                           getattr(settings, "ARTIFACTORIAL_DIRECTORIES_PER_PAGE", 100)))
+        except ValueError:
+            return HttpResponseBadRequest()
+        if per_page <= 0:
+            return HttpResponseBadRequest()
+        paginator = Paginator(dirs_query, per_page)
+        try:
+            page = paginator.page(request.GET.get('page', 1))
+        except PageNotAnInteger:
+            return HttpResponseBadRequest()
+        except EmptyPage:
+            raise Http404
+        dirs_query = page.object_list
+
+    dirs = [(d, d.is_writable_to(user)) for d in dirs_query]
+    if formating == 'json':
+        data = {'directories': [{'path': d.path,
+                                 'user': d.user.username if d.user else None,
+                                 'group': d.group.name if d.group else None,
+                                 'is_public': d.is_public,
+                                 'writable': writable,
+                                 'ttl': d.ttl,
+                                 'quota': d.quota,
+                                 'size': d.total_size,
+                                 'progress': d.quota_progress(),
+                                 'artifacts': d.artifacts_count,
+                                 'last_upload': d.last_upload}
+                                for (d, writable) in dirs]}
+        if page is not None:
+            data.update({'page': page.number,
+                         'pages': page.paginator.num_pages,
+                         'count': page.paginator.count})
+        return JsonResponse(data)
+
     return render(request, 'Artifactorial/directories/index.html',
-                  {'directories': dirs})
+                  {'directories': dirs,
+                   'page': page,
+                   'token': request.GET.get('token', None)},
+                  content_type=content_types[formating])
+
+
+USAGE_COUNTERS = ["uploads", "uploaded_bytes", "deletes", "deleted_bytes",
+                  "expired", "expired_bytes"]
+
+
+def directories_usage(request):
+    """
+    Usage history of the visible directories, read from the rollup table
+    """
+    user = get_current_user(request,
+                            request.GET.get('token', ''))
+
+    resolution = request.GET.get('resolution', 'day')
+    if resolution not in ['hour', 'day']:
+        return HttpResponseBadRequest()
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    dirs = Directory.objects.visible_to(user)
+    if 'path' in request.GET:
+        dirs = dirs.filter(path=request.GET['path'])
+        if not dirs.exists():
+            raise Http404
+
+    since = DirectoryUsage.bucket() - timedelta(days=days)
+    rows = DirectoryUsage.objects.filter(directory__in=dirs, timestamp__gte=since) \
+                                 .order_by("directory__path", "timestamp") \
+                                 .values_list("directory__path", "timestamp",
+                                              "size", "artifacts", *USAGE_COUNTERS)
+
+    series = []
+    for row in rows:
+        (path, timestamp, size, count) = row[:4]
+        if resolution == 'day':
+            timestamp = timestamp.replace(hour=0)
+        if not series or series[-1]["path"] != path:
+            series.append({"path": path, "usage": []})
+        points = series[-1]["usage"]
+        if not points or points[-1]["timestamp"] != timestamp:
+            points.append(dict([("timestamp", timestamp), ("size", None), ("artifacts", None)] +
+                               [(c, 0) for c in USAGE_COUNTERS]))
+        point = points[-1]
+        for (counter, value) in zip(USAGE_COUNTERS, row[4:]):
+            point[counter] += value
+        # Keep the last snapshot of the period
+        if size is not None:
+            point["size"] = size
+            point["artifacts"] = count
+
+    return JsonResponse({"resolution": resolution, "directories": series})
+
+
+def _parse_date(value):
+    """
+    Parse a date or a datetime, raising ValueError when invalid
+    """
+    date = parse_datetime(value)
+    if date is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError("Invalid date '%s'" % value)
+        date = timezone.datetime(date.year, date.month, date.day)
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def search(request):
+    """
+    Search the artifacts by path with a glob, a substring or a regular
+    expression, optionally restricted to a prefix and a date range.
+    """
+    user = get_current_user(request,
+                            request.GET.get('token', ''))
+
+    kinds = [k for k in ['glob', 'substring', 'regex'] if k in request.GET]
+    if len(kinds) != 1 or not request.GET[kinds[0]]:
+        return HttpResponseBadRequest()
+    kind = kinds[0]
+    pattern = request.GET[kind]
+
+    try:
+        page = int(request.GET.get('page', 1))
+        per_page = int(request.GET.get('per_page',
+                                       getattr(settings, "ARTIFACTORIAL_SEARCH_PER_PAGE", 100)))
+        since = _parse_date(request.GET['since']) if 'since' in request.GET else None
+        until = _parse_date(request.GET['until']) if 'until' in request.GET else None
+    except ValueError:
+        return HttpResponseBadRequest()
+    if page < 1 or not 0 < per_page <= 1000:
+        return HttpResponseBadRequest()
+
+    # Check the visibility in the database
+    artifacts = Artifact.objects.filter(directory__in=Directory.objects.visible_to(user))
+    if request.GET.get('prefix'):
+        artifacts = artifacts.filter(path__startswith=request.GET['prefix'].lstrip('/'))
+    if since is not None:
+        artifacts = artifacts.filter(created_at__gte=since)
+    if until is not None:
+        artifacts = artifacts.filter(created_at__lt=until)
+    try:
+        artifacts = a_search.filter_queryset(artifacts, kind, pattern).order_by("path")
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    # Fetch one more artifact to know if there is a next page
+    offset = (page - 1) * per_page
+    rows = list(artifacts.values_list("path", "filename", "size", "created_at", "is_permanent")
+                         [offset:offset + per_page + 1])
+    results = [{"path": "/" + path,
+                "filename": filename or os.path.basename(path),
+                "url": request.build_absolute_uri(reverse("artifacts", args=[path])),
+                "size": size,
+                "created_at": created_at,
+                "is_permanent": is_permanent}
+               for (path, filename, size, created_at, is_permanent) in rows[:per_page]]
+    return JsonResponse({"results": results,
+                         "page": page,
+                         "next": len(rows) > per_page})
+
+
+def _last_change():
+    """
+    Last change older than ARTIFACTORIAL_CHANGES_SAFETY_WINDOW seconds: the
+    ids are allocated before the commit, so a transaction still running
+    might commit a lower id after a newer change is visible.
+    """
+    window = getattr(settings, "ARTIFACTORIAL_CHANGES_SAFETY_WINDOW", 2)
+    last = Change.objects.filter(timestamp__lte=timezone.now() - timedelta(seconds=window)) \
+                         .order_by("-id").values_list("id", flat=True).first()
+    return max(last or 0, Change.pruned())
+
+
+def _read_changes(request, user, since, prefix, limit):
+    """
+    Return the visible changes after "since" under "prefix", the next
+    cursor and whether some changes are left.
+    """
+    last = _last_change()
+    if last <= since:
+        return ([], since, False)
+    changes = Change.objects.filter(directory__in=Directory.objects.visible_to(user),
+                                    id__gt=since, id__lte=last)
+    if prefix:
+        changes = changes.filter(path__startswith=prefix.lstrip('/'))
+
+    rows = list(changes.order_by("id")
+                       .values_list("id", "event", "path", "size", "timestamp")[:limit + 1])
+    results = [{"cursor": id,
+                "event": event,
+                "path": "/" + path,
+                "url": request.build_absolute_uri(reverse("artifacts", args=[path])),
+                "size": size,
+                "timestamp": timestamp}
+               for (id, event, path, size, timestamp) in rows[:limit]]
+    # Skip the invisible changes when the page is not full
+    if len(rows) > limit:
+        cursor = rows[limit - 1][0]
+    else:
+        cursor = max([last, since] + [row[0] for row in rows[-1:]])
+    return (results, cursor, len(rows) > limit)
+
+
+class CursorTooOld(Exception):
+    pass
+
+
+def _parse_cursor(since):
+    """
+    Parse the cursor, raising ValueError when invalid and CursorTooOld when
+    the changes after the cursor were pruned (the client should list again).
+    """
+    if since == 'latest':
+        return _last_change()
+    since = int(since)
+    if since < 0:
+        raise ValueError("Invalid cursor '%d'" % since)
+    if since < Change.pruned():
+        raise CursorTooOld()
+    return since
+
+
+def changes(request):
+    """
+    Feed of the artifacts created, deleted and expired after the cursor
+    given in *since*, optionally restricted to a prefix.
+    *since=latest* only returns the current cursor.
+    """
+    user = get_current_user(request,
+                            request.GET.get('token', ''))
+
+    try:
+        # Without cursor, start from the oldest change
+        since = _parse_cursor(request.GET['since']) if 'since' in request.GET else Change.pruned()
+        limit = int(request.GET.get('limit',
+                                    getattr(settings, "ARTIFACTORIAL_CHANGES_LIMIT", 1000)))
+    except ValueError:
+        return HttpResponseBadRequest()
+    except CursorTooOld:
+        return HttpResponse(status=410)
+    if not 0 < limit <= 10000:
+        return HttpResponseBadRequest()
+    if request.GET.get('since') == 'latest':
+        return JsonResponse({"changes": [], "next": since, "more": False})
+
+    (results, cursor, more) = _read_changes(request, user, since,
+                                            request.GET.get('prefix'), limit)
+    return JsonResponse({"changes": results,
+                         "next": cursor,
+                         "more": more})
+
+
+def _watch_events(request, user, since, prefix, timeout):
+    """
+    Server-Sent Events: one event per change, the cursor being the event id
+    """
+    interval = getattr(settings, "ARTIFACTORIAL_WATCH_INTERVAL", 1)
+    heartbeat = getattr(settings, "ARTIFACTORIAL_WATCH_HEARTBEAT", 15)
+    deadline = time.time() + timeout
+    last_write = time.time()
+    yield "retry: %d\n\n" % (interval * 1000)
+    while True:
+        (results, since, _) = _read_changes(request, user, since, prefix, 1000)
+        for change in results:
+            yield "id: %d\nevent: %s\ndata: %s\n\n" % (change["cursor"], change["event"],
+                                                        json.dumps(change, cls=DjangoJSONEncoder))
+            last_write = time.time()
+        now = time.time()
+        if now >= deadline:
+            return
+        if now - last_write >= heartbeat:
+            yield ": heartbeat\n\n"
+            last_write = now
+        time.sleep(min(interval, deadline - now))
+
+
+def watch(request):
+    """
+    Wait for changes after the cursor, under an optional prefix.
+    The changes are sent as Server-Sent Events when requested with
+    "Accept: text/event-stream", otherwise the request is a long-poll
+    returning like the change feed as soon as a change is visible.
+    Without cursor, only the changes after the request are returned.
+    """
+    user = get_current_user(request,
+                            request.GET.get('token', ''))
+    prefix = request.GET.get('prefix')
+    max_timeout = getattr(settings, "ARTIFACTORIAL_WATCH_TIMEOUT", 60)
+    try:
+        since = _parse_cursor(request.GET.get('since',
+                                              request.META.get('HTTP_LAST_EVENT_ID', 'latest')))
+        timeout = min(float(request.GET.get('timeout', max_timeout)), max_timeout)
+    except ValueError:
+        return HttpResponseBadRequest()
+    except CursorTooOld:
+        return HttpResponse(status=410)
+
+    if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+        response = StreamingHttpResponse(_watch_events(request, user, since, prefix, timeout),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    interval = getattr(settings, "ARTIFACTORIAL_WATCH_INTERVAL", 1)
+    deadline = time.time() + timeout
+    while True:
+        (results, cursor, more) = _read_changes(request, user, since, prefix, 1000)
+        now = time.time()
+        if results or now >= deadline:
+            return JsonResponse({"changes": results,
+                                 "next": cursor,
+                                 "more": more})
+        since = cursor
+        time.sleep(min(interval, deadline - now))
+
+
+class _GrepLines(object):
+    """
+    Matching lines streamed in the response. The admission is released when
+    the response is closed, even if it was never iterated.
+    """
+    def __init__(self, admission, search, files):
+        self.admission = admission
+        self.lines = a_grep.stream(search, files,
+                                   getattr(settings, "ARTIFACTORIAL_GREP_WORKERS", 4))
+
+    def __iter__(self):
+        return self.lines
+
+    def close(self):
+        self.lines.close()
+        self.admission.close()
+
+
+def grep(request):
+    """
+    Search the lines matching a pattern in an artifact (*path*) or in every
+    artifact under a *prefix* (optionally filtered by a *glob*).
+    The pattern is a literal string unless *regex=1*. The matching lines are
+    streamed like "grep -n", with *context* lines around each match.
+    """
+    user = get_current_user(request,
+                            request.GET.get('token', ''))
+    pattern = request.GET.get('pattern', '')
+    max_matches = getattr(settings, "ARTIFACTORIAL_GREP_MAX_MATCHES", 1000)
+    max_timeout = getattr(settings, "ARTIFACTORIAL_GREP_TIMEOUT", 30)
+    try:
+        context = int(request.GET.get('context', 0))
+        limit = min(int(request.GET.get('limit', max_matches)), max_matches)
+        timeout = min(float(request.GET.get('timeout', max_timeout)), max_timeout)
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not pattern or not 0 <= context <= 100 or limit <= 0 or timeout <= 0:
+        return HttpResponseBadRequest()
+
+    flags = re.MULTILINE
+    if request.GET.get('ignore_case') in ['1', 'true']:
+        flags |= re.IGNORECASE
+    if request.GET.get('regex') not in ['1', 'true']:
+        pattern = re.escape(pattern)
+    pattern = pattern.encode('utf-8')
+    try:
+        re.compile(pattern, flags)
+    except re.error:
+        return HttpResponseBadRequest("Invalid regular expression")
+
+    if 'path' in request.GET:
+        artifact = get_object_or_404(Artifact, path=request.GET['path'].lstrip('/'),
+                                     is_missing=False)
+        if not artifact.is_visible_to(user):
+            return HttpResponseForbidden()
+        artifacts = [artifact]
+        directory = artifact.directory
+        scopes = ("TOKEN", "DIRECTORY")
+    elif 'prefix' in request.GET:
+        prefix = request.GET['prefix'].lstrip('/')
+        query = Artifact.objects.filter(path__startswith=prefix, is_missing=False,
+                                        directory__in=Directory.objects.visible_to(user))
+        if request.GET.get('glob'):
+            try:
+                query = a_search.filter_queryset(query, 'glob', prefix + request.GET['glob'])
+            except ValueError:
+                return HttpResponseBadRequest("Invalid glob")
+        max_files = getattr(settings, "ARTIFACTORIAL_GREP_MAX_FILES", 1000)
+        artifacts = list(query.only("path", "root").order_by("path")[:max_files + 1])
+        if len(artifacts) > max_files:
+            return HttpResponseBadRequest("Too many artifacts")
+        # The files can be in many directories
+        directory = None
+        scopes = ("TOKEN",)
+    else:
+        return HttpResponseBadRequest()
+
+    # The files are read like a download
+    try:
+        admission = throttling.admit(request, directory, "downloads", scopes=scopes)
+    except throttling.Throttled as exc:
+        return _too_many_requests(exc)
+    # Each search starts its own pool of worker processes
+    slot = throttling.acquire("grep", getattr(settings, "ARTIFACTORIAL_GREP_MAX_SEARCHES", 4))
+    if slot is None:
+        admission.close()
+        return _too_many_requests(throttling.Throttled(
+            getattr(settings, "ARTIFACTORIAL_THROTTLE_RETRY_AFTER", 5)))
+    admission.slots.append(slot)
+    search = a_grep.Search(pattern, flags, context, limit, timeout, admission.buckets)
+    files = [("/" + a.path.name, a.path.path) for a in artifacts]
+    response = StreamingHttpResponse(_GrepLines(admission, search, files),
+                                     content_type='text/plain; charset=utf-8')
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @csrf_exempt
@@ -300,16 +1099,7 @@ def shares_root(request):
 def shares(request, token):
     if request.method == 'GET':
         share = get_object_or_404(Share, token=token)
-        artifact = share.artifact
-
-        # Guess the mimetype
-        mime = mimetypes.guess_type(artifact.path.name)
-        response = FileResponse(open(artifact.path.path, 'rb'),
-                                content_type=mime[0] if mime[0]
-                                else 'text/plain')
-
-        response['Content-Length'] = artifact.path.size
-        return response
+        return _serve(request, share.artifact)
 
     elif request.method == 'DELETE':
         # Get the current user
@@ -330,6 +1120,33 @@ def shares(request, token):
         return HttpResponseNotAllowed(['DELETE', 'PUT'])
 
 
+def _metrics_allowed(request):
+    """
+    The metrics are only exported to the staff, to the addresses listed in
+    ARTIFACTORIAL_METRICS_ALLOWED_IPS and with the bearer token
+    ARTIFACTORIAL_METRICS_TOKEN
+    """
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, "ARTIFACTORIAL_METRICS_ALLOWED_IPS", []):
+        return True
+    token = getattr(settings, "ARTIFACTORIAL_METRICS_TOKEN", None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and authorization.startswith('Bearer '):
+        return hmac.compare_digest(authorization[len('Bearer '):].encode('utf-8'),
+                                   token.encode('utf-8'))
+    return False
+
+
+def metrics(request):
+    if a_metrics.prometheus_client is None:
+        raise Http404
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(a_metrics.generate(),
+                        content_type=a_metrics.prometheus_client.CONTENT_TYPE_LATEST)
+
+
 @login_required
 def tokens(request):
     if request.method == 'POST':
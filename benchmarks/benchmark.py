@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Benchmarks for the listing, upload, download, HEAD and clean code paths.
+
+Run from the root of the repository:
+
+    python benchmarks/benchmark.py --sizes 1000,100000 --output HEAD.json
+    python benchmarks/benchmark.py --compare base.json HEAD.json
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.test_settings")
+
+
+def setup(media_root):
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    setup_test_environment()
+    # Do not record every SQL query
+    settings.DEBUG = False
+    settings.MEDIA_ROOT = media_root
+    # The cached listings are measured separately
+    settings.ARTIFACTORIAL_LISTING_CACHE_TIMEOUT = 0
+    call_command("migrate", verbosity=0, interactive=False)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def summary(durations, **extra):
+    result = {"min": min(durations),
+              "median": percentile(durations, 50),
+              "p95": percentile(durations, 95),
+              "runs": len(durations)}
+    result.update(extra)
+    return result
+
+
+def timed(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def create_directory(path, count, file_size=0):
+    """
+    Create a public directory with "count" artifacts of "file_size" bytes.
+    """
+    from django.conf import settings
+    from Artifactorial.models import Artifact, Directory
+
+    directory = Directory.objects.create(path=path, is_public=True,
+                                         quota=2 ** 62)
+    root = os.path.join(settings.MEDIA_ROOT, path.lstrip("/"))
+    os.makedirs(root)
+    batch = []
+    for index in range(count):
+        name = "file-%08d.txt" % index
+        with open(os.path.join(root, name), "wb") as f_out:
+            if file_size:
+                f_out.truncate(file_size)
+        batch.append(Artifact(path="%s/%s" % (path.lstrip("/"), name),
+                              directory=directory, size=file_size))
+        if len(batch) == 5000:
+            Artifact.objects.bulk_create(batch)
+            batch = []
+    Artifact.objects.bulk_create(batch)
+    return directory
+
+
+def bench_listing(client, count, repeat, cache_timeout=0):
+    """
+    Measure the listing of "count" artifacts, rendered every time or (with
+    a cache_timeout) served from the listing cache after the first run.
+    """
+    from django.conf import settings
+    from django.urls import reverse
+
+    path = "listing/%s%d" % ("cached/" if cache_timeout else "", count)
+    create_directory("/" + path, count)
+    url = "%s?format=json" % reverse("artifacts", args=[path + "/"])
+
+    def run():
+        response = client.get(url)
+        assert response.status_code == 200
+
+    settings.ARTIFACTORIAL_LISTING_CACHE_TIMEOUT = cache_timeout
+    try:
+        if cache_timeout:
+            run()
+        durations = timed(run, repeat)
+        tracemalloc.start()
+        run()
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        settings.ARTIFACTORIAL_LISTING_CACHE_TIMEOUT = 0
+    return summary(durations, entries=count, peak_memory=peak)
+
+
+def bench_upload(client, file_size, repeat, tmpdir):
+    from django.urls import reverse
+    from Artifactorial.models import Directory
+
+    Directory.objects.create(path="/upload", quota=2 ** 62)
+    filename = os.path.join(tmpdir, "upload.bin")
+    with open(filename, "wb") as f_out:
+        f_out.write(os.urandom(file_size))
+
+    def run():
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["upload"]),
+                                   data={"path": f_in})
+        assert response.status_code == 200
+
+    durations = timed(run, repeat)
+    return summary(durations, bytes=file_size,
+                   throughput=file_size / percentile(durations, 50))
+
+
+def bench_head(client, file_size, repeat):
+    from django.urls import reverse
+
+    create_directory("/head", 1, file_size)
+    url = reverse("artifacts", args=["head/file-00000000.txt"])
+
+    def run():
+        response = client.head(url)
+        assert response.status_code == 200
+
+    return summary(timed(run, repeat), bytes=file_size)
+
+
+def bench_share(client, file_size, repeat):
+    from django.contrib.auth.models import User
+    from django.urls import reverse
+    from Artifactorial.models import Artifact, Share
+
+    create_directory("/share", 1, file_size)
+    user = User.objects.create_user("benchmark")
+    share = Share.objects.create(user=user,
+                                 artifact=Artifact.objects.get(path="share/file-00000000.txt"))
+    url = reverse("shares", args=[share.token])
+
+    def run():
+        response = client.get(url)
+        assert response.status_code == 200
+        for _ in response.streaming_content:
+            pass
+
+    durations = timed(run, repeat)
+    return summary(durations, bytes=file_size,
+                   throughput=file_size / percentile(durations, 50))
+
+
+def bench_clean(count):
+    from datetime import timedelta
+    from django.core.management import call_command
+    from django.utils import timezone
+    from Artifactorial.models import Artifact
+
+    directory = create_directory("/clean/%d" % count, count)
+    directory.ttl = 1
+    directory.save()
+    Artifact.objects.filter(directory=directory).update(created_at=timezone.now() - timedelta(days=2))
+
+    with open(os.devnull, "w") as devnull:
+        start = time.perf_counter()
+        call_command("clean", stdout=devnull)
+        duration = time.perf_counter() - start
+    assert not Artifact.objects.filter(directory=directory).exists()
+    return {"min": duration, "median": duration, "p95": duration, "runs": 1,
+            "entries": count}
+
+
+def run(options):
+    tmpdir = tempfile.mkdtemp(prefix="artifactorial-bench-")
+    setup(os.path.join(tmpdir, "media"))
+    from django.test import Client
+
+    client = Client()
+    results = {}
+    for count in options.sizes:
+        results["listing.%d" % count] = bench_listing(client, count, options.repeat)
+        results["listing.cached.%d" % count] = bench_listing(client, count, options.repeat,
+                                                             cache_timeout=300)
+    results["upload"] = bench_upload(client, options.file_size, options.repeat, tmpdir)
+    results["head"] = bench_head(client, options.large_size, options.repeat)
+    results["share"] = bench_share(client, options.large_size, options.repeat)
+    for count in options.sizes:
+        results["clean.%d" % count] = bench_clean(count)
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"]).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results}
+
+
+def compare(base, head):
+    with open(base) as f_in:
+        base = json.load(f_in)
+    with open(head) as f_in:
+        head = json.load(f_in)
+    print("%-20s %12s %12s %8s" % ("benchmark", "base", "head", "ratio"))
+    for name in sorted(head["results"]):
+        if name not in base["results"]:
+            continue
+        old = base["results"][name]["median"]
+        new = head["results"][name]["median"]
+        print("%-20s %11.4fs %11.4fs %7.2fx" % (name, old, new, new / old if old else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Artifactorial benchmarks")
+    parser.add_argument("--sizes", default="1000",
+                        type=lambda s: [int(v) for v in s.split(",")],
+                        help="Number of artifacts in the directories (comma separated)")
+    parser.add_argument("--repeat", default=5, type=int,
+                        help="Number of runs for each benchmark")
+    parser.add_argument("--file-size", default=16 * 1024 * 1024, type=int,
+                        help="Size of the uploaded file")
+    parser.add_argument("--large-size", default=256 * 1024 * 1024, type=int,
+                        help="Size of the file for HEAD and shares")
+    parser.add_argument("--output", default=None,
+                        help="Write the results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                        help="Compare two result files")
+    options = parser.parse_args()
+
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    results = json.dumps(run(options), indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f_out:
+            f_out.write(results)
+    else:
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
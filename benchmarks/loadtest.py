@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+
+# Copyright 2026 Rémi Duraffort
+# This file is part of Artifactorial.
+#
+# Artifactorial is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Artifactorial is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Artifactorial.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Drive a local Artifactorial server with a mix of concurrent requests and
+report the throughput and the latency percentiles of each operation.
+
+    python manage.py runserver 8000  # or gunicorn
+    python benchmarks/loadtest.py --url http://localhost:8000 \\
+        --directory /pub --threads 32 --duration 60 \\
+        --mix upload=2,list=5,download=10,head=3,share=1,delete=1
+"""
+
+import argparse
+import binascii
+import json
+import os
+import random
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+
+OPERATIONS = ["upload", "list", "download", "head", "share", "delete"]
+# Operations on an uploaded artifact
+ON_ARTIFACT = ["download", "head", "share", "delete"]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        (name, weight) = item.split("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError("Unknown operation '%s'" % name)
+        mix[name] = int(weight)
+    return mix
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class LoadTest(object):
+    def __init__(self, options):
+        self.options = options
+        self.base = options.url.rstrip("/")
+        self.directory = options.directory.strip("/")
+        self.lock = threading.Lock()
+        # Artifacts uploaded by the load test (relative urls)
+        self.artifacts = []
+        self.latencies = dict([(op, []) for op in OPERATIONS])
+        self.errors = dict([(op, 0) for op in OPERATIONS])
+        # Artifacts deleted by another thread meanwhile
+        self.not_found = dict([(op, 0) for op in OPERATIONS])
+        self.payload = os.urandom(options.file_size)
+
+    def request(self, method, path, data=None, headers=None, params=None):
+        params = dict(params or {})
+        if self.options.token and method != "POST":
+            params["token"] = self.options.token
+        url = self.base + path
+        if params:
+            url += "?" + urlencode(params)
+        req = Request(url, data=data, headers=headers or {}, method=method)
+        with urlopen(req, timeout=self.options.timeout) as response:
+            # Always read the full body to measure the complete transfer
+            while response.read(1024 * 1024):
+                pass
+            return response
+
+    def pick(self, remove=False):
+        with self.lock:
+            if not self.artifacts:
+                return None
+            index = random.randrange(len(self.artifacts))
+            if remove:
+                return self.artifacts.pop(index)
+            return self.artifacts[index]
+
+    def upload(self):
+        boundary = binascii.b2a_hex(os.urandom(16)).decode("utf-8")
+        name = "load-%s.bin" % binascii.b2a_hex(os.urandom(8)).decode("utf-8")
+        fields = b""
+        if self.options.token:
+            fields = ("--%s\r\nContent-Disposition: form-data; name=\"token\"\r\n\r\n%s\r\n"
+                      % (boundary, self.options.token)).encode("utf-8")
+        body = fields + \
+            ("--%s\r\nContent-Disposition: form-data; name=\"path\"; filename=\"%s\"\r\n"
+             "Content-Type: application/octet-stream\r\n\r\n" % (boundary, name)).encode("utf-8") + \
+            self.payload + ("\r\n--%s--\r\n" % boundary).encode("utf-8")
+        url = self.base + "/artifacts/%s/" % self.directory
+        req = Request(url, data=body, method="POST",
+                      headers={"Content-Type": "multipart/form-data; boundary=%s" % boundary})
+        with urlopen(req, timeout=self.options.timeout) as response:
+            location = response.read().decode("utf-8").strip()
+        with self.lock:
+            self.artifacts.append(urlsplit(location).path)
+
+    def list(self):
+        self.request("GET", "/artifacts/%s/" % self.directory, params={"format": "json"})
+
+    def download(self, path):
+        self.request("GET", path)
+
+    def head(self, path):
+        self.request("HEAD", path)
+
+    def share(self, path):
+        data = {"path": path[len("/artifacts/"):]}
+        if self.options.token:
+            data["token"] = self.options.token
+        req = Request(self.base + "/shares/", data=urlencode(data).encode("utf-8"),
+                      method="PUT")
+        with urlopen(req, timeout=self.options.timeout) as response:
+            response.read()
+
+    def delete(self, path):
+        self.request("DELETE", path)
+
+    def worker(self, deadline, operations, weights):
+        rnd = random.Random()
+        while time.time() < deadline:
+            operation = rnd.choices(operations, weights)[0]
+            args = []
+            if operation in ON_ARTIFACT:
+                path = self.pick(remove=operation == "delete")
+                if path is None:
+                    # Nothing to work on: upload (and record it as such)
+                    operation = "upload"
+                else:
+                    args = [path]
+            start = time.perf_counter()
+            try:
+                getattr(self, operation)(*args)
+            except HTTPError as exc:
+                with self.lock:
+                    # The artifact was deleted by another thread
+                    if exc.code == 404 and args:
+                        self.not_found[operation] += 1
+                    else:
+                        self.errors[operation] += 1
+                continue
+            except OSError:
+                with self.lock:
+                    self.errors[operation] += 1
+                continue
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.latencies[operation].append(duration)
+
+    def run(self):
+        for _ in range(self.options.warmup):
+            self.upload()
+
+        mix = self.options.mix
+        operations = sorted(mix)
+        weights = [mix[op] for op in operations]
+        start = time.time()
+        deadline = start + self.options.duration
+        threads = [threading.Thread(target=self.worker, args=(deadline, operations, weights))
+                   for _ in range(self.options.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        results = {}
+        for op in OPERATIONS:
+            latencies = self.latencies[op]
+            if not latencies and not self.errors[op] and not self.not_found[op]:
+                continue
+            results[op] = {"requests": len(latencies),
+                           "errors": self.errors[op],
+                           "not_found": self.not_found[op],
+                           "throughput": len(latencies) / elapsed}
+            if latencies:
+                results[op].update({"p50": percentile(latencies, 50),
+                                    "p95": percentile(latencies, 95),
+                                    "p99": percentile(latencies, 99)})
+        return {"duration": elapsed, "threads": self.options.threads,
+                "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Artifactorial load test")
+    parser.add_argument("--url", default="http://localhost:8000",
+                        help="Root url of the server")
+    parser.add_argument("--directory", default="/pub",
+                        help="Directory where to upload (should be writable)")
+    parser.add_argument("--token", default=None,
+                        help="Token used for every request")
+    parser.add_argument("--threads", default=16, type=int,
+                        help="Number of concurrent clients")
+    parser.add_argument("--duration", default=30, type=int,
+                        help="Duration of the test (in seconds)")
+    parser.add_argument("--mix", default="upload=2,list=5,download=10,head=3,share=1,delete=1",
+                        type=parse_mix, help="Weight of each operation")
+    parser.add_argument("--file-size", default=1024 * 1024, type=int,
+                        help="Size of the uploaded files")
+    parser.add_argument("--warmup", default=20, type=int,
+                        help="Number of files uploaded before starting")
+    parser.add_argument("--timeout", default=60, type=int,
+                        help="Timeout of each request (in seconds)")
+    parser.add_argument("--output", default=None,
+                        help="Write the results in JSON to this file")
+    options = parser.parse_args()
+
+    results = LoadTest(options).run()
+    print("%-10s %9s %7s %7s %9s %9s %9s %9s" % ("operation", "requests", "errors", "404",
+                                                 "req/s", "p50", "p95", "p99"))
+    for (op, res) in sorted(results["results"].items()):
+        if res["requests"]:
+            print("%-10s %9d %7d %7d %9.1f %8.1fms %8.1fms %8.1fms"
+                  % (op, res["requests"], res["errors"], res["not_found"], res["throughput"],
+                     res["p50"] * 1000, res["p95"] * 1000, res["p99"] * 1000))
+        else:
+            print("%-10s %9d %7d %7d" % (op, 0, res["errors"], res["not_found"]))
+    if options.output:
+        with open(options.output, "w") as f_out:
+            json.dump(results, f_out, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()